@@ -0,0 +1,132 @@
+"""Benchmark of the build backends handing the Docker images of the job scripts over to Apptainer.
+
+Each backend builds the given job scripts from scratch, without the build cache nor the shared
+layers, while the used space of the filesystems holding the given paths is sampled. The wall time
+and the peak disk use above the starting point are reported for each backend. Unlike the offline
+orchestration benchmark, it needs Docker, with a buildx builder able to export OCI archives, and
+Apptainer. Run it from the root of the repository with:
+
+    poetry run python benchmarks/build_backends.py hpl-benchmark --disk-path /var/lib/docker
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+BACKENDS = ["docker-daemon", "oci-archive"]
+
+
+class DiskSampler(threading.Thread):
+    """Background sampler of the peak used space of a set of filesystems."""
+
+    def __init__(self, paths: list[Path], interval: float):  # noqa: D107
+        super().__init__(daemon=True)
+        # paths on the same filesystem would be counted twice
+        devices = {}
+        for path in paths:
+            devices.setdefault(os.stat(path).st_dev, path)
+        self.paths = list(devices.values())
+        self.interval = interval
+        self.baseline = self.used()
+        self.peak = self.baseline
+        self._stop_event = threading.Event()
+
+    def used(self) -> int:
+        """Return the used space of the filesystems, in bytes."""
+        return sum(shutil.disk_usage(path).used for path in self.paths)
+
+    def run(self):
+        """Sample the used space until stopped."""
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, self.used())
+
+    def stop(self) -> int:
+        """Stop sampling and return the peak used space above the baseline, in bytes."""
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, self.used())
+        return self.peak - self.baseline
+
+
+def run_backend(
+    backend: str, job_scripts: list[str], disk_paths: list[Path], interval: float
+) -> dict[str, float]:
+    """Build the job scripts with a backend, returning the wall time and the peak disk use."""
+    for job_script in job_scripts:
+        # start every run from a daemon without the images of the job scripts
+        subprocess.run(
+            ["docker", "image", "rm", "-f", f"{Path(job_script).name}:latest"], capture_output=True
+        )
+    sampler = DiskSampler(disk_paths, interval)
+    sampler.start()
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from builder.main import app; app()",
+            "apptainer",
+            "build",
+            "--no-cache",
+            "--no-share-layers",
+            f"--backend={backend}",
+            "--jobs=1",
+            *job_scripts,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    peak_disk = sampler.stop()
+    if proc.returncode != 0:
+        raise RuntimeError(f"Building with the {backend} backend failed:\n{proc.stdout}\n{proc.stderr}")
+    return {"wall": wall, "peak_disk_mib": peak_disk / 1024**2}
+
+
+def main() -> int:
+    """Run the benchmark, returning the exit code."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("job_scripts", nargs="+", help="Paths of the job scripts to build")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends to compare")
+    parser.add_argument(
+        "--runs", type=int, default=1, help="Number of runs per backend, the fastest one is kept"
+    )
+    parser.add_argument(
+        "--disk-path",
+        type=Path,
+        action="append",
+        help="Path on a filesystem whose used space is sampled, such as the Docker data root. "
+        "May be repeated. Defaults to the current directory.",
+    )
+    parser.add_argument("--interval", type=float, default=0.2, help="Seconds between disk samples")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file")
+    options = parser.parse_args()
+
+    disk_paths = options.disk_path or [Path(".")]
+    results = {}
+    for backend in options.backends.split(","):
+        runs = [
+            run_backend(backend, options.job_scripts, disk_paths, options.interval)
+            for _ in range(options.runs)
+        ]
+        results[backend] = min(runs, key=lambda run: run["wall"])
+        print(
+            f"{backend:<14} wall {results[backend]['wall']:>8.1f}s  "
+            f"peak disk {results[backend]['peak_disk_mib']:>9.1f} MiB"
+        )
+
+    if options.output is not None:
+        options.output.write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
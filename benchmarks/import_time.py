@@ -0,0 +1,135 @@
+"""Import-time regression check for the lightweight commands of the builder CLI.
+
+The check fails if importing the CLI entrypoint or running any of the lightweight commands takes
+longer than the budget, if any of these commands exits with an error, or if any of the heavy
+dependencies, which must only be imported by the commands that need them, is imported at start
+up. Run it from the root of the repository with:
+
+    poetry run python benchmarks/import_time.py --budget-ms 600
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# modules that must not be imported by `builder --help` and the settings commands
+HEAVY_MODULES = [
+    "boto3",
+    "botocore",
+    "s3transfer",
+    "docker",
+    "yaml",
+    "mypy_boto3_s3",
+    "mypy_boto3_ecr_public",
+    "urllib.request",
+]
+
+# lightweight commands whose cold start is timed
+LIGHTWEIGHT_COMMANDS = [
+    ["--help"],
+    ["settings", "--help"],
+    ["apptainer", "build", "--help"],
+]
+
+ENTRYPOINT = "builder.main"
+
+
+def measure_import_time(module: str) -> float:
+    """Return the cumulative import time of a module, in milliseconds, as reported by -X importtime."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in proc.stderr.splitlines():
+        (_, cumulative, name) = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1000
+    raise RuntimeError(f"Import time of {module} not found in the -X importtime report")
+
+
+def find_heavy_modules(module: str) -> list[str]:
+    """Return the heavy modules imported as a side effect of importing the given module."""
+    proc = subprocess.run(
+        [sys.executable, "-c", f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = set(json.loads(proc.stdout))
+    return [name for name in HEAVY_MODULES if name in imported]
+
+
+def measure_command_time(args: list[str]) -> tuple[float, subprocess.CompletedProcess]:
+    """Return the wall time, in milliseconds, of running the CLI with the given arguments, and its process."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", f"from {ENTRYPOINT} import app; app()", *args],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return ((time.perf_counter() - start) * 1000, proc)
+
+
+def summarize_error(output: str) -> str:
+    """Return the last lines of an error output, usually the exception ending a traceback, as one line."""
+    lines = output.strip().splitlines()
+    # the frames of plain tracebacks are indented, and the ones of rich tracebacks are boxed
+    tail = []
+    while lines and lines[-1] and lines[-1][0] not in " \t│╰":
+        tail.insert(0, lines.pop().strip())
+    if tail:
+        return " ".join(tail)
+    # otherwise the error is the last line with some text, such as the one of a usage error panel
+    texts = [text for line in lines if (text := line.strip(" \t│╭╮╰╯─"))]
+    return texts[-1] if texts else "no output"
+
+
+def main() -> int:
+    """Run the import-time check, returning the exit code."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=600.0,
+        help="Maximum import time of the CLI entrypoint and wall time of each lightweight command",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs, the fastest one is kept")
+    options = parser.parse_args()
+
+    failures = []
+
+    heavy_modules = find_heavy_modules(ENTRYPOINT)
+    if heavy_modules:
+        failures.append(f"{ENTRYPOINT} eagerly imports heavy modules: {', '.join(heavy_modules)}")
+
+    import_time = min(measure_import_time(ENTRYPOINT) for _ in range(options.runs))
+    print(f"import {ENTRYPOINT}: {import_time:.1f}ms (budget {options.budget_ms:.1f}ms)")
+    if import_time > options.budget_ms:
+        failures.append(f"Importing {ENTRYPOINT} takes {import_time:.1f}ms, above the budget")
+
+    for args in LIGHTWEIGHT_COMMANDS:
+        command = f"builder {' '.join(args)}"
+        runs = [measure_command_time(args) for _ in range(options.runs)]
+        command_time = min(duration for (duration, _) in runs)
+        print(f"{command}: {command_time:.1f}ms (budget {options.budget_ms:.1f}ms)")
+        failed = next((proc for (_, proc) in runs if proc.returncode != 0), None)
+        if failed is not None:
+            error = summarize_error(failed.stderr or failed.stdout)
+            failures.append(f"{command} exits with code {failed.returncode}: {error}")
+        elif command_time > options.budget_ms:
+            failures.append(f"{command} takes {command_time:.1f}ms, above the budget")
+
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,485 @@
+"""Offline benchmark of the orchestration overhead of the builder CLI.
+
+Synthetic catalogs of job scripts are generated in a temporary directory, and the commands of the
+CLI run against them with Docker, Apptainer, S3, ECR Public and the OCI registry replaced by local
+stand-ins, so no network access is needed:
+
+- the Docker SDK client is replaced by an in-process fake that consumes the build context;
+- `apptainer` is a stub script put first in the PATH, which writes random .sif files and pushes
+  their manifest to the fake registry;
+- boto3 sessions hand out in-process fakes of the S3 and ECR Public clients;
+- the OCI registry is a local HTTP server implementing the manifest endpoints.
+
+The staged commands run first, followed by the streaming pipeline on a copy of the catalog with new
+contents, whose wall time can be compared with the sum of the cold stages.
+
+Every stand-in counts the calls it receives. For each catalog size, the wall time, the peak RSS and
+the call counts of each scenario are reported. Each catalog size runs in its own process, so the
+peak RSS of a scenario is the high-water mark of its process up to the end of the scenario. Run it
+from the root of the repository with:
+
+    poetry run python benchmarks/orchestration.py --sizes 10,100,1000 --output bench.json
+
+Pass the results of a previous run with --baseline to fail when a scenario becomes slower than the
+tolerance allows, or issues more calls than before.
+"""
+
+import argparse
+import base64
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Iterator
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# stand-in of the apptainer binary, the calls are appended to the file named by BENCH_CALLS_LOG
+APPTAINER_STUB = """\
+import os, sys, time
+
+with open(os.environ["BENCH_CALLS_LOG"], "a") as log:
+    log.write(f"apptainer.{sys.argv[1]}\\n")
+time.sleep(float(os.environ["BENCH_TOOL_LATENCY"]))
+if sys.argv[1] == "build":
+    with open(sys.argv[2], "wb") as image:
+        image.write(os.urandom(int(os.environ["BENCH_SIF_SIZE"])))
+elif sys.argv[1] == "push":
+    import hashlib, json, urllib.request
+
+    # the stand-in registry is served over plain HTTP, which the real apptainer only pushes to with this flag
+    if "--no-https" not in sys.argv:
+        sys.exit("apptainer push needs --no-https for a plain HTTP registry")
+    (image_path, url) = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    with open(image_path, "rb") as image:
+        digest = hashlib.sha256(image.read()).hexdigest()
+    (reference, _, tag) = url.removeprefix("oras://").rpartition(":")
+    (domain, _, repository) = reference.partition("/")
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": "application/vnd.oci.image.manifest.v1+json",
+        "layers": [{"digest": f"sha256:{digest}", "size": os.path.getsize(image_path)}],
+    }
+    request = urllib.request.Request(
+        f"http://{domain}/v2/{repository}/manifests/{tag}",
+        data=json.dumps(manifest).encode(),
+        method="PUT",
+        headers={"Content-Type": manifest["mediaType"]},
+    )
+    urllib.request.urlopen(request).close()
+"""
+
+DOCKERFILE = """\
+FROM ubuntu:22.04
+RUN apt-get update && apt-get install -y --no-install-recommends openmpi-bin
+COPY input.dat /opt/input.dat
+"""
+
+
+class Calls:
+    """Thread safe counter of the calls received by the stand-ins."""
+
+    def __init__(self, calls_log: Path):  # noqa: D107
+        self._lock = threading.Lock()
+        self._counter: Counter[str] = Counter()
+        self.calls_log = calls_log
+
+    def add(self, name: str):
+        """Count a call."""
+        with self._lock:
+            self._counter[name] += 1
+
+    def snapshot(self) -> Counter[str]:
+        """Return the calls counted so far, including the ones of the stub binaries."""
+        with self._lock:
+            counter = Counter(self._counter)
+        if self.calls_log.exists():
+            counter.update(self.calls_log.read_text().split())
+        return counter
+
+
+class FakeClientError(Exception):
+    """Error raised by the fake AWS clients, shaped like botocore's ClientError."""
+
+    def __init__(self, code: str):  # noqa: D107
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3:
+    """In-process stand-in of the S3 client."""
+
+    def __init__(self, calls: Calls):  # noqa: D107
+        self.calls = calls
+        self.objects: dict[tuple[str, str], dict[str, Any]] = {}
+        self.exceptions = type("exceptions", (), {"ClientError": FakeClientError})
+
+    def head_object(self, Bucket: str, Key: str) -> dict[str, Any]:  # noqa: N803
+        """Return the metadata of an uploaded object."""
+        self.calls.add("s3.head_object")
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError("404")
+        return self.objects[(Bucket, Key)]
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, ExtraArgs=None, Config=None, Callback=None):  # noqa: N803
+        """Record the upload of a file, reporting its size to the callback."""
+        self.calls.add("s3.upload_file")
+        content = Path(Filename).read_bytes()
+        self.objects[(Bucket, Key)] = {
+            "Metadata": (ExtraArgs or {}).get("Metadata", {}),
+            "ETag": f'"{hashlib.md5(content).hexdigest()}"',
+        }
+        if Callback is not None:
+            Callback(len(content))
+
+
+class RepositoryNotFoundException(Exception):  # noqa: N818
+    """Error raised by the fake ECR Public client for unknown repositories."""
+
+
+class FakeEcrPublic:
+    """In-process stand-in of the ECR Public client, pointing at the fake registry."""
+
+    def __init__(self, calls: Calls, registry_uri: str):  # noqa: D107
+        self.calls = calls
+        self.registry_uri = registry_uri
+        self.repositories: set[str] = set()
+        self.exceptions = type("exceptions", (), {"RepositoryNotFoundException": RepositoryNotFoundException})
+
+    def get_authorization_token(self) -> dict[str, Any]:
+        """Return a token valid for twelve hours."""
+        self.calls.add("ecr.get_authorization_token")
+        return {
+            "authorizationData": {
+                "authorizationToken": base64.b64encode(b"AWS:password").decode(),
+                "expiresAt": datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(hours=12),
+            }
+        }
+
+    def describe_registries(self) -> dict[str, Any]:
+        """Return the fake registry as the only registry."""
+        self.calls.add("ecr.describe_registries")
+        return {"registries": [{"registryId": "000000000000", "registryUri": self.registry_uri}]}
+
+    def get_repository_catalog_data(self, registryId: str, repositoryName: str):  # noqa: N803
+        """Fail for repositories that were not created."""
+        self.calls.add("ecr.get_repository_catalog_data")
+        if repositoryName not in self.repositories:
+            raise RepositoryNotFoundException(repositoryName)
+
+    def create_repository(self, repositoryName: str):  # noqa: N803
+        """Create a repository."""
+        self.calls.add("ecr.create_repository")
+        self.repositories.add(repositoryName)
+
+
+class FakeDocker:
+    """In-process stand-in of the Docker SDK client, which only consumes the build context."""
+
+    def __init__(self, calls: Calls, latency: float):  # noqa: D107
+        self.calls = calls
+        self.latency = latency
+        self.images = self
+
+    def build(self, fileobj=None, **kwargs):
+        """Consume the build context."""
+        self.calls.add("docker.build")
+        if fileobj is not None:
+            fileobj.read()
+        time.sleep(self.latency)
+        return (None, [])
+
+    def pull(self, repository: str, **kwargs):
+        """Pretend to pull an image."""
+        self.calls.add("docker.pull")
+
+
+def start_registry(calls: Calls) -> ThreadingHTTPServer:
+    """Start a local OCI registry implementing the manifest endpoints, in a background thread."""
+    manifests: dict[str, tuple[bytes, str]] = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            calls.add("registry.get_manifest")
+            with lock:
+                manifest = manifests.get(self.path)
+            if manifest is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            (content, media_type) = manifest
+            self.send_response(200)
+            self.send_header("Content-Type", media_type)
+            self.send_header("Docker-Content-Digest", f"sha256:{hashlib.sha256(content).hexdigest()}")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_PUT(self):  # noqa: N802
+            calls.add("registry.put_manifest")
+            content = self.rfile.read(int(self.headers["Content-Length"]))
+            with lock:
+                manifests[self.path] = (content, self.headers["Content-Type"])
+            self.send_response(201)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate_catalog(path: Path, size: int):
+    """Generate a catalog of job scripts, each with its metadata, README, Dockerfile and files."""
+    for index in range(size):
+        job_script_path = path / f"job-script-{index:04d}"
+        job_script_path.mkdir(parents=True)
+        job_script_path.joinpath("metadata.yaml").write_text(
+            "\n".join(
+                [
+                    f"summary: Synthetic job script {index}",
+                    "entrypoint: job.sh",
+                    "supporting-files:",
+                    "  - input.dat",
+                    "image-source: Dockerfile",
+                    "image-tags:",
+                    '  - "1.0.0"',
+                    '  - "latest"',
+                    "",
+                ]
+            )
+        )
+        job_script_path.joinpath("README.md").write_text(f"# Job script {index}\n\nA synthetic job script.\n")
+        job_script_path.joinpath("Dockerfile").write_text(DOCKERFILE)
+        job_script_path.joinpath("job.sh").write_text(f"#!/bin/bash\necho {index}\n")
+        job_script_path.joinpath("input.dat").write_bytes(os.urandom(4096))
+
+
+def peak_rss_mib() -> float:
+    """Return the peak RSS of this process and of its waited for children, in MiB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+@contextlib.contextmanager
+def measure(results: dict[str, Any], scenario: str, calls: Calls) -> Iterator[None]:
+    """Record the wall time, the peak RSS and the calls issued by the enclosed scenario."""
+    before = calls.snapshot()
+    start = time.perf_counter()
+    yield
+    results[scenario] = {
+        "wall": time.perf_counter() - start,
+        "peak_rss_mib": peak_rss_mib(),
+        "calls": dict(sorted((calls.snapshot() - before).items())),
+    }
+
+
+def run_worker(size: int, jobs: int, latency: float, sif_size: int) -> dict[str, Any]:
+    """Run every scenario against a catalog of the given size, returning their measures."""
+    workdir = Path(tempfile.mkdtemp(prefix=f"builder-bench-{size}-"))
+    bin_dir = workdir / "bin"
+    bin_dir.mkdir()
+    apptainer_stub = bin_dir / "apptainer"
+    apptainer_stub.write_text(f"#!{sys.executable} -S\n{APPTAINER_STUB}")
+    apptainer_stub.chmod(0o755)
+    calls = Calls(workdir / "calls.log")
+
+    # the cache directory of the builder is derived from the home directory upon import
+    os.environ.update(
+        HOME=str(workdir / "home"),
+        PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+        BENCH_CALLS_LOG=str(calls.calls_log),
+        BENCH_TOOL_LATENCY=str(latency),
+        BENCH_SIF_SIZE=str(sif_size),
+    )
+    sys.path.insert(0, str(ROOT_DIR))
+
+    import boto3
+    import docker
+    from typer.testing import CliRunner
+
+    from builder.main import app
+    from builder.subapps.helpers import find_job_scripts, load_job_script_metadata
+
+    registry = start_registry(calls)
+    (host, port) = registry.server_address[:2]
+    s3 = FakeS3(calls)
+    ecr = FakeEcrPublic(calls, f"{host}:{port}/bench")
+
+    class FakeSession:
+        def __init__(self, **kwargs):
+            pass
+
+        def client(self, service_name: str, **kwargs):
+            return {"s3": s3, "ecr-public": ecr}[service_name]
+
+    boto3.Session = FakeSession
+    fake_docker = FakeDocker(calls, latency)
+    docker.from_env = lambda *args, **kwargs: fake_docker
+
+    catalog_path = workdir / "catalog"
+    generate_catalog(catalog_path, size)
+    os.chdir(catalog_path)
+    runner = CliRunner()
+
+    def invoke(*args: str):
+        result = runner.invoke(app, list(args))
+        if result.exit_code != 0:
+            raise RuntimeError(f"builder {' '.join(args)} failed:\n{result.output}")
+
+    invoke(
+        "settings",
+        "set",
+        "--aws-access-key-id=benchmark",
+        "--aws-secret-access-key=benchmark",
+        "--s3-bucket=benchmark",
+        "--s3-bucket-region=us-east-1",
+        "--oci-registry-plain-http",
+    )
+
+    results: dict[str, Any] = {}
+    with measure(results, "find-job-scripts", calls):
+        paths = find_job_scripts()
+    with measure(results, "load-metadata", calls):
+        for path in paths:
+            load_job_script_metadata(path)
+    with measure(results, "catalog-generate-cold", calls):
+        invoke("catalog", "generate", "--no-index")
+    with measure(results, "catalog-generate-warm", calls):
+        invoke("catalog", "generate")
+    for state in ("cold", "warm"):
+        with measure(results, f"build-{state}", calls):
+            invoke("apptainer", "build", f"--jobs={jobs}")
+    for state in ("cold", "warm"):
+        with measure(results, f"publish-images-{state}", calls):
+            invoke("apptainer", "publish", f"--jobs={jobs}")
+    for state in ("cold", "warm"):
+        with measure(results, f"publish-files-{state}", calls):
+            invoke("files", "publish", f"--jobs={jobs}")
+
+    # the same job scripts with new contents, so that every stage has work to do again
+    pipeline_path = workdir / "pipeline"
+    generate_catalog(pipeline_path, size)
+    os.chdir(pipeline_path)
+    with measure(results, "pipeline-cold", calls):
+        invoke("pipeline", "run", f"--build-jobs={jobs}", f"--publish-jobs={jobs}", f"--upload-jobs={jobs}")
+
+    registry.shutdown()
+    return results
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float, slack: float) -> list[str]:
+    """Return the regressions of the results against the baseline.
+
+    A scenario regresses when its wall time exceeds the baseline one by more than the tolerance,
+    plus an absolute slack absorbing the noise of the shortest scenarios, or when it issues more
+    calls of any kind than in the baseline.
+    """
+    regressions = []
+    for size, scenarios in results.items():
+        for scenario, measures in scenarios.items():
+            reference = baseline.get(size, {}).get(scenario)
+            if reference is None:
+                continue
+            limit = reference["wall"] * (1 + tolerance) + slack
+            if measures["wall"] > limit:
+                regressions.append(
+                    f"{scenario} with {size} job scripts took {measures['wall']:.2f}s, above {limit:.2f}s"
+                )
+            for name, count in measures["calls"].items():
+                if count > reference["calls"].get(name, 0):
+                    regressions.append(
+                        f"{scenario} with {size} job scripts issued {count} {name} calls, "
+                        f"{reference['calls'].get(name, 0)} in the baseline"
+                    )
+    return regressions
+
+
+def print_results(results: dict[str, Any]):
+    """Print the measures of every scenario as a table."""
+    print(f"{'size':>6} {'scenario':<24} {'wall (s)':>9} {'rss (MiB)':>10}  calls")
+    for size, scenarios in results.items():
+        for scenario, measures in scenarios.items():
+            calls = ", ".join(f"{name}={count}" for (name, count) in measures["calls"].items())
+            print(
+                f"{size:>6} {scenario:<24} {measures['wall']:>9.3f} {measures['peak_rss_mib']:>10.1f}  "
+                f"{calls or '-'}"
+            )
+
+
+def main() -> int:
+    """Run the benchmark, returning the exit code."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated sizes of the catalogs")
+    parser.add_argument("--jobs", type=int, default=8, help="Value of the --jobs option of the commands")
+    parser.add_argument(
+        "--tool-latency",
+        type=float,
+        default=0.0,
+        help="Seconds each Docker build and Apptainer call takes, to emulate real work",
+    )
+    parser.add_argument("--sif-size", type=int, default=64 * 1024, help="Size, in bytes, of the .sif files")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", type=Path, help="Results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Tolerated relative wall time increase")
+    parser.add_argument("--slack", type=float, default=0.1, help="Tolerated absolute wall time increase")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.worker is not None:
+        results = run_worker(options.worker, options.jobs, options.tool_latency, options.sif_size)
+        print(json.dumps(results))
+        return 0
+
+    results = {}
+    for size in options.sizes.split(","):
+        # every catalog size runs in a fresh process, so that the peak RSS and the caches are its own
+        proc = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                f"--worker={size}",
+                f"--jobs={options.jobs}",
+                f"--tool-latency={options.tool_latency}",
+                f"--sif-size={options.sif_size}",
+            ],
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            return 1
+        results[size] = json.loads(proc.stdout.splitlines()[-1])
+
+    print_results(results)
+    if options.output is not None:
+        options.output.write_text(json.dumps(results, indent=2))
+
+    if options.baseline is not None:
+        regressions = compare(
+            results, json.loads(options.baseline.read_text()), options.tolerance, options.slack
+        )
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
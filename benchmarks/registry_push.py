@@ -0,0 +1,105 @@
+"""Smoke test of the publish process against a local OCI registry served over plain HTTP.
+
+A registry:2 container is started on the given port, the job scripts are built, then published
+with the real apptainer push and the manifest uploads of the tags, and the tags of each image are
+read back from the registry. Unlike the offline orchestration benchmark, which stubs apptainer, it
+needs Docker and Apptainer. The settings and the caches live in a temporary home directory, so the
+ones of the user are left untouched. Run it from the root of the repository with:
+
+    poetry run python benchmarks/registry_push.py hpl-benchmark --port 5000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+# namespace of the images in the local registry
+NAMESPACE = "vantage"
+
+
+def builder(home: Path, *args: str):
+    """Run a builder command with the temporary home directory, raising if it fails."""
+    proc = subprocess.run(
+        [sys.executable, "-c", "from builder.main import app; app()", *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "HOME": str(home)},
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"builder {' '.join(args)} failed:\n{proc.stdout}\n{proc.stderr}")
+
+
+def wait_for_registry(port: int, timeout: float):
+    """Wait until the registry answers the base endpoint of the distribution API."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f"http://localhost:{port}/v2/"):
+                return
+        except (urllib.error.URLError, ConnectionError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def list_tags(port: int, image_name: str) -> list[str]:
+    """Return the tags of an image in the registry."""
+    url = f"http://localhost:{port}/v2/{NAMESPACE}/{image_name}/tags/list"
+    with urllib.request.urlopen(url) as response:
+        return json.load(response).get("tags") or []
+
+
+def main() -> int:
+    """Run the smoke test, returning the exit code."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("job_scripts", nargs="+", help="Paths of the job scripts to build and publish")
+    parser.add_argument("--port", type=int, default=5000, help="Port the local registry listens on")
+    parser.add_argument(
+        "--timeout", type=float, default=30.0, help="Seconds to wait for the registry to start"
+    )
+    options = parser.parse_args()
+
+    container = subprocess.run(
+        ["docker", "run", "--detach", "--rm", f"--publish={options.port}:5000", "registry:2"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    try:
+        wait_for_registry(options.port, options.timeout)
+        with tempfile.TemporaryDirectory(prefix="registry-push-") as home:
+            builder(
+                Path(home),
+                "settings",
+                "set",
+                "--aws-access-key-id=smoke",
+                "--aws-secret-access-key=smoke",
+                "--s3-bucket=smoke",
+                "--s3-bucket-region=us-east-1",
+                f"--oci-registry=localhost:{options.port}/{NAMESPACE}",
+                "--oci-registry-plain-http",
+            )
+            builder(Path(home), "apptainer", "build", "--no-share-layers", *options.job_scripts)
+            builder(Path(home), "apptainer", "publish", *options.job_scripts)
+        failures = 0
+        for job_script in options.job_scripts:
+            name = Path(job_script).resolve().name
+            tags = list_tags(options.port, name)
+            print(f"{name:<30} {', '.join(sorted(tags)) or 'no tags'}")
+            failures += not tags
+    finally:
+        subprocess.run(["docker", "stop", container], capture_output=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Core module for the AWS clients shared by the commands of a single CLI invocation."""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
+from loguru import logger
+
+from builder.config import Settings
+from builder.exceptions import Abort
+from builder.schemas import EcrLogin
+from builder.tools import run_command
+
+# boto3 and botocore are slow to import, so they are only imported once clients are needed
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
+    from mypy_boto3_ecr_public.client import ECRPublicClient
+    from mypy_boto3_s3.client import S3Client
+    from mypy_boto3_s3.type_defs import CompletedPartTypeDef
+
+# ECR Public only lives in us-east-1
+ECR_PUBLIC_REGION = "us-east-1"
+
+# the authorization token is renewed this many seconds before it expires
+ECR_TOKEN_EXPIRATION_MARGIN = 300
+
+MIB = 1024**2
+
+
+class TransferStats:
+    """Thread-safe accumulator of the bytes transferred to S3."""
+
+    def __init__(self):  # noqa: D107
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.started_at = time.perf_counter()
+
+    def add(self, amount: int):
+        """Account for a chunk of transferred bytes. Meant to be used as a boto3 transfer callback."""
+        with self._lock:
+            self.bytes += amount
+
+    def summary(self) -> str:
+        """Return the amount of transferred data and the aggregate throughput."""
+        elapsed = time.perf_counter() - self.started_at
+        rate = self.bytes / elapsed if elapsed > 0 else 0.0
+        return f"{self.bytes / MIB:.1f} MiB transferred at {rate / MIB:.1f} MiB/s"
+
+
+class AwsClients:
+    """Factory of pooled AWS clients built from the settings.
+
+    Clients are created once and shared by all the tasks of a command, with a connection pool sized
+    to the concurrency level. The ECR Public login is also performed once and reused until the
+    authorization token expires.
+    """
+
+    def __init__(self, settings: Settings, max_pool_connections: int = 10):  # noqa: D107
+        import boto3
+        from botocore.config import Config
+
+        self.settings = settings
+        self.session = boto3.Session(
+            aws_access_key_id=settings.aws_access_key_id,
+            aws_secret_access_key=settings.aws_secret_access_key,
+            aws_session_token=settings.aws_session_token,
+        )
+        # botocore retries transient errors of the ECR Public calls with its own jittered backoff
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={"mode": "standard", "total_max_attempts": settings.max_attempts},
+        )
+        # the S3 calls are already retried by builder.retry, which would multiply the attempts of botocore
+        self.s3_config = self.config.merge(Config(retries={"mode": "standard", "total_max_attempts": 1}))
+        self._lock = threading.Lock()
+        self._s3: S3Client | None = None
+        self._ecr_public: ECRPublicClient | None = None
+        self._ecr_login: EcrLogin | None = None
+        self.transfer_stats = TransferStats()
+
+    def s3(self) -> S3Client:
+        """Return the shared S3 client."""
+        with self._lock:
+            if self._s3 is None:
+                logger.debug(f"Creating S3 client for region {self.settings.s3_bucket_region}")
+                self._s3 = self.session.client(
+                    "s3", region_name=self.settings.s3_bucket_region, config=self.s3_config
+                )
+            return self._s3
+
+    def transfer_config(self) -> TransferConfig:
+        """Return the S3 transfer configuration built from the settings."""
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=self.settings.s3_multipart_threshold * MIB,
+            multipart_chunksize=self.settings.s3_multipart_chunksize * MIB,
+            max_concurrency=self.settings.s3_max_concurrency,
+            use_threads=True,
+        )
+
+    def upload_file(
+        self,
+        local_path: Path,
+        key: str,
+        metadata: dict[str, str],
+        upload_id: str | None = None,
+        on_started: Callable[[str], None] | None = None,
+    ):
+        """Upload a file to the bucket, resuming the given multipart upload if it still exists.
+
+        Files below the multipart threshold are uploaded by boto3 in one go. Larger ones are uploaded
+        part by part, and the identifier of a new multipart upload is passed to on_started, so an
+        interrupted upload can be resumed. The parts already uploaded with the same content, which is
+        checked through their MD5 digest, are skipped.
+        """
+        s3 = self.s3()
+        bucket = self.settings.s3_bucket
+        size = local_path.stat().st_size
+        if size < self.settings.s3_multipart_threshold * MIB:
+            s3.upload_file(
+                Filename=str(local_path),
+                Bucket=bucket,
+                Key=key,
+                ExtraArgs={"Metadata": metadata},
+                Config=self.transfer_config(),
+                Callback=self.transfer_stats.add,
+            )
+            return
+
+        uploaded = None if upload_id is None else self._uploaded_parts(key, upload_id)
+        if upload_id is None or uploaded is None:
+            upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, Metadata=metadata)["UploadId"]
+            logger.debug(f"Started the multipart upload {upload_id} of {key}")
+            if on_started is not None:
+                on_started(upload_id)
+            uploaded = {}
+        else:
+            logger.debug(f"Resuming the multipart upload {upload_id} of {key} from {len(uploaded)} parts")
+        part_size = self.settings.s3_multipart_chunksize * MIB
+
+        def upload_part(number: int) -> CompletedPartTypeDef:
+            with open(local_path, "rb") as file:
+                file.seek((number - 1) * part_size)
+                data = file.read(part_size)
+            etag = f'"{hashlib.md5(data).hexdigest()}"'
+            if uploaded.get(number) != etag:
+                response = s3.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+                )
+                etag = response["ETag"]
+                self.transfer_stats.add(len(data))
+            return {"ETag": etag, "PartNumber": number}
+
+        with ThreadPoolExecutor(max_workers=self.settings.s3_max_concurrency) as pool:
+            parts = list(pool.map(upload_part, range(1, math.ceil(size / part_size) + 1)))
+        s3.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+
+    def _uploaded_parts(self, key: str, upload_id: str) -> dict[int, str] | None:
+        """Return the ETag of the uploaded parts of a multipart upload, or None if it no longer exists."""
+        s3 = self.s3()
+        parts = {}
+        try:
+            paginator = s3.get_paginator("list_parts")
+            for page in paginator.paginate(Bucket=self.settings.s3_bucket, Key=key, UploadId=upload_id):
+                parts.update({part["PartNumber"]: part["ETag"] for part in page.get("Parts", [])})
+        except s3.exceptions.NoSuchUpload:
+            logger.debug(f"The multipart upload {upload_id} of {key} no longer exists")
+            return None
+        return parts
+
+    def ecr_public(self) -> ECRPublicClient:
+        """Return the shared ECR Public client."""
+        with self._lock:
+            if self._ecr_public is None:
+                logger.debug(f"Creating ECR client for region {ECR_PUBLIC_REGION}")
+                self._ecr_public = self.session.client(
+                    "ecr-public", region_name=ECR_PUBLIC_REGION, config=self.config
+                )
+            return self._ecr_public
+
+    def ecr_login(self) -> EcrLogin:
+        """Log into the ECR Public registry, reusing the previous login until its token expires."""
+        ecr = self.ecr_public()
+        with self._lock:
+            if self._ecr_login is not None and self._ecr_login.expires_at > time.time():
+                return self._ecr_login
+
+            logger.debug("Fetching authorization token and extracting username and password")
+            auth_token_response = ecr.get_authorization_token()
+            auth_data = auth_token_response["authorizationData"]
+            (username, password) = base64.b64decode(auth_data["authorizationToken"]).decode().split(":")
+            logger.debug(f"Got authorization token for user {username}")
+
+            logger.debug("Describing registries on ECR Public")
+            registry_response = ecr.describe_registries()
+            registry_list = registry_response["registries"]
+            Abort.require_condition(
+                len(registry_list) == 1,
+                "Did not find one and only one registry",
+                raise_kwargs=dict(
+                    subject="Publish failed",
+                    log_message=f"Found {len(registry_list)} registries instead of one",
+                ),
+            )
+            registry_data = registry_list[0]
+            registry_uri = registry_data["registryUri"]
+            registry_domain = registry_uri.split("/")[0]
+
+            logger.debug("Logging into the ECR Public registry via Apptainer")
+            command = (
+                "apptainer registry login "
+                f"--username={username} "
+                f"--password={password} "
+                f"oras://{registry_domain}"
+            )
+            (returncode, stdout, stderr) = run_command(command)
+            # a failed login must not be cached, or every push would fail until the token expires
+            Abort.require_condition(
+                returncode == 0,
+                f"Could not log into oras://{registry_domain} with Apptainer:\n{(stderr or stdout).strip()}",
+                raise_kwargs=dict(
+                    subject="Registry login failed",
+                    log_message=f"apptainer registry login exited with code {returncode}",
+                ),
+            )
+
+            self._ecr_login = EcrLogin(
+                registry_id=registry_data["registryId"],
+                registry_uri=registry_uri,
+                username=username,
+                password=password,
+                expires_at=auth_data["expiresAt"].timestamp() - ECR_TOKEN_EXPIRATION_MARGIN,
+            )
+            return self._ecr_login
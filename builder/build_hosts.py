@@ -0,0 +1,272 @@
+"""Core module for distributing the image builds across a pool of build hosts.
+
+A build host is a Docker daemon, reached through a DOCKER_HOST endpoint, along with a working
+directory where Apptainer converts the images built by that daemon. Images built by a local
+endpoint, such as another Unix socket or a TCP port, are converted by the local Apptainer, while
+the ones built by a host reached through SSH are converted on that host, in its working
+directory, and the resulting .sif files are copied back. Builds are scheduled on the least loaded
+host, and rescheduled on another one when their host stops responding.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import shlex
+import shutil
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, TypeVar
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from builder.exceptions import Abort
+from builder.history import estimate_durations
+from builder.tools import run_command_logged
+
+# the Docker SDK is slow to import, so it is only imported when needed
+if TYPE_CHECKING:
+    from docker import DockerClient
+
+T = TypeVar("T")
+
+# working directory of the hosts reached through SSH, when none is given
+DEFAULT_WORK_DIR = "/tmp/vantage-jobs-catalog"
+
+# options of the SSH connections, which must fail instead of prompting and notice a dead host
+SSH_OPTIONS = "-o BatchMode=yes -o ConnectTimeout=10 -o ServerAliveInterval=15 -o ServerAliveCountMax=3"
+
+# threads running the blocking calls of the Docker SDK, apart from the default executor of asyncio
+_docker_executor: ThreadPoolExecutor | None = None
+_docker_workers = 0
+
+
+@functools.cache
+def docker_client(docker_host: str | None = None) -> DockerClient:
+    """Return a client of the Docker daemon at the endpoint, or of the one of the environment if None.
+
+    Clients are created once per endpoint and kept warm for the rest of the process, such as the
+    following iterations of the watch command.
+    """
+    import docker
+
+    if docker_host is None:
+        return docker.from_env()
+    return docker.DockerClient(base_url=docker_host, use_ssh_client=docker_host.startswith("ssh://"))
+
+
+def size_docker_executor(workers: int):
+    """Make room for the given number of concurrent Docker SDK calls, such as the builds of every slot.
+
+    Builds hold a thread for their whole duration, so running them on the default executor, which
+    is bounded by the local CPUs, would cap the concurrent builds and starve the other blocking
+    calls such as the hashing and the uploads. The executor only ever grows.
+    """
+    global _docker_executor, _docker_workers
+    if workers <= _docker_workers:
+        return
+    previous = _docker_executor
+    _docker_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="docker")
+    _docker_workers = workers
+    logger.debug(f"Running up to {workers} concurrent Docker SDK calls")
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+async def run_docker(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call of the Docker SDK on the threads dedicated to these calls."""
+    if _docker_executor is None:
+        size_docker_executor(min(32, (os.cpu_count() or 1) + 4))
+    return await asyncio.get_running_loop().run_in_executor(
+        _docker_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+class BuildHost:
+    """Docker daemon, and the machine running it, on which images are built and converted."""
+
+    def __init__(self, docker_host: str, work_dir: str | None = None, slots: int | None = None):  # noqa: D107
+        self.docker_host = docker_host
+        self.is_remote = docker_host.startswith("ssh://")
+        self.work_dir = work_dir or (DEFAULT_WORK_DIR if self.is_remote else None)
+        self.slots = slots
+
+    @classmethod
+    def parse(cls, spec: str) -> BuildHost:
+        """Parse a build host given as DOCKER_HOST[,WORK_DIR[,SLOTS]]."""
+        (docker_host, work_dir, slots, *extra) = [*spec.split(","), "", ""]
+        Abort.require_condition(
+            "://" in docker_host and not any(extra) and (not slots or slots.isdigit() and int(slots) > 0),
+            f"Invalid build host {spec!r}, expected DOCKER_HOST[,WORK_DIR[,SLOTS]], "
+            "such as ssh://builder@10.0.0.5,/scratch/builds,8",
+            raise_kwargs=dict(subject="Invalid build host", log_message=f"Invalid build host {spec}"),
+        )
+        return cls(docker_host, work_dir or None, int(slots) if slots else None)
+
+    @property
+    def label(self) -> str:
+        """Return a short name of the host, for the logs and the traces."""
+        endpoint = urlsplit(self.docker_host)
+        return endpoint.hostname or endpoint.path or self.docker_host
+
+    def _ssh(self, program: str = "ssh") -> str:
+        """Return the ssh or scp command connecting to the host, without its destination."""
+        endpoint = urlsplit(self.docker_host)
+        port_flag = "-P" if program == "scp" else "-p"
+        port = f" {port_flag} {endpoint.port}" if endpoint.port else ""
+        return f"{program} {SSH_OPTIONS}{port}"
+
+    @property
+    def _target(self) -> str:
+        """Return the user and the address of the host reached through SSH."""
+        endpoint = urlsplit(self.docker_host)
+        return f"{endpoint.username}@{endpoint.hostname}" if endpoint.username else str(endpoint.hostname)
+
+    def work_path(self, output_path: Path, name: str) -> Path:
+        """Return the path where the .sif file of a job script is written on the host."""
+        if self.work_dir is None:
+            return output_path
+        return Path(self.work_dir) / f"{name}.sif"
+
+    async def run(self, command: str, timeout: float | None = None):
+        """Run a command on the host, against its Docker daemon."""
+        if not self.is_remote:
+            await run_command_logged(command, timeout=timeout, env={"DOCKER_HOST": self.docker_host})
+            return
+        await run_command_logged(f"{self._ssh()} {self._target} {shlex.quote(command)}", timeout=timeout)
+
+    async def fetch(self, work_path: Path, output_path: Path):
+        """Bring a .sif file written on the host back to the output path, removing it from the host."""
+        if work_path == output_path:
+            return
+        if not self.is_remote:
+            await asyncio.to_thread(shutil.move, work_path, output_path)
+            return
+        partial_path = output_path.with_name(f".{output_path.name}.partial")
+        source = f"{self._target}:{shlex.quote(str(work_path))}"
+        await run_command_logged(f"{self._ssh('scp')} {source} {shlex.quote(str(partial_path))}")
+        partial_path.replace(output_path)
+        await self.run(f"rm -f {shlex.quote(str(work_path))}")
+
+    async def probe(self) -> int | None:
+        """Check that the host responds and prepare its working directory.
+
+        Return the number of CPUs of its Docker daemon, or None if the host is unreachable.
+        """
+        try:
+            info: dict[str, Any] = await run_docker(lambda: docker_client(self.docker_host).info())
+            if self.work_dir is not None:
+                await self.run(f"mkdir -p {shlex.quote(self.work_dir)}")
+        except Exception as err:
+            logger.warning(f"Build host {self.label} is unreachable: {err}")
+            return None
+        return int(info.get("NCPU") or 1)
+
+
+class BuildHostPool:
+    """Pool of build hosts, scheduling each build on the least loaded one.
+
+    The load of a host is the estimated duration of its running builds per slot. When a build
+    fails and its host no longer responds, the host is left out and the build is rescheduled on
+    another one, while the failures of the job scripts themselves are raised as usual.
+    """
+
+    def __init__(self, hosts: list[BuildHost]):  # noqa: D107
+        self.hosts = hosts
+        self._running: dict[BuildHost, dict[str, float]] = {host: {} for host in hosts}
+        self._failed: set[BuildHost] = set()
+        self._estimates: dict[str, float] = {}
+        self._changed = asyncio.Condition()
+
+    @property
+    def docker_hosts(self) -> list[str]:
+        """Return the endpoints of the healthy hosts."""
+        return [host.docker_host for host in self.hosts if host not in self._failed]
+
+    @property
+    def capacity(self) -> int:
+        """Return the number of builds the healthy hosts run at the same time."""
+        return sum(host.slots or 1 for host in self.hosts if host not in self._failed)
+
+    async def start(self, job_scripts: list[str], dry_run: bool = False):
+        """Probe the hosts, sizing their slots after their CPUs, and estimate the builds to schedule.
+
+        In dry run, the hosts are not contacted and get a single slot unless given.
+        """
+        if not dry_run:
+            cpus = await asyncio.gather(*(host.probe() for host in self.hosts))
+            for host, count in zip(self.hosts, cpus):
+                if count is None:
+                    self._failed.add(host)
+                elif host.slots is None:
+                    host.slots = count
+        Abort.require_condition(
+            len(self._failed) < len(self.hosts),
+            "None of the build hosts responds",
+            raise_kwargs=dict(subject="Build hosts unreachable", log_message="No build host responds"),
+        )
+        estimates = estimate_durations(job_scripts, ["build"])
+        known = [estimate for estimate in estimates.values() if estimate is not None]
+        default = statistics.fmean(known) if known else 1.0
+        self._estimates = {
+            name: default if estimate is None else estimate for (name, estimate) in estimates.items()
+        }
+        for host in self.hosts:
+            state = "unreachable" if host in self._failed else f"up to {host.slots or 1} concurrent builds"
+            logger.debug(f"Build host {host.label} ({host.docker_host}): {state}")
+
+    def _pick(self) -> BuildHost | None:
+        """Return the healthy host with a free slot and the lowest load, if any."""
+        available = [
+            host
+            for host in self.hosts
+            if host not in self._failed and len(self._running[host]) < (host.slots or 1)
+        ]
+        if not available:
+            return None
+        return min(available, key=lambda host: sum(self._running[host].values()) / (host.slots or 1))
+
+    async def _acquire(self, name: str) -> BuildHost:
+        """Wait for a free slot on a healthy host and assign the build of a job script to it."""
+        async with self._changed:
+            while (host := self._pick()) is None:
+                Abort.require_condition(
+                    len(self._failed) < len(self.hosts),
+                    f"No build host is left to build {name}",
+                    raise_kwargs=dict(
+                        subject="Build hosts unreachable", log_message="Every build host failed"
+                    ),
+                )
+                await self._changed.wait()
+            self._running[host][name] = self._estimates.get(name, 1.0)
+        logger.debug(f"Scheduling the build of {name} on {host.label}")
+        return host
+
+    async def _release(self, host: BuildHost, name: str, failed: bool = False):
+        """Free the slot of a build, leaving its host out if it failed."""
+        async with self._changed:
+            self._running[host].pop(name, None)
+            if failed:
+                self._failed.add(host)
+            self._changed.notify_all()
+
+    async def run(self, name: str, build: Callable[[BuildHost], Awaitable[T]]) -> T:
+        """Run the build of a job script on a host, rescheduling it if the host stops responding."""
+        while True:
+            host = await self._acquire(name)
+            try:
+                result = await build(host)
+            except Exception as err:
+                lost = await host.probe() is None
+                await self._release(host, name, failed=lost)
+                if not lost:
+                    raise
+                logger.warning(
+                    f"Build host {host.label} failed while building {name}, rescheduling it: {err}"
+                )
+                continue
+            await self._release(host, name)
+            return result
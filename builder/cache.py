@@ -2,12 +2,24 @@
 
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import shutil
+import time
 from functools import wraps
 from pathlib import Path
 
+from loguru import logger
+
+from builder.dockerfile import build_context_files, resolve_dockerfile
 from builder.exceptions import Abort
+from builder.hashing import hash_file
+from builder.schemas import BuildCacheEntry, JobScriptMetadata
 
 cache_dir: Path = Path.home() / ".local/share/vantage-jobs-catalog"
+build_cache_dir: Path = cache_dir / "builds"
+layer_cache_dir: Path = cache_dir / "buildkit"
 
 
 def init_cache(func):
@@ -32,3 +44,114 @@ def init_cache(func):
         return func(*args, **kwargs)
 
     return wrapper
+
+
+def compute_build_key(job_script_path: Path, metadata: JobScriptMetadata) -> str:
+    """Compute the content address of a job script image.
+
+    The key is a hash of the files of the minimal build context, which include the Dockerfile,
+    and the image related fields of the metadata, including the compression when it is set.
+    """
+    digest = hashlib.sha256()
+    dockerfile_path = resolve_dockerfile(job_script_path, metadata.image_source)
+    for path in build_context_files(job_script_path, dockerfile_path):
+        digest.update(path.relative_to(job_script_path).as_posix().encode())
+        digest.update(hash_file(path).encode())
+    image_fields = metadata.model_dump(
+        mode="json",
+        by_alias=True,
+        include={"image_source", "image_tags", "sif_compression", "sif_compression_level"},
+        exclude_none=True,
+    )
+    digest.update(json.dumps(image_fields, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _entry_paths(key: str) -> tuple[Path, Path]:
+    """Return the paths of the image and of the record of a build cache entry."""
+    return (build_cache_dir / f"{key}.sif", build_cache_dir / f"{key}.json")
+
+
+def list_build_cache_entries() -> list[BuildCacheEntry]:
+    """List the entries of the build cache, from the least to the most recently used."""
+    if not build_cache_dir.exists():
+        return []
+    entries = []
+    for record_path in build_cache_dir.glob("*.json"):
+        entry = BuildCacheEntry.model_validate_json(record_path.read_text())
+        if _entry_paths(entry.key)[0].exists():
+            entries.append(entry)
+    return sorted(entries, key=lambda entry: entry.last_used_at)
+
+
+def has_build_cache_entry(key: str) -> bool:
+    """Check if an image is cached under the given key."""
+    return all(path.exists() for path in _entry_paths(key))
+
+
+def restore_from_build_cache(key: str, output_path: Path) -> bool:
+    """Restore the image cached under the given key to the output path.
+
+    Return False if there is no such entry in the cache. The output path is left untouched if it
+    already holds the cached image.
+    """
+    (image_path, record_path) = _entry_paths(key)
+    if not (image_path.exists() and record_path.exists()):
+        return False
+
+    if output_path.exists() and output_path.samefile(image_path):
+        logger.debug(f"{output_path} is up to date with the cache entry {key}")
+    else:
+        logger.debug(f"Restoring {output_path} from the cache entry {key}")
+        output_path.unlink(missing_ok=True)
+        _link_or_copy(image_path, output_path)
+
+    entry = BuildCacheEntry.model_validate_json(record_path.read_text())
+    entry.last_used_at = time.time()
+    record_path.write_text(entry.model_dump_json())
+    return True
+
+
+def store_in_build_cache(key: str, job_script_path: Path, output_path: Path):
+    """Store a freshly built image in the build cache under the given key."""
+    build_cache_dir.mkdir(parents=True, exist_ok=True)
+    (image_path, record_path) = _entry_paths(key)
+    logger.debug(f"Storing {output_path} in the cache entry {key}")
+    image_path.unlink(missing_ok=True)
+    _link_or_copy(output_path, image_path)
+    now = time.time()
+    entry = BuildCacheEntry(
+        key=key,
+        job_script=job_script_path.name,
+        size=image_path.stat().st_size,
+        created_at=now,
+        last_used_at=now,
+    )
+    record_path.write_text(entry.model_dump_json())
+
+
+def prune_build_cache(max_size: int) -> list[BuildCacheEntry]:
+    """Evict the least recently used entries until the build cache fits in max_size bytes.
+
+    Return the evicted entries.
+    """
+    entries = list_build_cache_entries()
+    total_size = sum(entry.size for entry in entries)
+    evicted = []
+    for entry in entries:
+        if total_size <= max_size:
+            break
+        logger.debug(f"Evicting the cache entry {entry.key} of {entry.job_script}")
+        for path in _entry_paths(entry.key):
+            path.unlink(missing_ok=True)
+        total_size -= entry.size
+        evicted.append(entry)
+    return evicted
+
+
+def _link_or_copy(source: Path, destination: Path):
+    """Hard link the source to the destination, falling back to a copy across file systems."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
@@ -0,0 +1,116 @@
+"""Core module for the on-disk index of job script metadata used to generate the catalog.
+
+Parsing every metadata.yaml file and reading every README.md file gets slow as the catalog grows,
+so the parsed content is stored in an index under the cache directory. An entry is reused as long
+as the modification time and size, or failing that the digest, of its source files are unchanged.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from loguru import logger
+from pydantic import ValidationError
+
+from builder.cache import cache_dir
+from builder.hashing import hash_file
+from builder.schemas import FileStamp, JobScriptIndex, JobScriptIndexEntry
+
+index_path: Path = cache_dir / "catalog-index.json"
+
+# files of a job script whose content ends up in the catalog
+INDEXED_FILES = ["metadata.yaml", "README.md"]
+
+# below this number of changed job scripts, spawning worker processes costs more than it saves
+PARALLEL_PARSE_THRESHOLD = 16
+
+
+def load_index() -> JobScriptIndex:
+    """Load the index from disk, starting from an empty one if it is missing or unreadable."""
+    try:
+        return JobScriptIndex.model_validate_json(index_path.read_text())
+    except FileNotFoundError:
+        logger.debug(f"No catalog index found at {index_path}")
+    except ValidationError:
+        logger.warning(f"Discarding the unreadable catalog index at {index_path}")
+    return JobScriptIndex()
+
+
+def save_index(index: JobScriptIndex):
+    """Atomically write the index to disk."""
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(index.model_dump_json(by_alias=True))
+    tmp_path.replace(index_path)
+
+
+def _stamp(path: Path, sha256: str | None = None) -> FileStamp:
+    """Stamp a file with its modification time, size and digest."""
+    stat = path.stat()
+    return FileStamp(mtime_ns=stat.st_mtime_ns, size=stat.st_size, sha256=sha256 or hash_file(path))
+
+
+def _is_fresh(job_script_path: Path, entry: JobScriptIndexEntry) -> bool:
+    """Check if an index entry is still up to date with the files of its job script.
+
+    The modification time and size are checked first, the content digest is only computed if they
+    differ. Stamps of files whose content did not change are refreshed in place.
+    """
+    if set(entry.stamps) != set(INDEXED_FILES):
+        return False
+    for name in INDEXED_FILES:
+        path = job_script_path / name
+        stamp = entry.stamps[name]
+        stat = path.stat()
+        if (stat.st_mtime_ns, stat.st_size) == (stamp.mtime_ns, stamp.size):
+            continue
+        if stat.st_size != stamp.size or hash_file(path) != stamp.sha256:
+            return False
+        entry.stamps[name] = _stamp(path, sha256=stamp.sha256)
+    return True
+
+
+def parse_job_script(job_script_path: Path) -> JobScriptIndexEntry:
+    """Parse the metadata and read the description of a job script into an index entry."""
+    # imported here so this function can be run by worker processes
+    from builder.subapps.helpers import load_job_script_metadata
+
+    stamps = {name: _stamp(job_script_path / name) for name in INDEXED_FILES}
+    return JobScriptIndexEntry(
+        name=job_script_path.name,
+        stamps=stamps,
+        metadata=load_job_script_metadata(job_script_path),
+        description=job_script_path.joinpath("README.md").read_text(),
+    )
+
+
+def index_job_scripts(
+    job_scripts_paths: list[Path], use_index: bool = True, save: bool = True
+) -> tuple[list[JobScriptIndexEntry], set[str]]:
+    """Return the index entries of the given job scripts, in the same order, and the changed job scripts.
+
+    Unchanged job scripts are served from the index, the changed ones are parsed, in parallel
+    worker processes when there are many of them, and the index is updated on disk unless save is
+    unset.
+    """
+    index = load_index() if use_index else JobScriptIndex()
+    keys = [str(path.resolve()) for path in job_scripts_paths]
+
+    stale = [
+        (key, path)
+        for (key, path) in zip(keys, job_scripts_paths)
+        if key not in index.entries or not _is_fresh(path, index.entries[key])
+    ]
+    logger.debug(f"Catalog index: {len(keys) - len(stale)} hits, {len(stale)} misses")
+
+    stale_paths = [path for (_, path) in stale]
+    if len(stale) >= PARALLEL_PARSE_THRESHOLD:
+        with ProcessPoolExecutor() as executor:
+            entries = list(executor.map(parse_job_script, stale_paths, chunksize=8))
+    else:
+        entries = [parse_job_script(path) for path in stale_paths]
+    index.entries.update((key, entry) for ((key, _), entry) in zip(stale, entries))
+
+    if save:
+        save_index(index)
+    return ([index.entries[key] for key in keys], {entry.name for entry in entries})
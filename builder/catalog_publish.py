@@ -0,0 +1,166 @@
+"""Core module for publishing the catalog as immutable, content-hashed artifacts.
+
+The catalog is serialized to canonical JSON and written under a name derived from its digest,
+along with precompressed variants, so it can be cached forever by CloudFront. A small pointer
+file, which is the only artifact that changes between deploys, names the current catalog. The
+catalog may also be sharded into a compact index and a detail document per job script.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from builder.schemas import CatalogPointer
+from builder.types import JobScriptCatalog
+
+# short-lived file naming the current content-hashed catalog
+CATALOG_POINTER = "catalog-latest.json"
+
+# number of hexadecimal digits of the digest kept in the artifact names
+CATALOG_DIGEST_LENGTH = 16
+
+# file name suffixes of the precompressed variants, by content encoding
+CATALOG_ENCODINGS = {"gzip": ".gz", "br": ".br"}
+
+# directory of the detail documents of the job scripts in the sharded catalog
+CATALOG_DETAILS_DIR = "jobs"
+
+# fields of the catalog entries kept in the index of the sharded catalog
+CATALOG_INDEX_FIELDS = ["name", "summary", "icon-url", "apptainer-image-urls"]
+
+# content-hashed artifacts managed in the publish directory
+CATALOG_ARTIFACT_PATTERNS = ["catalog.*.json*", "catalog-index.*.json*", f"{CATALOG_DETAILS_DIR}/*.json*"]
+
+
+def serialize_catalog(document: dict[str, Any]) -> bytes:
+    """Serialize the catalog, or a part of it, to canonical JSON, so equal documents yield equal bytes."""
+    return json.dumps(document, sort_keys=True, separators=(",", ":")).encode()
+
+
+def compress_catalog(data: bytes) -> dict[str, bytes]:
+    """Return the precompressed variants of the serialized catalog, by content encoding.
+
+    The gzip variant carries no timestamp, so it is reproducible. The brotli variant is only
+    produced when the optional brotli package is installed.
+    """
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        logger.debug("The brotli package is not installed, skipping the brotli variant of the catalog")
+    else:
+        variants["br"] = brotli.compress(data, quality=11)
+    return variants
+
+
+def _write_atomically(path: Path, data: bytes):
+    """Write a file through a temporary one, so readers never see a partially written file."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+
+
+def _hashed_artifacts(prefix: str, data: bytes) -> tuple[str, str, dict[str, bytes]]:
+    """Name a serialized document after its digest and add its precompressed variants.
+
+    Return the name of the document, its digest and the content of every artifact by name.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"{prefix}.{digest[:CATALOG_DIGEST_LENGTH]}.json"
+    artifacts = {name: data}
+    for encoding, compressed in compress_catalog(data).items():
+        artifacts[f"{name}{CATALOG_ENCODINGS[encoding]}"] = compressed
+    return (name, f"sha256:{digest}", artifacts)
+
+
+def _encodings(name: str, artifacts: dict[str, bytes]) -> dict[str, str]:
+    """Return the names of the precompressed variants of a document, by content encoding."""
+    return {
+        encoding: f"{name}{suffix}"
+        for (encoding, suffix) in CATALOG_ENCODINGS.items()
+        if f"{name}{suffix}" in artifacts
+    }
+
+
+def shard_catalog(catalog: JobScriptCatalog) -> tuple[list[dict[str, Any]], dict[str, bytes]]:
+    """Split the catalog into a compact index and a detail document per job script.
+
+    The index entries only hold the fields needed to list the job scripts, along with the digest
+    and the path of their detail document, which holds the whole entry. Return the index entries
+    and the detail artifacts by path, relative to the publish directory.
+    """
+    (index, details) = ([], {})
+    for item in catalog["job-scripts"]:
+        (name, digest, artifacts) = _hashed_artifacts(
+            f"{CATALOG_DETAILS_DIR}/{item['name']}", serialize_catalog(item)
+        )
+        details.update(artifacts)
+        entry = {field: item.get(field) for field in CATALOG_INDEX_FIELDS}
+        entry.update({"digest": digest, "detail": name})
+        index.append(entry)
+    return (index, details)
+
+
+def _write_artifacts(publish_dir: Path, artifacts: dict[str, bytes], patterns: list[str]):
+    """Write the artifacts missing from the directory and remove the stale ones matching the patterns.
+
+    Artifacts that already exist are left untouched, since their content is determined by their name.
+    """
+    for pattern in patterns:
+        for stale_path in publish_dir.glob(pattern):
+            if stale_path.relative_to(publish_dir).as_posix() not in artifacts:
+                logger.debug(f"Removing the stale catalog artifact {stale_path}")
+                stale_path.unlink()
+    for artifact_name, artifact_data in artifacts.items():
+        artifact_path = publish_dir / artifact_name
+        if artifact_path.exists():
+            logger.debug(f"Catalog artifact {artifact_path} is up to date")
+            continue
+        logger.debug(f"Writing the catalog artifact {artifact_path} ({len(artifact_data)} bytes)")
+        artifact_path.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomically(artifact_path, artifact_data)
+
+
+def write_catalog_artifacts(
+    catalog: JobScriptCatalog, publish_dir: Path, sharded: bool = False
+) -> CatalogPointer:
+    """Write the content-hashed catalog, its precompressed variants and the pointer to them.
+
+    When sharded, a compact index of the catalog and the detail documents of the job scripts are
+    written as well, so clients listing the job scripts do not download every description. Only
+    the detail documents of the changed job scripts get a new name. Artifacts of previous catalogs
+    are removed from the directory, which only ever holds what a deploy needs. Return the pointer.
+    """
+    data = serialize_catalog(catalog)
+    (name, digest, artifacts) = _hashed_artifacts("catalog", data)
+    pointer = CatalogPointer(
+        catalog=name,
+        digest=digest,
+        size=len(data),
+        encodings=_encodings(name, artifacts),
+        job_scripts=len(catalog["job-scripts"]),
+    )
+    if sharded:
+        (index, details) = shard_catalog(catalog)
+        (index_name, index_digest, index_artifacts) = _hashed_artifacts(
+            "catalog-index", serialize_catalog({"job-scripts": index})
+        )
+        artifacts.update(index_artifacts)
+        artifacts.update(details)
+        pointer = pointer.model_copy(
+            update={
+                "index": index_name,
+                "index_digest": index_digest,
+                "index_encodings": _encodings(index_name, index_artifacts),
+            }
+        )
+
+    publish_dir.mkdir(parents=True, exist_ok=True)
+    _write_artifacts(publish_dir, artifacts, CATALOG_ARTIFACT_PATTERNS)
+    _write_atomically(publish_dir / CATALOG_POINTER, pointer.model_dump_json(indent=2).encode())
+    return pointer
@@ -0,0 +1,151 @@
+"""Core module for detecting the job scripts affected by the changes since a git reference.
+
+The changed paths are mapped to the job script directories holding them, and each change is
+classified by the artifacts it affects: the image, for the Dockerfile and its build context, the
+published files, for the entrypoint and the supporting files, and the catalog, for the README.md
+file. Changes to the metadata.yaml file are classified by comparing the fields before and after,
+taken from git or from a snapshot of the files, such as the one kept by the watch command.
+"""
+
+import subprocess
+from collections import defaultdict
+from pathlib import Path
+
+from loguru import logger
+
+from builder.dockerfile import build_context_files, resolve_dockerfile
+from builder.exceptions import Abort
+from builder.schemas import ChangeKind, JobScriptChange, JobScriptMetadata
+
+# fields of the metadata that change the content of the image
+IMAGE_FIELDS = {"image_source", "image_tags", "sif_compression", "sif_compression_level"}
+
+# fields of the metadata that change the published files
+FILES_FIELDS = {"entrypoint", "supporting_files"}
+
+
+def _git(*args: str) -> str:
+    """Run a git command in the current directory and return its output."""
+    proc = subprocess.run(["git", *args], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise Abort(
+            f"Command git {' '.join(args)} failed: {proc.stderr.strip()}",
+            subject="Git error",
+            log_message=f"git {args[0]} failed",
+        )
+    return proc.stdout
+
+
+def list_changed_paths(since: str) -> list[Path]:
+    """Return the paths under the current directory changed since the reference.
+
+    Uncommitted and untracked files are included, and renames are reported as a deletion and an
+    addition, so both job scripts are affected.
+    """
+    diff = _git("diff", "--name-only", "--no-renames", "--relative", "-z", since, "--")
+    untracked = _git("ls-files", "--others", "--exclude-standard", "-z")
+    return sorted({Path(path) for path in (diff + untracked).split("\0") if path})
+
+
+def _read_at(since: str, path: Path) -> str | None:
+    """Return the content of a file at the reference, or None if it did not exist then."""
+    proc = subprocess.run(["git", "show", f"{since}:./{path.as_posix()}"], capture_output=True, text=True)
+    return proc.stdout if proc.returncode == 0 else None
+
+
+def _load_metadata(content: str) -> JobScriptMetadata | None:
+    """Parse the content of a metadata.yaml file, returning None if it is not valid."""
+    import yaml
+
+    try:
+        return JobScriptMetadata(**yaml.safe_load(content))
+    except Exception as err:
+        logger.debug(f"Ignoring invalid metadata: {err}")
+        return None
+
+
+def _image_files(job_script_path: Path, metadata: JobScriptMetadata) -> set[Path]:
+    """Return the files, relative to the job script, that are part of its Docker build context."""
+    dockerfile_path = resolve_dockerfile(job_script_path, metadata.image_source)
+    if not dockerfile_path.exists():
+        return set()
+    try:
+        files = build_context_files(job_script_path, dockerfile_path)
+    except (FileNotFoundError, ValueError) as err:
+        # a Dockerfile caught in the middle of an edit may not parse, such as an unclosed quote
+        logger.warning(f"Considering only the Dockerfile of {job_script_path} as its build context: {err}")
+        files = [dockerfile_path]
+    return {path.relative_to(job_script_path) for path in files}
+
+
+def _metadata_kinds(previous: JobScriptMetadata | None, current: JobScriptMetadata) -> set[ChangeKind]:
+    """Classify a change of the metadata by the fields that differ."""
+    if previous is None:
+        return set(ChangeKind)
+    changed_fields = {
+        field
+        for field in JobScriptMetadata.model_fields
+        if getattr(previous, field) != getattr(current, field)
+    }
+    kinds = {ChangeKind.CATALOG} if changed_fields else set()
+    if changed_fields & IMAGE_FIELDS:
+        kinds.add(ChangeKind.IMAGE)
+    if changed_fields & FILES_FIELDS:
+        kinds.add(ChangeKind.FILES)
+    return kinds
+
+
+def classify_changes(
+    job_script_path: Path, paths: list[Path], previous_content: str | None
+) -> JobScriptChange:
+    """Classify the changed paths of a job script, relative to its directory, by the artifacts they affect.
+
+    The previous content of the metadata.yaml file is None if the job script did not exist before.
+    """
+    change = JobScriptChange(name=job_script_path.name, paths=[path.as_posix() for path in paths])
+    if not (job_script_path / "metadata.yaml").exists():
+        change.removed = previous_content is not None
+        change.kinds = {ChangeKind.CATALOG} if change.removed else set()
+        return change
+    metadata = _load_metadata((job_script_path / "metadata.yaml").read_text())
+    if previous_content is None or metadata is None:
+        # new job scripts, and the ones that cannot be parsed, are published entirely
+        change.kinds = set(ChangeKind)
+        return change
+
+    image_files = _image_files(job_script_path, metadata)
+    published_files = {metadata.entrypoint, *(metadata.supporting_files or [])}
+    for path in paths:
+        if path == Path("metadata.yaml"):
+            change.kinds |= _metadata_kinds(_load_metadata(previous_content), metadata)
+        if path in image_files:
+            change.kinds.add(ChangeKind.IMAGE)
+        if path in published_files:
+            change.kinds.add(ChangeKind.FILES)
+        if path == Path("README.md"):
+            change.kinds.add(ChangeKind.CATALOG)
+    return change
+
+
+def group_by_job_script(paths: list[Path]) -> dict[str, list[Path]]:
+    """Group the changed paths by job script directory, relative to it, leaving the other paths out."""
+    paths_by_job_script: dict[str, list[Path]] = defaultdict(list)
+    for path in paths:
+        if len(path.parts) > 1:
+            paths_by_job_script[path.parts[0]].append(Path(*path.parts[1:]))
+    return dict(sorted(paths_by_job_script.items()))
+
+
+def detect_changes(since: str) -> dict[str, JobScriptChange]:
+    """Detect the job scripts of the current directory changed since the reference, by name.
+
+    Changes outside of the job script directories, and the ones affecting none of their artifacts,
+    such as the built .sif files, are left out.
+    """
+    changes = {}
+    for name, paths in group_by_job_script(list_changed_paths(since)).items():
+        change = classify_changes(Path(name), paths, _read_at(since, Path(name) / "metadata.yaml"))
+        logger.debug(f"Changes of {name} since {since}: {sorted(change.kinds)} from {change.paths}")
+        if change.kinds:
+            changes[name] = change
+    return changes
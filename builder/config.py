@@ -23,6 +23,14 @@ class Settings(BaseModel):
     aws_session_token: Optional[str] = None
     s3_bucket: str
     s3_bucket_region: str
+    oci_registry: Optional[str] = None
+    oci_registry_plain_http: bool = False
+    s3_multipart_threshold: int = 8
+    s3_multipart_chunksize: int = 8
+    s3_max_concurrency: int = 10
+    max_attempts: int = 5
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 30.0
 
 
 def init_settings(**settings_values):
@@ -0,0 +1,165 @@
+"""Core module for parsing Dockerfiles and assembling minimal Docker build contexts."""
+
+import io
+import json
+import shlex
+import tarfile
+import tempfile
+from pathlib import Path
+from typing import IO
+
+from pydantic import BaseModel
+
+# name of the Dockerfile when the metadata does not point at another file
+DEFAULT_DOCKERFILE = "Dockerfile"
+
+# contexts larger than this are spooled to disk instead of being kept in memory
+CONTEXT_SPOOL_SIZE = 64 * 1024 * 1024
+
+
+class DockerfileInstruction(BaseModel):
+    """A single instruction of a Dockerfile, with its continuation lines joined."""
+
+    keyword: str
+    arguments: str
+    # verbatim lines of the instruction, which Docker uses as the layer cache key
+    source: str = ""
+
+    @property
+    def flags(self) -> dict[str, str]:
+        """Return the --flag=value options preceding the arguments, e.g. --from of COPY."""
+        flags = {}
+        for token in shlex.split(self.arguments):
+            if not token.startswith("--"):
+                break
+            (name, _, value) = token[2:].partition("=")
+            flags[name] = value
+        return flags
+
+    @property
+    def operands(self) -> list[str]:
+        """Return the arguments that follow the flags, supporting both the shell and the JSON forms."""
+        arguments = self.arguments
+        while arguments.startswith("--"):
+            arguments = arguments.partition(" ")[2].lstrip()
+        if arguments.startswith("["):
+            try:
+                return json.loads(arguments)
+            except json.JSONDecodeError:
+                pass
+        return shlex.split(arguments)
+
+
+def parse_dockerfile(dockerfile_path: Path) -> list[DockerfileInstruction]:
+    """Parse a Dockerfile into its instructions, skipping comments and joining continuation lines."""
+    instructions = []
+    pending = ""
+    lines: list[str] = []
+    for line in dockerfile_path.read_text().splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        lines.append(line.rstrip())
+        if stripped.endswith("\\"):
+            pending += stripped[:-1] + " "
+            continue
+        (keyword, _, arguments) = (pending + stripped).partition(" ")
+        instructions.append(
+            DockerfileInstruction(
+                keyword=keyword.upper(), arguments=arguments.strip(), source="\n".join(lines)
+            )
+        )
+        (pending, lines) = ("", [])
+    return instructions
+
+
+def base_images(instructions: list[DockerfileInstruction]) -> list[str]:
+    """Return the images the stages of a Dockerfile start from, excluding its own stages."""
+    (images, stages) = ([], set())
+    for instruction in instructions:
+        if instruction.keyword != "FROM":
+            continue
+        operands = instruction.operands
+        if operands[0] not in stages and operands[0] != "scratch" and "$" not in operands[0]:
+            images.append(operands[0])
+        if len(operands) == 3 and operands[1].upper() == "AS":
+            stages.add(operands[2])
+    return list(dict.fromkeys(images))
+
+
+def shareable_prefix(instructions: list[DockerfileInstruction]) -> list[DockerfileInstruction]:
+    """Return the leading instructions of the first stage that do not read from the build context.
+
+    Those instructions yield the same layers for every Dockerfile starting with them, so they can be
+    built once and reused from the layer cache by all of them.
+    """
+    prefix: list[DockerfileInstruction] = []
+    for instruction in instructions:
+        if instruction.keyword in ("COPY", "ADD", "ONBUILD") or (instruction.keyword == "FROM" and prefix):
+            break
+        prefix.append(instruction)
+    return prefix
+
+
+def resolve_dockerfile(job_script_path: Path, image_source: str | None) -> Path:
+    """Return the Dockerfile of a job script, which the image source may name."""
+    if image_source is not None and job_script_path.joinpath(image_source).is_file():
+        return job_script_path / image_source
+    return job_script_path / DEFAULT_DOCKERFILE
+
+
+def build_context_files(job_script_path: Path, dockerfile_path: Path) -> list[Path]:
+    """Return the files the Dockerfile needs from the job script directory, including itself.
+
+    Only the sources of the COPY and ADD instructions that read from the build context are kept,
+    which excludes remote sources and copies from other build stages. Apptainer images are never
+    part of the context, even when a whole directory is copied.
+    """
+    files = {dockerfile_path}
+    for instruction in parse_dockerfile(dockerfile_path):
+        if instruction.keyword not in ("COPY", "ADD") or "from" in instruction.flags:
+            continue
+        for source in instruction.operands[:-1]:
+            if "://" in source or source.startswith("git@"):
+                continue
+            pattern = source.removeprefix("./").strip("/")
+            matches = list(job_script_path.glob(pattern)) if pattern not in ("", ".") else [job_script_path]
+            if not matches:
+                raise FileNotFoundError(f"COPY/ADD source {source} not found in {job_script_path}")
+            for match in matches:
+                if match.is_dir():
+                    files.update(path for path in match.rglob("*") if path.is_file())
+                else:
+                    files.add(match)
+    return sorted(path for path in files if path.suffix != ".sif")
+
+
+def dockerfile_tarball(content: str) -> tuple[IO[bytes], int]:
+    """Assemble a build context holding only a Dockerfile with the given content."""
+    tarball = tempfile.SpooledTemporaryFile(max_size=CONTEXT_SPOOL_SIZE)
+    data = content.encode()
+    with tarfile.open(fileobj=tarball, mode="w") as tar:
+        info = tarfile.TarInfo(DEFAULT_DOCKERFILE)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    size = tarball.tell()
+    tarball.seek(0)
+    return (tarball, size)
+
+
+def build_context_tarball(job_script_path: Path, files: list[Path]) -> tuple[IO[bytes], int]:
+    """Assemble the given files into an uncompressed tarball to be streamed to the Docker daemon.
+
+    The ownership and modification times are normalized, so identical contents yield identical
+    tarballs. Return the tarball, rewound, and its size in bytes.
+    """
+    tarball = tempfile.SpooledTemporaryFile(max_size=CONTEXT_SPOOL_SIZE)
+    with tarfile.open(fileobj=tarball, mode="w") as tar:
+        for path in files:
+            info = tar.gettarinfo(str(path), arcname=path.relative_to(job_script_path).as_posix())
+            (info.uid, info.gid, info.uname, info.gname, info.mtime) = (0, 0, "", "", 0)
+            with open(path, "rb") as file:
+                tar.addfile(info, file)
+    size = tarball.tell()
+    tarball.seek(0)
+    return (tarball, size)
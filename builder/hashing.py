@@ -0,0 +1,16 @@
+"""Core module for content hashing operations."""
+
+import hashlib
+from pathlib import Path
+
+# size of the chunks read from disk when hashing files
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def hash_file(path: Path, algorithm: str = "sha256") -> str:
+    """Return the hexadecimal digest of a file's content without loading it entirely in memory."""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,160 @@
+"""Core module for the history of the build and push durations of the job scripts.
+
+The history is kept in a SQLite database under the cache directory. It is used to start the
+longest job scripts first, which shortens the total duration of a run when the job scripts do not
+all take the same time, and to estimate that duration beforehand.
+"""
+
+import heapq
+import sqlite3
+import statistics
+import time
+from contextlib import closing
+from pathlib import Path
+
+from loguru import logger
+
+from builder.cache import cache_dir
+from builder.schemas import HistoryRecord, HistorySummary
+
+history_path: Path = cache_dir / "history.sqlite"
+
+# number of recent records of a job script phase averaged to estimate its next duration
+ESTIMATE_WINDOW = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    job_script TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    duration REAL NOT NULL,
+    size INTEGER,
+    setting TEXT,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_job_script_phase ON history (job_script, phase, recorded_at);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    """Open the history database, creating it if needed."""
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(history_path, timeout=30)
+    connection.executescript(SCHEMA)
+    # databases created before the build settings were recorded lack their column
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(history)")}
+    if "setting" not in columns:
+        connection.execute("ALTER TABLE history ADD COLUMN setting TEXT")
+    return connection
+
+
+def record_history(
+    job_script: str, phase: str, duration: float, size: int | None = None, setting: str | None = None
+):
+    """Record the duration of a phase of a job script, along with the setting it ran with.
+
+    Failing to record it only affects the scheduling of later runs, so it is logged and ignored.
+    """
+    try:
+        with closing(_connect()) as connection, connection:
+            connection.execute(
+                "INSERT INTO history (job_script, phase, duration, size, setting, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_script, phase, duration, size, setting, time.time()),
+            )
+    except sqlite3.Error as err:
+        logger.warning(f"Could not record the {phase} duration of {job_script} in {history_path}: {err}")
+
+
+def list_history(job_scripts: list[str] | None = None, limit: int | None = None) -> list[HistoryRecord]:
+    """Return the recorded history, most recent first, optionally for some job scripts only."""
+    query = "SELECT job_script, phase, duration, size, setting, recorded_at FROM history"
+    params: list[str | int] = []
+    if job_scripts:
+        query += f" WHERE job_script IN ({', '.join('?' for _ in job_scripts)})"
+        params.extend(job_scripts)
+    query += " ORDER BY recorded_at DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    with closing(_connect()) as connection:
+        rows = connection.execute(query, params).fetchall()
+    fields = ["job_script", "phase", "duration", "size", "setting", "recorded_at"]
+    return [HistoryRecord(**dict(zip(fields, row))) for row in rows]
+
+
+def summarize_settings(job_scripts: list[str] | None = None, phase: str = "build") -> list[HistorySummary]:
+    """Return the average duration and artifact size of a phase of the job scripts for each setting."""
+    query = (
+        "SELECT job_script, COALESCE(setting, 'default'), COUNT(*), AVG(duration), AVG(size) "
+        "FROM history WHERE phase = ?"
+    )
+    params = [phase]
+    if job_scripts:
+        query += f" AND job_script IN ({', '.join('?' for _ in job_scripts)})"
+        params.extend(job_scripts)
+    query += " GROUP BY job_script, COALESCE(setting, 'default') ORDER BY job_script, AVG(duration)"
+    with closing(_connect()) as connection:
+        rows = connection.execute(query, params).fetchall()
+    fields = ["job_script", "setting", "runs", "duration", "size"]
+    return [HistorySummary(**dict(zip(fields, row))) for row in rows]
+
+
+def clear_history(job_scripts: list[str] | None = None) -> int:
+    """Delete the recorded history, optionally for some job scripts only, returning the deleted count."""
+    with closing(_connect()) as connection, connection:
+        if job_scripts:
+            placeholders = ", ".join("?" for _ in job_scripts)
+            cursor = connection.execute(
+                f"DELETE FROM history WHERE job_script IN ({placeholders})", job_scripts
+            )
+        else:
+            cursor = connection.execute("DELETE FROM history")
+        return cursor.rowcount
+
+
+def estimate_durations(job_scripts: list[str], phases: list[str]) -> dict[str, float | None]:
+    """Estimate the duration of the given phases of each job script from their recent history.
+
+    The estimate of a job script is the sum of the average of its last records for each phase, or
+    None if any of the phases was never recorded.
+    """
+    estimates: dict[str, float | None] = {}
+    try:
+        with closing(_connect()) as connection:
+            for job_script in job_scripts:
+                total: float | None = 0.0
+                for phase in phases:
+                    rows = connection.execute(
+                        "SELECT duration FROM history WHERE job_script = ? AND phase = ? "
+                        "ORDER BY recorded_at DESC LIMIT ?",
+                        (job_script, phase, ESTIMATE_WINDOW),
+                    ).fetchall()
+                    if not rows or total is None:
+                        total = None
+                        continue
+                    total += statistics.fmean(row[0] for row in rows)
+                estimates[job_script] = total
+    except sqlite3.Error as err:
+        logger.warning(f"Could not read the history from {history_path}: {err}")
+        estimates = {job_script: None for job_script in job_scripts}
+    return estimates
+
+
+def order_longest_first(estimates: dict[str, float | None]) -> list[str]:
+    """Order the job scripts by decreasing estimated duration.
+
+    Job scripts without history come first, since they may well be the longest ones.
+    """
+    return sorted(estimates, key=lambda name: (estimates[name] is not None, -(estimates[name] or 0.0)))
+
+
+def estimate_makespan(durations: list[float], workers: int) -> float:
+    """Estimate the total duration of running jobs on a number of workers, longest first.
+
+    Each job is assigned to the least loaded worker, which is what a semaphore does when the jobs
+    are started in that order.
+    """
+    loads = [0.0] * max(1, workers)
+    for duration in sorted(durations, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + duration)
+    return max(loads)
@@ -0,0 +1,366 @@
+"""Core module for the shared cache of the Apptainer images pulled on the clusters.
+
+Images are stored under the digest of their SIF layer in a directory shared by the nodes of a
+cluster, such as an NFS mount. A POSIX lock per digest, which NFS supports, lets a single process
+download an image while the others wait for it, and each download is checked against its digest
+before being renamed into place. The modification time of an image is refreshed whenever it is
+pulled, so the least recently used images are evicted first once the cache outgrows its size.
+"""
+
+from __future__ import annotations
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import socket
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from loguru import logger
+
+from builder.exceptions import Abort
+from builder.hashing import hash_file
+from builder.registry import RegistryClient
+from builder.retry import is_transient_error, retry_call
+from builder.schemas import CatalogPointer, ImageRef, PullSettings
+from builder.types import JobScriptCatalog
+
+# media type of the layer holding the SIF file in the artifacts pushed by apptainer
+SIF_LAYER_MEDIA_TYPE = "application/vnd.sylabs.sif.layer.v1.sif"
+
+# size of the ranges of an image downloaded concurrently
+DOWNLOAD_CHUNK_SIZE = 64 * 1024**2
+
+# size of the buffer each range is streamed to disk through
+DOWNLOAD_BUFFER_SIZE = 1024**2
+
+# age, in seconds, after which a partial download is considered abandoned by a dead process
+PARTIAL_MAX_AGE = 24 * 3600
+
+# lock taken by the process evicting images, so concurrent pulls do not evict together
+EVICT_LOCK = "evict"
+
+
+def parse_oras_url(url: str) -> tuple[str, str, str]:
+    """Split an oras:// image URL into the domain of its registry, its repository and its tag or digest."""
+    Abort.require_condition(
+        url.startswith("oras://"),
+        f"Only images pushed to an OCI registry can be pulled, not {url}",
+        raise_kwargs=dict(subject="Unsupported image URL", log_message=f"Unsupported image URL {url}"),
+    )
+    (domain, _, path) = url.removeprefix("oras://").partition("/")
+    if "@" in path:
+        (repository, _, reference) = path.partition("@")
+    else:
+        (repository, _, reference) = path.rpartition(":") if ":" in path else (path, "", "latest")
+    return (domain, repository, reference)
+
+
+def _read_source(source: str) -> Any:
+    """Load a YAML or JSON document from a local path or an http(s) URL."""
+    import yaml
+
+    if urllib.parse.urlsplit(source).scheme in ("http", "https"):
+        logger.debug(f"Fetching {source}")
+        with urllib.request.urlopen(source) as response:
+            return yaml.safe_load(response.read())
+    with open(source) as source_file:
+        return yaml.safe_load(source_file)
+
+
+def load_catalog_source(source: str, settings: PullSettings) -> JobScriptCatalog:
+    """Load the catalog from a path or URL, following the pointer of a published catalog.
+
+    The compact index of a sharded catalog holds the image URLs, so it is preferred over the full
+    catalog when the pointer names one.
+    """
+    document = retry_call(_read_source, source, settings=settings, description=f"download of {source}")
+    if isinstance(document, dict) and "job-scripts" not in document:
+        pointer = CatalogPointer.model_validate(document)
+        target = urllib.parse.urljoin(source, pointer.index or pointer.catalog)
+        logger.debug(f"Following the catalog pointer {source} to {target}")
+        document = retry_call(_read_source, target, settings=settings, description=f"download of {target}")
+    Abort.require_condition(
+        isinstance(document, dict) and isinstance(document.get("job-scripts"), list),
+        f"{source} is not a catalog of job scripts",
+        raise_kwargs=dict(subject="Invalid catalog", log_message=f"Invalid catalog {source}"),
+    )
+    return document
+
+
+def select_image_url(catalog: JobScriptCatalog, name: str, tag: str | None = None) -> str:
+    """Return the URL of the image of a job script with the given tag, or its latest or first image."""
+    entry = next((entry for entry in catalog["job-scripts"] if entry["name"] == name), None)
+    Abort.require_condition(
+        entry is not None,
+        f"Job script {name} is not in the catalog",
+        raise_kwargs=dict(subject="Unknown job script", log_message=f"Job script {name} not found"),
+    )
+    assert entry is not None
+    urls = [url for url in entry.get("apptainer-image-urls") or [] if isinstance(url, str)]
+    Abort.require_condition(
+        len(urls) > 0,
+        f"Job script {name} has no Apptainer image",
+        raise_kwargs=dict(subject="No image", log_message=f"Job script {name} has no image"),
+    )
+    if tag is not None:
+        url = next((url for url in urls if url.endswith(f":{tag}")), None)
+        Abort.require_condition(
+            url is not None,
+            f"Job script {name} has no image tagged {tag}, only:\n" + "\n".join(urls),
+            raise_kwargs=dict(subject="Unknown tag", log_message=f"Tag {tag} of {name} not found"),
+        )
+        assert url is not None
+        return url
+    return next((url for url in urls if url.endswith(":latest")), urls[0])
+
+
+def download_blob(url: str, headers: dict[str, str], size: int, destination: Path, settings: PullSettings):
+    """Download a blob into the destination with concurrent range requests, retrying each range.
+
+    The first range tells whether the server honors ranges. If it does not, the whole blob is
+    streamed by that first request.
+    """
+
+    def fetch(start: int, end: int) -> bool:
+        request = urllib.request.Request(url, headers={**headers, "Range": f"bytes={start}-{end}"})
+        with urllib.request.urlopen(request) as response, open(destination, "r+b") as output:
+            ranged = response.status == 206
+            output.seek(start if ranged else 0)
+            shutil.copyfileobj(response, output, DOWNLOAD_BUFFER_SIZE)
+        return ranged
+
+    def fetch_range(start: int) -> bool:
+        end = min(start + DOWNLOAD_CHUNK_SIZE, size) - 1
+        return retry_call(
+            fetch, start, end, settings=settings, description=f"download of bytes {start}-{end} of {url}"
+        )
+
+    with open(destination, "wb") as output:
+        output.truncate(size)
+    if size == 0:
+        return
+    starts = range(0, size, DOWNLOAD_CHUNK_SIZE)
+    if not fetch_range(starts[0]):
+        logger.debug(f"{url.split('?')[0]} does not serve ranges, downloaded it in a single request")
+        return
+    with ThreadPoolExecutor(settings.jobs) as executor:
+        list(executor.map(fetch_range, starts[1:]))
+
+
+def _mtime(path: Path, default: float) -> float:
+    """Return the modification time of a file, or the default if it is already gone."""
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return default
+
+
+class ImageCache:
+    """Cache of images shared by concurrent processes, possibly running on several nodes."""
+
+    def __init__(self, directory: Path, max_size: int):  # noqa: D107
+        self.directory = directory
+        self.max_size = max_size
+        self.blobs_dir = directory / "blobs" / "sha256"
+        self.locks_dir = directory / "locks"
+        self.refs_dir = directory / "refs"
+        for path in (self.blobs_dir, self.locks_dir, self.refs_dir):
+            path.mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, digest: str) -> Path:
+        """Return the path of the image with the given sha256 digest."""
+        return self.blobs_dir / f"{digest.removeprefix('sha256:')}.sif"
+
+    def _ref_path(self, url: str) -> Path:
+        return self.refs_dir / f"{hashlib.sha256(url.encode()).hexdigest()[:32]}.json"
+
+    def find_ref(self, url: str) -> ImageRef | None:
+        """Return the digest an image URL was last resolved to, if its image is still cached."""
+        path = self._ref_path(url)
+        if not path.exists():
+            return None
+        ref = ImageRef.model_validate_json(path.read_text())
+        return ref if self.blob_path(ref.digest).exists() else None
+
+    def save_ref(self, ref: ImageRef):
+        """Record the digest an image URL resolved to, replacing the file so readers never see half of it."""
+        path = self._ref_path(ref.url)
+        partial_path = path.with_name(f".{path.name}.{os.getpid()}.partial")
+        partial_path.write_text(ref.model_dump_json())
+        partial_path.chmod(0o644)
+        partial_path.replace(path)
+
+    @contextmanager
+    def lock(self, name: str, blocking: bool = True) -> Iterator[bool]:
+        """Hold the named lock, yielding whether it was acquired.
+
+        Locks are taken with fcntl.lockf, whose POSIX locks are honored across the nodes sharing an
+        NFS mount, unlike the ones of flock. Without blocking, a lock held by another process is
+        not acquired.
+        """
+        path = self.locks_dir / f"{name}.lock"
+        with open(path, "a+") as lock_file:
+            try:
+                os.chmod(path, 0o666)
+            except PermissionError:
+                pass
+            try:
+                fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as err:
+                if err.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+                if not blocking:
+                    yield False
+                    return
+                logger.info(f"Waiting for another process holding the {name} lock of the image cache")
+                fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                yield True
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+    def _is_valid(self, path: Path, digest: str, verify: bool) -> bool:
+        """Check if an image is cached, verifying its digest again if asked to."""
+        if not path.exists():
+            return False
+        if verify and f"sha256:{hash_file(path)}" != digest:
+            logger.warning(f"Cached image {path} does not match its digest {digest}, downloading it again")
+            return False
+        return True
+
+    def fetch(self, digest: str, download: Callable[[Path], None], verify: bool = False) -> Path:
+        """Return the path of the image with the given digest, downloading it if it is not cached.
+
+        Only one process downloads a given image, while the others wait for its lock and find the
+        image in the cache once they acquire it. The image is touched under its lock, so a
+        concurrent eviction, which skips the locked images, cannot remove it in between.
+        """
+        path = self.blob_path(digest)
+        with self.lock(digest.removeprefix("sha256:")):
+            if not self._is_valid(path, digest, verify):
+                self._download(path, digest, download)
+            os.utime(path)
+        return path
+
+    def _download(self, path: Path, digest: str, download: Callable[[Path], None]):
+        """Download an image next to its path, then move it in place once its digest is verified."""
+        partial_path = path.with_name(f".{path.stem}.{socket.gethostname()}.{os.getpid()}.partial")
+        start = time.monotonic()
+        try:
+            download(partial_path)
+            actual = f"sha256:{hash_file(partial_path)}"
+            Abort.require_condition(
+                actual == digest,
+                f"The downloaded image has the digest {actual} instead of {digest}",
+                raise_kwargs=dict(subject="Corrupted download", log_message=f"Digest mismatch for {digest}"),
+            )
+            partial_path.chmod(0o644)
+            partial_path.replace(path)
+        finally:
+            partial_path.unlink(missing_ok=True)
+        logger.debug(f"Downloaded image {digest} in {time.monotonic() - start:.1f}s")
+
+    def evict(self, keep: set[Path]) -> list[Path]:
+        """Evict the least recently used images until the cache fits in its size, returning them.
+
+        Images in use by a download of another process, or kept by the caller, are never evicted,
+        and partial downloads abandoned by dead processes are removed. Eviction is skipped when
+        another process is already evicting.
+        """
+        evicted: list[Path] = []
+        with self.lock(EVICT_LOCK, blocking=False) as acquired:
+            if not acquired:
+                return evicted
+            now = time.time()
+            for partial_path in self.blobs_dir.glob(".*.partial"):
+                if now - _mtime(partial_path, now) > PARTIAL_MAX_AGE:
+                    logger.debug(f"Removing the abandoned download {partial_path}")
+                    partial_path.unlink(missing_ok=True)
+            images = sorted(
+                ((path, path.stat()) for path in self.blobs_dir.glob("*.sif")),
+                key=lambda item: item[1].st_mtime,
+            )
+            total_size = sum(stat.st_size for (_, stat) in images)
+            for path, stat in images:
+                if total_size <= self.max_size:
+                    break
+                if path in keep:
+                    continue
+                with self.lock(path.stem, blocking=False) as free:
+                    # images being pulled, or pulled since they were listed, are in use
+                    if not free or _mtime(path, now) != stat.st_mtime:
+                        continue
+                    logger.debug(
+                        f"Evicting the image {path.name}, last used {(now - stat.st_mtime) / 3600:.1f}h ago"
+                    )
+                    path.unlink(missing_ok=True)
+                total_size -= stat.st_size
+                evicted.append(path)
+        return evicted
+
+
+def resolve_image(registry: RegistryClient, url: str, cache: ImageCache, settings: PullSettings) -> ImageRef:
+    """Resolve an image URL to the digest and size of its SIF layer.
+
+    The tag is resolved again on every pull, so a republished image replaces the cached one. When
+    the registry cannot be reached, the digest it last resolved to is used if its image is cached.
+    """
+    (_, repository, reference) = parse_oras_url(url)
+    try:
+        manifest = retry_call(
+            registry.get_manifest,
+            repository,
+            reference,
+            settings=settings,
+            description=f"resolution of {url}",
+        )
+    except Exception as err:
+        if not is_transient_error(err) or (ref := cache.find_ref(url)) is None:
+            raise
+        logger.warning(f"Could not resolve {url}, using the image cached {ref.digest}: {err}")
+        return ref
+    Abort.require_condition(
+        manifest is not None,
+        f"Image {url} does not exist",
+        raise_kwargs=dict(subject="Image not found", log_message=f"Image {url} not found"),
+    )
+    assert manifest is not None
+    layers: list[dict[str, Any]] = json.loads(manifest.content).get("layers", [])
+    Abort.require_condition(
+        len(layers) > 0,
+        f"Image {url} has no layer",
+        raise_kwargs=dict(subject="Invalid image", log_message=f"Image {url} has no layer"),
+    )
+    layer = next((layer for layer in layers if layer.get("mediaType") == SIF_LAYER_MEDIA_TYPE), layers[0])
+    ref = ImageRef(url=url, digest=layer["digest"], size=layer["size"], resolved_at=time.time())
+    cache.save_ref(ref)
+    return ref
+
+
+def pull_image(url: str, settings: PullSettings, verify: bool = False) -> Path:
+    """Return the path of the cached image of an oras:// URL, downloading it if needed."""
+    (domain, repository, _) = parse_oras_url(url)
+    cache = ImageCache(settings.cache_dir, settings.max_cache_size)
+    registry = RegistryClient(domain)
+    ref = resolve_image(registry, url, cache, settings)
+    logger.debug(f"Image {url} resolved to {ref.digest} ({ref.size} bytes)")
+
+    def download(destination: Path):
+        (blob_url, headers) = retry_call(
+            registry.locate_blob, repository, ref.digest, settings=settings, description=f"location of {url}"
+        )
+        download_blob(blob_url, headers, ref.size, destination, settings)
+
+    path = cache.fetch(ref.digest, download, verify)
+    for evicted in cache.evict(keep={path}):
+        logger.info(f"Evicted the least recently used image {evicted.name} from the image cache")
+    return path
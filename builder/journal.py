@@ -0,0 +1,84 @@
+"""Core module for the journals of the publish runs, from which an interrupted run is resumed.
+
+Each completed step of a run, such as a pushed tag or an uploaded file, is appended to the journal
+of its command along with the digest of the published content. A resumed run skips the steps
+whose digest did not change, while a new run starts from an empty journal.
+"""
+
+import threading
+import time
+
+from loguru import logger
+from pydantic import ValidationError
+
+from builder.cache import cache_dir
+from builder.schemas import JournalStep
+
+journal_dir = cache_dir / "journals"
+
+
+class RunJournal:
+    """Append-only journal of the steps completed by a publish command."""
+
+    def __init__(self, name: str, resume: bool = False):  # noqa: D107
+        self.path = journal_dir / f"{name}.jsonl"
+        self._lock = threading.Lock()
+        self._steps: dict[tuple[str, str, str], JournalStep] = {}
+        journal_dir.mkdir(parents=True, exist_ok=True)
+        if not resume:
+            self.path.unlink(missing_ok=True)
+            return
+        if not self.path.exists():
+            logger.warning(f"No journal found at {self.path}. Starting from scratch")
+            return
+        for line in self.path.read_text().splitlines():
+            try:
+                step = JournalStep.model_validate_json(line)
+            except ValidationError:
+                # the last line may have been cut short by the interruption
+                logger.debug(f"Skipping an unreadable journal line: {line!r}")
+                continue
+            self._steps[(step.job_script, step.artifact, step.tag)] = step
+        logger.debug(f"Loaded {len(self._steps)} steps from the journal {self.path}")
+
+    def find(self, job_script: str, artifact: str, tag: str, digest: str) -> JournalStep | None:
+        """Return the recorded step of an artifact, if it was recorded for the same digest."""
+        with self._lock:
+            step = self._steps.get((job_script, artifact, tag))
+        return step if step is not None and step.digest == digest else None
+
+    def is_done(self, job_script: str, artifact: str, tag: str, digest: str) -> bool:
+        """Check if a step was completed for the same digest."""
+        done = self.find(job_script, artifact, tag, digest) is not None
+        if done:
+            logger.debug(f"Skipping the {artifact} {tag} of {job_script}, completed by a previous run")
+        return done
+
+    def completed(self, job_script: str, artifact: str, tags: list[str], digest: str) -> list[str]:
+        """Return the tags of an artifact whose step was completed for the same digest."""
+        return [tag for tag in tags if self.is_done(job_script, artifact, tag, digest)]
+
+    def record(self, job_script: str, artifact: str, tag: str, digest: str, upload_id: str | None = None):
+        """Append a completed step to the journal, flushing it so it survives an interruption."""
+        step = JournalStep(
+            job_script=job_script,
+            artifact=artifact,
+            tag=tag,
+            digest=digest,
+            upload_id=upload_id,
+            completed_at=time.time(),
+        )
+        with self._lock:
+            self._steps[(job_script, artifact, tag)] = step
+            with open(self.path, "a") as journal_file:
+                journal_file.write(step.model_dump_json() + "\n")
+
+    def record_all(self, job_script: str, artifact: str, tags: list[str], digest: str):
+        """Append the completed steps of several tags of an artifact to the journal."""
+        for tag in tags:
+            self.record(job_script, artifact, tag, digest)
+
+    def complete(self):
+        """Delete the journal once the run succeeded, since there is nothing left to resume."""
+        logger.debug(f"Removing the journal {self.path} of the completed run")
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,57 @@
+"""Core module for detecting the layers shared by the Dockerfiles of several job scripts.
+
+Job scripts often start from the same image and install the same packages before diverging.
+Building those shared instructions once, before the job scripts that use them, lets the following
+builds reuse the layers from the cache instead of running the same steps concurrently.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Any
+
+from builder.dockerfile import parse_dockerfile, shareable_prefix
+from builder.schemas import SharedStage
+
+# a shared stage must hold at least one instruction besides FROM, which pre-pulling already covers
+MIN_SHARED_DEPTH = 2
+
+
+def find_shared_stages(dockerfiles: dict[str, Path]) -> list[SharedStage]:
+    """Find the leading instructions shared by the Dockerfiles of several job scripts.
+
+    The shareable prefixes of the Dockerfiles are arranged in a trie keyed by the verbatim source of
+    each instruction. A stage is kept where a group of at least two job scripts diverges, so nested
+    groups yield nested stages, which are returned shallowest first.
+    """
+    root: dict[str, Any] = {"children": {}, "job_scripts": set()}
+    for name, dockerfile_path in dockerfiles.items():
+        node = root
+        for instruction in shareable_prefix(parse_dockerfile(dockerfile_path)):
+            node = node["children"].setdefault(instruction.source, {"children": {}, "job_scripts": set()})
+            node["job_scripts"].add(name)
+
+    stages = []
+    pending: list[tuple[dict[str, Any], list[str]]] = [(root, [])]
+    while pending:
+        (node, sources) = pending.pop()
+        for source, child in node["children"].items():
+            job_scripts = child["job_scripts"]
+            if len(job_scripts) < 2:
+                continue
+            child_sources = [*sources, source]
+            diverges = all(
+                len(grandchild["job_scripts"]) < len(job_scripts) for grandchild in child["children"].values()
+            )
+            if diverges and len(child_sources) >= MIN_SHARED_DEPTH:
+                dockerfile = "\n".join(child_sources) + "\n"
+                digest = hashlib.sha256(dockerfile.encode()).hexdigest()[:12]
+                stages.append(
+                    SharedStage(
+                        tag=f"vantage-base-{digest}:latest",
+                        dockerfile=dockerfile,
+                        depth=len(child_sources),
+                        job_scripts=sorted(job_scripts),
+                    )
+                )
+            pending.append((child, child_sources))
+    return sorted(stages, key=lambda stage: (stage.depth, stage.tag))
@@ -1,5 +1,9 @@
 """Main module for the Vantage Jobs Catalog CLI app."""
 
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
 import snick
 import typer
 
@@ -7,13 +11,29 @@ from builder.context import CliContext
 from builder.exceptions import handle_abort
 from builder.format import terminal_message
 from builder.logging import init_logs
-from builder.subapps import apptainer_app, catalog_app, files_app, settings_app
+from builder.subapps import (
+    apptainer_app,
+    cache_app,
+    catalog_app,
+    files_app,
+    history_app,
+    pipeline_app,
+    settings_app,
+)
+from builder.subapps.pull import pull
+from builder.subapps.watch import watch
+from builder.tracing import tracer
 
 app = typer.Typer(name="Vantage Jobs Catalog")
 app.add_typer(settings_app, name="settings")
 app.add_typer(apptainer_app, name="apptainer")
 app.add_typer(files_app, name="files")
 app.add_typer(catalog_app, name="catalog")
+app.add_typer(cache_app, name="cache")
+app.add_typer(pipeline_app, name="pipeline")
+app.add_typer(history_app, name="history")
+app.command(name="watch")(watch)
+app.command(name="pull")(pull)
 
 
 @app.callback(invoke_without_command=True)
@@ -21,6 +41,12 @@ app.add_typer(catalog_app, name="catalog")
 def main(
     ctx: typer.Context,
     verbose: bool = typer.Option(False, help="Enable verbose logging to the terminal"),
+    report: Optional[Path] = typer.Option(
+        None, help="Write a JSON report with the duration, bytes and decisions of every phase to this file."
+    ),
+    trace: Optional[Path] = typer.Option(
+        None, help="Write a Chrome trace of every phase to this file, to be opened in Perfetto."
+    ),
 ):
     """Welcome to the Vantage Jobs Catalog CLI!.
 
@@ -42,3 +68,8 @@ def main(
 
     init_logs(verbose=verbose)
     ctx.obj = CliContext(verbose=verbose)
+    # the files are written even when the command fails, which is when they are most useful
+    if report is not None:
+        ctx.call_on_close(partial(tracer.write_report, report))
+    if trace is not None:
+        ctx.call_on_close(partial(tracer.write_chrome_trace, trace))
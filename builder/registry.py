@@ -0,0 +1,166 @@
+"""Core module for talking to OCI registries through the distribution API."""
+
+import base64
+import json
+import re
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any
+
+from loguru import logger
+from pydantic import BaseModel
+
+# status codes of the redirects to the storage holding the blobs
+REDIRECT_STATUS_CODES = {301, 302, 303, 307, 308}
+
+# media types accepted when fetching manifests
+MANIFEST_MEDIA_TYPES = [
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.artifact.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+]
+
+
+class Manifest(BaseModel):
+    """Manifest fetched from an OCI registry."""
+
+    content: bytes
+    media_type: str
+    digest: str | None = None
+
+    @property
+    def layer_digests(self) -> list[str]:
+        """Return the digests of the layers referenced by the manifest."""
+        data: dict[str, Any] = json.loads(self.content)
+        return [layer["digest"] for layer in data.get("layers", [])]
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Handler raising the redirects as errors, so their location can be fetched without credentials."""
+
+    def redirect_request(self, *args, **kwargs):  # noqa: D102
+        return None
+
+
+class RegistryClient:
+    """Minimal client for the OCI distribution API.
+
+    It authenticates with the bearer token flow advertised by the registry, falling back to basic
+    authentication, which covers ECR Public as well as local registries used for testing.
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        domain: str,
+        username: str | None = None,
+        password: str | None = None,
+        plain_http: bool = False,
+    ):
+        self.domain = domain
+        self.username = username
+        self.password = password
+        self.scheme = "http" if plain_http else "https"
+        self._tokens: dict[str, str] = {}
+
+    def _basic_auth(self) -> str | None:
+        if self.username is None or self.password is None:
+            return None
+        credentials = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+        return f"Basic {credentials}"
+
+    def _fetch_token(self, challenge: str) -> str:
+        """Exchange the credentials for a bearer token following the WWW-Authenticate challenge."""
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm")
+        request = urllib.request.Request(f"{realm}?{urllib.parse.urlencode(params)}")
+        basic_auth = self._basic_auth()
+        if basic_auth is not None:
+            request.add_header("Authorization", basic_auth)
+        with urllib.request.urlopen(request) as response:
+            data = json.loads(response.read())
+        return data.get("token") or data["access_token"]
+
+    def _request(
+        self,
+        method: str,
+        repository: str,
+        path: str,
+        data: bytes | None = None,
+        headers: dict[str, str] | None = None,
+        follow_redirects: bool = True,
+    ):
+        """Issue a request against the repository, authenticating when challenged by the registry."""
+        url = f"{self.scheme}://{self.domain}/v2/{repository}/{path}"
+        opener = (
+            urllib.request.build_opener()
+            if follow_redirects
+            else urllib.request.build_opener(_NoRedirectHandler)
+        )
+
+        def send():
+            request = urllib.request.Request(url, data=data, method=method, headers=headers or {})
+            if repository in self._tokens:
+                request.add_header("Authorization", self._tokens[repository])
+            return opener.open(request)
+
+        try:
+            return send()
+        except urllib.error.HTTPError as err:
+            if err.code != 401:
+                raise
+            challenge = err.headers.get("WWW-Authenticate", "")
+            if challenge.lower().startswith("bearer"):
+                logger.debug(f"Fetching a bearer token for {self.domain}/{repository}")
+                self._tokens[repository] = f"Bearer {self._fetch_token(challenge[len('bearer') :])}"
+            elif (basic_auth := self._basic_auth()) is not None:
+                self._tokens[repository] = basic_auth
+            else:
+                raise
+        return send()
+
+    def get_manifest(self, repository: str, reference: str) -> Manifest | None:
+        """Fetch the manifest of a tag or digest, returning None if it does not exist."""
+        logger.debug(f"Fetching manifest {self.domain}/{repository}:{reference}")
+        try:
+            headers = {"Accept": ", ".join(MANIFEST_MEDIA_TYPES)}
+            with self._request("GET", repository, f"manifests/{reference}", headers=headers) as response:
+                return Manifest(
+                    content=response.read(),
+                    media_type=response.headers.get("Content-Type", MANIFEST_MEDIA_TYPES[0]),
+                    digest=response.headers.get("Docker-Content-Digest"),
+                )
+        except urllib.error.HTTPError as err:
+            if err.code == 404:
+                return None
+            raise
+
+    def put_manifest(self, repository: str, reference: str, manifest: Manifest):
+        """Upload a manifest under the given tag, so it references the same blobs as the original one."""
+        logger.debug(f"Putting manifest {self.domain}/{repository}:{reference}")
+        headers = {"Content-Type": manifest.media_type}
+        with self._request(
+            "PUT", repository, f"manifests/{reference}", data=manifest.content, headers=headers
+        ):
+            pass
+
+    def locate_blob(self, repository: str, digest: str) -> tuple[str, dict[str, str]]:
+        """Return the URL to download a blob from, along with the headers to send to it.
+
+        Registries usually redirect the blob downloads to a storage service, whose signed URLs must
+        not receive the credentials of the registry, so the redirect is not followed.
+        """
+        url = f"{self.scheme}://{self.domain}/v2/{repository}/blobs/{digest}"
+        try:
+            with self._request("GET", repository, f"blobs/{digest}", follow_redirects=False):
+                pass
+        except urllib.error.HTTPError as err:
+            if err.code not in REDIRECT_STATUS_CODES:
+                raise
+            location = urllib.parse.urljoin(url, err.headers["Location"])
+            logger.debug(
+                f"Blob {digest} of {self.domain}/{repository} is served from {location.split('?')[0]}"
+            )
+            return (location, {})
+        headers = {"Authorization": self._tokens[repository]} if repository in self._tokens else {}
+        return (url, headers)
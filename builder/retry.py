@@ -0,0 +1,104 @@
+"""Core module for retrying transient failures with a jittered exponential backoff."""
+
+import asyncio
+import random
+import time
+import urllib.error
+from typing import Any, Awaitable, Callable, Protocol, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+# error codes of the AWS APIs that are worth retrying
+TRANSIENT_AWS_ERROR_CODES = {
+    "InternalError",
+    "RequestTimeout",
+    "RequestTimeoutException",
+    "ServiceUnavailable",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+}
+
+# HTTP status codes of the registries that are worth retrying
+TRANSIENT_HTTP_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy(Protocol):
+    """Bounds of the retries, held by the settings of the CLI and of the pull command."""
+
+    max_attempts: int
+    retry_base_delay: float
+    retry_max_delay: float
+
+
+def backoff_delay(attempt: int, settings: RetryPolicy) -> float:
+    """Return the delay before the given attempt, drawn uniformly up to the exponential backoff.
+
+    The full jitter keeps concurrent tasks that failed together from retrying together.
+    """
+    ceiling = min(settings.retry_max_delay, settings.retry_base_delay * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+def is_transient_error(err: BaseException) -> bool:
+    """Check if an error is likely to go away when retrying, such as throttling or a dropped connection."""
+    if isinstance(err, urllib.error.HTTPError):
+        return err.code in TRANSIENT_HTTP_STATUS_CODES
+    if isinstance(err, (urllib.error.URLError, ConnectionError, TimeoutError)):
+        return True
+    if type(err).__module__.startswith("botocore"):
+        from botocore import exceptions as botocore_exceptions
+
+        if isinstance(err, botocore_exceptions.ClientError):
+            error = err.response.get("Error", {})
+            status = err.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+            return error.get("Code") in TRANSIENT_AWS_ERROR_CODES or status >= 500
+        return isinstance(err, (botocore_exceptions.ConnectionError, botocore_exceptions.HTTPClientError))
+    # wrapping errors, such as the ones of the S3 transfers, keep the original one as their context
+    cause = err.__cause__ or err.__context__
+    return cause is not None and is_transient_error(cause)
+
+
+def retry_call(
+    func: Callable[..., T],
+    *args: Any,
+    settings: RetryPolicy,
+    description: str,
+    is_transient: Callable[[BaseException], bool] = is_transient_error,
+    **kwargs: Any,
+) -> T:
+    """Call a function, retrying it upon transient errors until the attempts are exhausted."""
+    attempt = 1
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as err:
+            if attempt >= settings.max_attempts or not is_transient(err):
+                raise
+            delay = backoff_delay(attempt, settings)
+            logger.warning(f"Attempt {attempt} of the {description} failed, retrying in {delay:.1f}s: {err}")
+            time.sleep(delay)
+            attempt += 1
+
+
+async def retry_async(
+    factory: Callable[[], Awaitable[T]],
+    settings: RetryPolicy,
+    description: str,
+    is_transient: Callable[[BaseException], bool] = is_transient_error,
+) -> T:
+    """Await a coroutine made by the factory, making a new one upon transient errors until out of attempts."""
+    attempt = 1
+    while True:
+        try:
+            return await factory()
+        except Exception as err:
+            if attempt >= settings.max_attempts or not is_transient(err):
+                raise
+            delay = backoff_delay(attempt, settings)
+            logger.warning(f"Attempt {attempt} of the {description} failed, retrying in {delay:.1f}s: {err}")
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -1,9 +1,51 @@
 """Core module for defining schemas and constants."""
 
+from enum import Enum
 from pathlib import Path
+from typing import Any
 
 from pydantic import BaseModel, Field
 
+# registry where the images built from the job scripts' Dockerfiles are published to
+CATALOG_IMAGE_REGISTRY = "oras://public.ecr.aws/g5s2h5u4"
+
+# pointer to the published catalog, from which the pull command resolves the images of the job scripts
+CATALOG_URL = "https://catalog.vantagecompute.ai/catalog-latest.json"
+
+# estimated disk space consumed by a single concurrent Docker + Apptainer build
+BUILD_DISK_PER_JOB = 10 * 1024**3
+
+
+class BuildBackend(str, Enum):
+    """How the Docker image of a job script is handed over to Apptainer."""
+
+    # the image is loaded into the Docker daemon, then exported from it by Apptainer
+    DOCKER_DAEMON = "docker-daemon"
+    # the image is written by BuildKit as an OCI archive, which Apptainer converts directly
+    OCI_ARCHIVE = "oci-archive"
+
+
+class SifCompression(str, Enum):
+    """Compression of the squashfs filesystem of the Apptainer images."""
+
+    GZIP = "gzip"
+    ZSTD = "zstd"
+    XZ = "xz"
+    LZ4 = "lz4"
+    NONE = "none"
+
+
+# range of the compression levels accepted by mksquashfs for each compression supporting them
+SIF_COMPRESSION_LEVELS = {SifCompression.GZIP: (1, 9), SifCompression.ZSTD: (1, 22)}
+
+
+class ChangeKind(str, Enum):
+    """Kinds of artifacts of a job script affected by a change."""
+
+    IMAGE = "image"
+    FILES = "files"
+    CATALOG = "catalog"
+
 
 class JobScriptMetadata(BaseModel):
     """Metadata for a job script."""
@@ -14,3 +56,169 @@ class JobScriptMetadata(BaseModel):
     supporting_files: list[Path] | None = Field(None, alias="supporting-files")
     image_source: str | None = Field(None, alias="image-source")
     image_tags: list[str] | None = Field(None, alias="image-tags")
+    build_backend: BuildBackend | None = Field(None, alias="build-backend")
+    sif_compression: SifCompression | None = Field(None, alias="sif-compression")
+    sif_compression_level: int | None = Field(None, alias="sif-compression-level")
+
+
+class TaskResult(BaseModel):
+    """Outcome of a task executed by the concurrent task runner."""
+
+    name: str
+    elapsed: float
+    outcome: str | None = None
+    error: str | None = None
+
+
+class BuildCacheEntry(BaseModel):
+    """Record of an Apptainer image stored in the build cache."""
+
+    key: str
+    job_script: str
+    size: int
+    created_at: float
+    last_used_at: float
+
+
+class EcrLogin(BaseModel):
+    """Credentials and coordinates of the ECR Public registry."""
+
+    registry_id: str
+    registry_uri: str
+    username: str
+    password: str
+    expires_at: float
+
+
+class JobScriptChange(BaseModel):
+    """Changes made to a job script since a git reference, and the artifacts they affect."""
+
+    name: str
+    kinds: set[ChangeKind] = set()
+    removed: bool = False
+    paths: list[str] = []
+
+
+class JournalStep(BaseModel):
+    """Step completed by a publish run, which a resumed run skips as long as the digest is the same."""
+
+    job_script: str
+    artifact: str
+    tag: str
+    digest: str
+    # identifier of a multipart upload started by the step, which can be resumed
+    upload_id: str | None = None
+    completed_at: float
+
+
+class PullSettings(BaseModel):
+    """Settings of the pull command, which runs on the clusters without the settings of the CLI."""
+
+    cache_dir: Path
+    # size of the image cache, in bytes, beyond which the least recently used images are evicted
+    max_cache_size: int
+    jobs: int = 4
+    max_attempts: int = 5
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 30.0
+
+
+class ImageRef(BaseModel):
+    """Digest an image URL was last resolved to, used when the registry cannot be reached."""
+
+    url: str
+    digest: str
+    size: int
+    resolved_at: float
+
+
+class FileStamp(BaseModel):
+    """Modification time, size and digest of a file, used to detect changes."""
+
+    mtime_ns: int
+    size: int
+    sha256: str
+
+
+class JobScriptIndexEntry(BaseModel):
+    """Parsed metadata and description of a job script, as stored in the catalog index."""
+
+    name: str
+    stamps: dict[str, FileStamp]
+    metadata: JobScriptMetadata
+    description: str
+
+
+class JobScriptIndex(BaseModel):
+    """On-disk index of the job scripts, keyed by the absolute path of their directories."""
+
+    entries: dict[str, JobScriptIndexEntry] = {}
+
+
+class CatalogDiff(BaseModel):
+    """Structural difference between two versions of the catalog."""
+
+    added: list[str] = []
+    removed: list[str] = []
+    changed: dict[str, list[str]] = {}
+
+    @property
+    def is_empty(self) -> bool:
+        """Check if both versions of the catalog are identical."""
+        return not (self.added or self.removed or self.changed)
+
+
+class CatalogPointer(BaseModel):
+    """Short-lived pointer to the current content-hashed catalog and its precompressed variants."""
+
+    catalog: str
+    digest: str
+    size: int
+    encodings: dict[str, str] = {}
+    job_scripts: int = 0
+    # compact index of the sharded catalog, when published
+    index: str | None = None
+    index_digest: str | None = None
+    index_encodings: dict[str, str] = {}
+
+
+class TraceSpan(BaseModel):
+    """Timing of a single phase of the processing of a job script."""
+
+    job: str
+    phase: str
+    start: float
+    duration: float
+    thread: int
+    attributes: dict[str, Any] = {}
+    error: str | None = None
+
+
+class HistoryRecord(BaseModel):
+    """Duration and artifact size of a phase of a past run for a job script."""
+
+    job_script: str
+    phase: str
+    duration: float
+    size: int | None = None
+    setting: str | None = None
+    recorded_at: float
+
+
+class HistorySummary(BaseModel):
+    """Average build duration and image size of a job script for a build setting."""
+
+    job_script: str
+    setting: str
+    runs: int
+    duration: float
+    size: float | None = None
+
+
+class SharedStage(BaseModel):
+    """Leading Dockerfile instructions shared by several job scripts, built once before them."""
+
+    tag: str
+    dockerfile: str
+    depth: int
+    job_scripts: list[str]
@@ -2,5 +2,8 @@ from builder.subapps.settings import app as settings_app
 from builder.subapps.apptainer import app as apptainer_app
 from builder.subapps.files import app as files_app
 from builder.subapps.catalog import app as catalog_app
+from builder.subapps.cache import app as cache_app
+from builder.subapps.pipeline import app as pipeline_app
+from builder.subapps.history import app as history_app
 
-all = ["settings_app", "apptainer_app", "files_app", "catalog_app"]
\ No newline at end of file
+all = ["settings_app", "apptainer_app", "files_app", "catalog_app", "cache_app", "pipeline_app", "history_app"]
\ No newline at end of file
@@ -6,17 +6,27 @@ from typing import Annotated, Optional
 
 import typer
 
+from builder.aws import AwsClients
+from builder.build_hosts import size_docker_executor
+from builder.cache import init_cache
 from builder.config import attach_settings
 from builder.context import CliContext
 from builder.exceptions import handle_abort
 from builder.format import terminal_message
+from builder.journal import RunJournal
+from builder.schemas import BuildBackend, ChangeKind, SifCompression
 from builder.subapps.helpers import (
-    build_image,
     check_existing_paths,
     check_sif_exists,
+    default_build_jobs,
     find_job_scripts,
+    prepare_shared_layers,
     publish_image,
+    report_task_results,
     run_tasks_concurrently,
+    schedule_build,
+    schedule_longest_first,
+    start_build_hosts,
 )
 
 app = typer.Typer()
@@ -24,6 +34,7 @@ app = typer.Typer()
 
 @app.command(name="build")
 @handle_abort
+@init_cache
 def build(
     job_scripts: Annotated[
         Optional[list[Path]],
@@ -32,12 +43,97 @@ def build(
         ),
     ] = None,
     dry_run: bool = typer.Option(False, help="Do not build the images, only print the commands."),
+    jobs: Optional[int] = typer.Option(
+        None,
+        "--jobs",
+        "-j",
+        min=1,
+        help="Maximum number of concurrent builds. Defaults to a value based on CPU count and free disk.",
+    ),
+    no_cache: bool = typer.Option(
+        False, "--no-cache", help="Rebuild the images even if they are available in the build cache."
+    ),
+    timeout: Optional[float] = typer.Option(
+        None, min=1, help="Maximum duration, in seconds, of each Apptainer build."
+    ),
+    output_dir: Optional[Path] = typer.Option(
+        None,
+        help="Directory where the .sif files are stored, named after the job scripts. "
+        "Defaults to an output.sif file in each job script directory.",
+    ),
+    share_layers: bool = typer.Option(
+        True, help="Pull the base images and build the layers shared by several job scripts first."
+    ),
+    buildkit_cache: bool = typer.Option(
+        False, help="Build with docker buildx, importing and exporting the layers to a local cache."
+    ),
+    backend: Optional[BuildBackend] = typer.Option(
+        None,
+        help="How images are handed over to Apptainer, overriding the build-backend of the metadata. "
+        "Defaults to docker-daemon.",
+    ),
+    compression: Optional[SifCompression] = typer.Option(
+        None, help="Compression of the SIF filesystem, overriding the sif-compression of the metadata."
+    ),
+    compression_level: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="Level of the SIF compression, overriding the sif-compression-level of the metadata.",
+    ),
+    since: Optional[str] = typer.Option(
+        None,
+        help="Only build the job scripts whose image changed since this git reference, "
+        "such as a commit or a branch.",
+    ),
+    build_host: Optional[list[str]] = typer.Option(
+        None,
+        help="Build host, as DOCKER_HOST[,WORK_DIR[,SLOTS]], such as ssh://builder@10.0.0.5,/scratch,8. "
+        "May be repeated to distribute the builds across several hosts, scheduled by load.",
+    ),
 ):
     """Build an Apptainer .sif file from a Dockerfile for each job script imputed."""
-    job_scripts = find_job_scripts(job_scripts)
+    job_scripts = find_job_scripts(job_scripts, since, {ChangeKind.IMAGE})
+    if since is not None and not job_scripts:
+        terminal_message(f"No image changed since {since}, nothing to build.", "Process Complete")
+        return
     check_existing_paths(job_scripts)
-    tasks = [build_image(job_script_path, dry_run) for job_script_path in job_scripts]
-    asyncio.run(run_tasks_concurrently(tasks))
+    host_pool = start_build_hosts(build_host, job_scripts, dry_run)
+    if jobs is None:
+        jobs = default_build_jobs() if host_pool is None else host_pool.capacity
+    size_docker_executor(jobs)
+    job_scripts = schedule_longest_first(job_scripts, ["build"], jobs, dry_run)
+    shared_stages = []
+    if share_layers:
+        shared_stages = asyncio.run(
+            prepare_shared_layers(
+                job_scripts,
+                jobs,
+                dry_run,
+                not no_cache,
+                buildkit_cache,
+                compression,
+                compression_level,
+                None if host_pool is None else host_pool.docker_hosts,
+            )
+        )
+    tasks = {
+        job_script_path.name: schedule_build(
+            job_script_path,
+            host_pool,
+            dry_run=dry_run,
+            use_cache=not no_cache,
+            timeout=timeout,
+            output_dir=output_dir,
+            buildkit_cache=buildkit_cache,
+            shared_stages=shared_stages,
+            backend=backend,
+            compression=compression,
+            compression_level=compression_level,
+        )
+        for job_script_path in job_scripts
+    }
+    results = asyncio.run(run_tasks_concurrently(tasks, max_concurrency=jobs))
+    report_task_results(results, "Build", count_outcomes=True)
     terminal_message("Built Apptainer images successfully", "Process Complete")
 
 
@@ -53,6 +149,27 @@ def publish(
         ),
     ] = None,
     dry_run: bool = typer.Option(False, help="Do not publish the images, only print the commands."),
+    force: bool = typer.Option(
+        False, "--force", help="Publish the artifacts even if the remote copies are identical."
+    ),
+    jobs: int = typer.Option(
+        10, "--jobs", "-j", min=1, help="Maximum number of job scripts published concurrently."
+    ),
+    output_dir: Optional[Path] = typer.Option(
+        None,
+        help="Directory where the .sif files are stored, named after the job scripts. "
+        "Defaults to an output.sif file in each job script directory.",
+    ),
+    resume: bool = typer.Option(
+        False,
+        help="Skip the steps completed by the previous run of this command, as recorded in its journal, "
+        "and resume its interrupted uploads.",
+    ),
+    since: Optional[str] = typer.Option(
+        None,
+        help="Only publish the job scripts whose image changed since this git reference, "
+        "such as a commit or a branch.",
+    ),
 ):
     """Publish the built Apptainer .sif files for each job script supplied."""
     ctx_obj = ctx.obj
@@ -60,11 +177,27 @@ def publish(
     settings = ctx_obj.settings
     assert settings is not None
 
-    job_scripts = find_job_scripts(job_scripts)
+    job_scripts = find_job_scripts(job_scripts, since, {ChangeKind.IMAGE})
+    if since is not None and not job_scripts:
+        terminal_message(f"No image changed since {since}, nothing to publish.", "Process Complete")
+        return
 
-    check_sif_exists(job_scripts)
-    tasks = [
-        publish_image(job_script_path, settings, dry_run, ctx_obj.verbose) for job_script_path in job_scripts
-    ]
-    asyncio.run(run_tasks_concurrently(tasks))
+    check_sif_exists(job_scripts, output_dir)
+    job_scripts = schedule_longest_first(job_scripts, ["push"], jobs, dry_run)
+    aws = AwsClients(settings, max_pool_connections=jobs)
+    journal = None if dry_run else RunJournal("apptainer-publish", resume=resume)
+    tasks = {
+        job_script_path.name: publish_image(
+            job_script_path,
+            aws,
+            dry_run,
+            ctx_obj.verbose,
+            force=force,
+            output_dir=output_dir,
+            journal=journal,
+        )
+        for job_script_path in job_scripts
+    }
+    results = asyncio.run(run_tasks_concurrently(tasks, max_concurrency=jobs))
+    report_task_results(results, "Publish", journal=journal)
     terminal_message("Published Apptainer images successfully", "Process Complete")
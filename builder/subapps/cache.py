@@ -0,0 +1,58 @@
+"""App for inspecting and pruning the build cache."""
+
+import time
+
+import typer
+
+from builder.cache import build_cache_dir, init_cache, list_build_cache_entries, prune_build_cache
+from builder.exceptions import handle_abort
+from builder.format import terminal_message
+
+app = typer.Typer()
+
+
+def _format_size(size: float) -> str:
+    """Format a size in bytes as a human readable string."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+@app.command(name="stats")
+@handle_abort
+@init_cache
+def stats():
+    """Show the entries of the build cache and its total size."""
+    entries = list_build_cache_entries()
+    total_size = sum(entry.size for entry in entries)
+    now = time.time()
+    lines = [
+        f"{entry.job_script} [dim]{entry.key[:12]}[/dim] {_format_size(entry.size)}, "
+        f"last used {(now - entry.last_used_at) / 3600:.1f}h ago"
+        for entry in reversed(entries)
+    ]
+    lines.append("")
+    lines.append(f"{len(entries)} entries using {_format_size(total_size)} at {build_cache_dir}")
+    terminal_message("\n".join(lines), "Build Cache", indent=False)
+
+
+@app.command(name="prune")
+@handle_abort
+@init_cache
+def prune(
+    max_size: float = typer.Option(
+        ...,
+        min=0,
+        help="Evict the least recently used entries until the cache fits in this size, in GiB. "
+        "Use 0 to empty the cache.",
+    ),
+):
+    """Evict entries from the build cache, least recently used first."""
+    evicted = prune_build_cache(int(max_size * 1024**3))
+    freed = sum(entry.size for entry in evicted)
+    terminal_message(
+        f"Evicted {len(evicted)} entries, freeing {_format_size(freed)}",
+        "Process Complete",
+    )
@@ -1,21 +1,25 @@
 """App for managing the catalog.yaml file."""
 
+from pathlib import Path
+from typing import Optional
+
 import typer
-import yaml
 from loguru import logger
 
+from builder.cache import init_cache
+from builder.catalog_publish import CATALOG_POINTER, write_catalog_artifacts
 from builder.config import attach_settings
 from builder.context import CliContext
-from builder.exceptions import handle_abort
-from builder.format import render_json, terminal_message
-from builder.subapps.helpers import find_job_scripts, load_job_script_metadata
-from builder.types import JobScriptCatalog
+from builder.exceptions import Abort, handle_abort
+from builder.format import render_json
+from builder.subapps.helpers import detect_job_script_changes, generate_catalog, report_catalog_diff
 
 app = typer.Typer()
 
 
 @app.command(name="generate")
 @handle_abort
+@init_cache
 @attach_settings
 def generate_catalog_file(
     ctx: typer.Context,
@@ -26,66 +30,89 @@ def generate_catalog_file(
             "Use in conjunction with the --verbose flag for enhanced debugging."
         ),
     ),
+    no_index: bool = typer.Option(
+        False, "--no-index", help="Parse every job script again instead of using the metadata index."
+    ),
+    only: Optional[list[str]] = typer.Option(
+        None,
+        help=(
+            "Only update the entries of these job scripts in the existing catalog. "
+            "May be repeated or supplied as a comma-separated list."
+        ),
+    ),
+    changed_only: bool = typer.Option(
+        False, help="Only update the entries of the job scripts that changed since the previous run."
+    ),
+    since: Optional[str] = typer.Option(
+        None,
+        help="Only update the entries of the job scripts that changed since this git reference, "
+        "such as a commit or a branch.",
+    ),
+    diff_file: Optional[Path] = typer.Option(
+        None, help="Write the structural difference with the previous catalog to this JSON file."
+    ),
+    publish_dir: Optional[Path] = typer.Option(
+        None,
+        help=(
+            "Also write the catalog to this directory as a content-hashed JSON file, with precompressed "
+            f"variants, and the {CATALOG_POINTER} file pointing at it."
+        ),
+    ),
+    sharded: bool = typer.Option(
+        False,
+        help=(
+            "With --publish-dir, also publish a compact index of the catalog and a detail document "
+            "per job script, holding its whole entry."
+        ),
+    ),
 ):
-    """Generate a catalog.yaml file."""
+    """Generate a catalog.yaml file.
+
+    With the --only, --since or --changed-only options, the existing catalog is loaded and only the affected
+    entries are replaced, inserted or removed. With the --publish-dir option, the artifacts deployed
+    to the catalog website are written as well.
+    """
     ctx_obj = ctx.obj
     assert isinstance(ctx_obj, CliContext)
     settings = ctx_obj.settings
     assert settings is not None
 
-    job_scripts_paths = find_job_scripts()
-    logger.debug(f"Found {len(job_scripts_paths)} job scripts: {[path.name for path in job_scripts_paths]}")
-
-    catalog: JobScriptCatalog = {"job-scripts": []}
-
-    for job_script_path in job_scripts_paths:
-        metadata = load_job_script_metadata(job_script_path)
-
-        apptainer_image_urls: list[str | None]
-        if metadata.image_source is None:
-            logger.warning(f"No image source found for {job_script_path.name}")
-            apptainer_image_urls = [None]
-        elif metadata.image_source == "Dockerfile":
-            if metadata.image_tags is None:
-                apptainer_image_urls = [
-                    f"oras://public.ecr.aws/g5s2h5u4/{job_script_path.name}:latest"
-                ]
-            else:
-                apptainer_image_urls = [
-                    f"oras://public.ecr.aws/g5s2h5u4/{job_script_path.name}:{tag}"
-                    for tag in metadata.image_tags
-                ]
-        else:
-            apptainer_image_urls = [metadata.image_source]
-
-        supporting_files_urls = (
-            [
-                f"s3://{settings.s3_bucket}/files/{job_script_path.name}/{supporting_file.name}"
-                for supporting_file in metadata.supporting_files
-            ]
-            if metadata.supporting_files
-            else []
-        )
-
-        catalog_item = {
-            "name": job_script_path.name,
-            "summary": metadata.summary,
-            "icon-url": metadata.icon_url,
-            "description": job_script_path.joinpath("README.md").read_text(),
-            "entrypoint-file-url": f"s3://{settings.s3_bucket}/files/{job_script_path.name}/{metadata.entrypoint.name}",
-            "supporting-files-urls": supporting_files_urls,
-            "apptainer-image-urls": apptainer_image_urls,
-        }
-        catalog["job-scripts"].append(catalog_item)
-        logger.debug(f"Added {job_script_path.name} to the catalog")
+    Abort.require_condition(
+        not sharded or publish_dir is not None,
+        "The --sharded flag requires the --publish-dir option",
+        raise_kwargs=dict(
+            subject="Invalid options", log_message="Sharded catalog without a publish directory"
+        ),
+    )
 
-    catalog_path = "catalog.yaml"
+    catalog_path = Path("catalog.yaml")
+    selected = {name.strip() for names in only or [] for name in names.split(",") if name.strip()}
+    if since is not None:
+        # removed job scripts are kept, so their entries are removed from the catalog
+        selected |= set(detect_job_script_changes(since))
+    (catalog, diff, written) = generate_catalog(
+        settings,
+        catalog_path,
+        only=selected if selected or since is not None else None,
+        changed_only=changed_only,
+        use_index=not no_index,
+        dry_run=dry_run,
+    )
     if ctx_obj.verbose:
         logger.debug("Generated catalog:")
         render_json(catalog)
 
-    if not dry_run:
-        with open(catalog_path, "w") as catalog_file:
-            yaml.dump(catalog, catalog_file, indent=2)
+    if diff_file is not None:
+        diff_file.write_text(diff.model_dump_json(indent=2))
+
+    if publish_dir is not None and not dry_run:
+        pointer = write_catalog_artifacts(catalog, publish_dir, sharded=sharded)
+        logger.debug(f"Catalog published as {publish_dir / pointer.catalog} ({pointer.digest})")
+        if pointer.index is not None:
+            logger.debug(f"Catalog index published as {publish_dir / pointer.index} ({pointer.index_digest})")
 
-    terminal_message(f"Catalog file generated at {catalog_path}.", "Process Complete")
+    if written:
+        footer = f"Catalog file generated at {catalog_path}"
+    else:
+        footer = f"Catalog file {catalog_path} left untouched"
+    report_catalog_diff(diff, footer)
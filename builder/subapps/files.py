@@ -6,14 +6,18 @@ from typing import Annotated, Optional
 
 import typer
 
+from builder.aws import AwsClients
 from builder.config import attach_settings
 from builder.context import CliContext
 from builder.exceptions import handle_abort
 from builder.format import terminal_message
+from builder.journal import RunJournal
+from builder.schemas import ChangeKind
 from builder.subapps.helpers import (
     check_metadata_exists,
     find_job_scripts,
     publish_files,
+    report_task_results,
     run_tasks_concurrently,
 )
 
@@ -32,6 +36,31 @@ def publish(
         ),
     ] = None,
     dry_run: bool = typer.Option(False, help="Do not publish the images, only print the commands."),
+    force: bool = typer.Option(
+        False, "--force", help="Publish the artifacts even if the remote copies are identical."
+    ),
+    jobs: int = typer.Option(
+        10, "--jobs", "-j", min=1, help="Maximum number of job scripts published concurrently."
+    ),
+    multipart_threshold: Optional[int] = typer.Option(
+        None, min=5, help="Override the size, in MiB, from which files are uploaded in multiple parts."
+    ),
+    multipart_chunksize: Optional[int] = typer.Option(
+        None, min=5, help="Override the size, in MiB, of each part of a multipart upload."
+    ),
+    max_concurrency: Optional[int] = typer.Option(
+        None, min=1, help="Override the maximum number of threads transferring the parts of a single file."
+    ),
+    resume: bool = typer.Option(
+        False,
+        help="Skip the steps completed by the previous run of this command, as recorded in its journal, "
+        "and resume its interrupted uploads.",
+    ),
+    since: Optional[str] = typer.Option(
+        None,
+        help="Only publish the job scripts whose published files changed since this git reference, "
+        "such as a commit or a branch.",
+    ),
 ):
     """Publish the built Apptainer .sif files for each job script imputed."""
     ctx_obj = ctx.obj
@@ -39,11 +68,28 @@ def publish(
     settings = ctx_obj.settings
     assert settings is not None
 
-    job_scripts = find_job_scripts(job_scripts)
+    job_scripts = find_job_scripts(job_scripts, since, {ChangeKind.FILES})
+    if since is not None and not job_scripts:
+        terminal_message(f"No published file changed since {since}, nothing to publish.", "Process Complete")
+        return
 
     check_metadata_exists(job_scripts)
-    tasks = [publish_files(job_script_path, settings, dry_run) for job_script_path in job_scripts]
-    asyncio.run(run_tasks_concurrently(tasks))
+    overrides = {
+        "s3_multipart_threshold": multipart_threshold,
+        "s3_multipart_chunksize": multipart_chunksize,
+        "s3_max_concurrency": max_concurrency,
+    }
+    settings = settings.model_copy(
+        update={key: value for (key, value) in overrides.items() if value is not None}
+    )
+    aws = AwsClients(settings, max_pool_connections=jobs * settings.s3_max_concurrency)
+    journal = None if dry_run else RunJournal("files-publish", resume=resume)
+    tasks = {
+        job_script_path.name: publish_files(job_script_path, aws, dry_run, force=force, journal=journal)
+        for job_script_path in job_scripts
+    }
+    results = asyncio.run(run_tasks_concurrently(tasks, max_concurrency=jobs))
+    report_task_results(results, "Publish", footer=aws.transfer_stats.summary(), journal=journal)
     terminal_message(
         f"Published auxiliary files to the bucket {settings.s3_bucket}",
         "Process Complete",
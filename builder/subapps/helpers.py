@@ -1,22 +1,72 @@
 """Core module for defining auxiliary functions of the commands."""
 
+from __future__ import annotations
+
 import asyncio
-import base64
+import os
+import shlex
+import shutil
+import statistics
+import time
+from collections import Counter
 from pathlib import Path
-from typing import Any, AsyncGenerator, Coroutine, Iterable
+from typing import IO, TYPE_CHECKING, Any, Coroutine
 
-import boto3
-import docker
-import yaml
+import snick
 from loguru import logger
-from mypy_boto3_ecr_public.client import ECRPublicClient
-from mypy_boto3_s3.client import S3Client
+from rich.console import Console
 
-from builder.config import Settings
+from builder.build_hosts import BuildHost, BuildHostPool, docker_client, run_docker
+from builder.cache import (
+    compute_build_key,
+    has_build_cache_entry,
+    layer_cache_dir,
+    restore_from_build_cache,
+    store_in_build_cache,
+)
+from builder.catalog_index import index_job_scripts
+from builder.changes import classify_changes, detect_changes
+from builder.dockerfile import (
+    base_images,
+    build_context_files,
+    build_context_tarball,
+    dockerfile_tarball,
+    parse_dockerfile,
+    resolve_dockerfile,
+)
 from builder.exceptions import Abort
 from builder.format import render_json, terminal_message
-from builder.schemas import JobScriptMetadata
-from builder.tools import run_command, run_command_logged
+from builder.hashing import hash_file
+from builder.history import estimate_durations, estimate_makespan, order_longest_first, record_history
+from builder.journal import RunJournal
+from builder.layers import find_shared_stages
+from builder.retry import is_transient_error, retry_async, retry_call
+from builder.schemas import (
+    BUILD_DISK_PER_JOB,
+    CATALOG_IMAGE_REGISTRY,
+    SIF_COMPRESSION_LEVELS,
+    BuildBackend,
+    CatalogDiff,
+    ChangeKind,
+    EcrLogin,
+    JobScriptChange,
+    JobScriptIndexEntry,
+    JobScriptMetadata,
+    SharedStage,
+    SifCompression,
+    TaskResult,
+)
+from builder.tools import run_command_logged
+from builder.tracing import tracer
+from builder.types import JobScriptCatalog
+
+# the AWS clients and the Docker SDK are slow to import, so they are only imported when needed
+if TYPE_CHECKING:
+    from mypy_boto3_s3.client import S3Client
+
+    from builder.aws import AwsClients
+    from builder.config import Settings
+    from builder.registry import RegistryClient
 
 
 def check_existing_paths(paths: list[Path]) -> bool:
@@ -33,9 +83,20 @@ def check_existing_paths(paths: list[Path]) -> bool:
     return True
 
 
-def check_sif_exists(paths: list[Path]) -> bool:
-    """Check if the given parent paths have a child .sif file in them."""
-    return check_existing_paths([path.joinpath("output.sif") for path in paths])
+def sif_path(job_script_path: Path, output_dir: Path | None = None) -> Path:
+    """Return where the Apptainer image of a job script is stored.
+
+    The image lands next to the job script unless an output directory is given, in which case it
+    is named after the job script.
+    """
+    if output_dir is None:
+        return job_script_path / "output.sif"
+    return output_dir / f"{job_script_path.name}.sif"
+
+
+def check_sif_exists(paths: list[Path], output_dir: Path | None = None) -> bool:
+    """Check if the Apptainer images of the given job scripts exist."""
+    return check_existing_paths([sif_path(path, output_dir) for path in paths])
 
 
 def check_metadata_exists(paths: list[Path]) -> bool:
@@ -43,8 +104,21 @@ def check_metadata_exists(paths: list[Path]) -> bool:
     return check_existing_paths([path.joinpath("metadata.yaml") for path in paths])
 
 
-def find_job_scripts(paths: list[Path] | None = None) -> list[Path]:
-    """Check if the input is None. If so, return a list containing all job scripts."""
+def find_job_scripts(
+    paths: list[Path] | None = None, since: str | None = None, kinds: set[ChangeKind] | None = None
+) -> list[Path]:
+    """Check if the input is None. If so, return a list containing all job scripts.
+
+    With since, only the job scripts, among the given ones if any, whose changes since that git
+    reference affect one of the kinds of artifacts are returned.
+    """
+    if since is not None:
+        changes = detect_job_script_changes(since, paths)
+        return [
+            Path(change.name)
+            for change in changes.values()
+            if not change.removed and change.kinds & (kinds or set(ChangeKind))
+        ]
     if paths is None:
         # search of folder in the current execution directory
         # and return the ones with a metadata.yaml file
@@ -53,27 +127,633 @@ def find_job_scripts(paths: list[Path] | None = None) -> list[Path]:
     return paths
 
 
+def detect_job_script_changes(since: str, paths: list[Path] | None = None) -> dict[str, JobScriptChange]:
+    """Detect and report the changes of the job scripts since a git reference, among the given ones if any."""
+    changes = detect_changes(since)
+    if paths is not None:
+        names = {path.name for path in paths}
+        changes = {name: change for (name, change) in changes.items() if name in names}
+    lines = [
+        f"{name}: " + ("removed" if change.removed else ", ".join(sorted(change.kinds)))
+        for (name, change) in changes.items()
+    ]
+    terminal_message("\n".join(lines) or "No job script changed", f"Changes since {since}", indent=False)
+    return changes
+
+
+def snapshot_metadata(job_scripts: list[Path]) -> dict[str, str | None]:
+    """Return the content of the metadata.yaml file of each job script, or None if it has none."""
+    return {
+        path.name: (path / "metadata.yaml").read_text() if (path / "metadata.yaml").exists() else None
+        for path in job_scripts
+    }
+
+
+def classify_watched_changes(
+    paths: set[Path], job_scripts: list[Path], snapshots: dict[str, str | None]
+) -> dict[str, JobScriptChange]:
+    """Classify the changed paths of the watched job scripts, by name, then update their snapshots.
+
+    Changes to the metadata.yaml files are classified against the snapshots taken when they were
+    last seen, so only the changes affecting an artifact are returned.
+    """
+    changes = {}
+    for job_script_path in job_scripts:
+        job_script_paths = sorted(
+            path.relative_to(job_script_path) for path in paths if path.is_relative_to(job_script_path)
+        )
+        if not job_script_paths:
+            continue
+        change = classify_changes(job_script_path, job_script_paths, snapshots.get(job_script_path.name))
+        snapshots.update(snapshot_metadata([job_script_path]))
+        logger.debug(f"Changes of {change.name}: {sorted(change.kinds)} from {change.paths}")
+        if change.kinds:
+            changes[change.name] = change
+    return changes
+
+
 def load_job_script_metadata(job_script_path: Path) -> JobScriptMetadata:
     """Load the metadata.yaml file from a job script."""
+    import yaml
+
     with open(job_script_path / "metadata.yaml") as metadata_file:
         metadata_dict = yaml.safe_load(metadata_file)
         metadata = JobScriptMetadata(**metadata_dict)
     return metadata
 
 
-async def run_tasks_concurrently(tasks: list[Coroutine[Any, Any, Any]]):
-    """Run tasks concurrently."""
-    await asyncio.gather(*tasks)
+def load_build_metadata(
+    job_script_path: Path,
+    compression: SifCompression | None = None,
+    compression_level: int | None = None,
+) -> JobScriptMetadata:
+    """Load the metadata of a job script, overriding its SIF compression with the one of the run."""
+    metadata = load_job_script_metadata(job_script_path)
+    overrides = {"sif_compression": compression, "sif_compression_level": compression_level}
+    return metadata.model_copy(update={key: value for (key, value) in overrides.items() if value is not None})
+
+
+def mksquashfs_args(metadata: JobScriptMetadata) -> str | None:
+    """Return the mksquashfs arguments implementing the SIF compression of the metadata, if any."""
+    (compression, level) = (metadata.sif_compression, metadata.sif_compression_level)
+    if compression is None:
+        Abort.require_condition(
+            level is None,
+            "A SIF compression level requires a SIF compression",
+            raise_kwargs=dict(
+                subject="Invalid compression", log_message="Compression level without compression"
+            ),
+        )
+        return None
+    if compression == SifCompression.NONE:
+        return "-noI -noD -noF -noX"
+    args = f"-comp {compression.value}"
+    if level is not None:
+        bounds = SIF_COMPRESSION_LEVELS.get(compression)
+        Abort.require_condition(
+            bounds is not None and bounds[0] <= level <= bounds[1],
+            f"Compression level {level} is not supported by {compression.value}",
+            raise_kwargs=dict(subject="Invalid compression", log_message="Unsupported compression level"),
+        )
+        args += f" -Xcompression-level {level}"
+    return args
+
+
+def apptainer_build_command(output_path: Path, image_source: str, squashfs_args: str | None) -> str:
+    """Return the command building a SIF file from an image, passing the mksquashfs arguments along."""
+    if squashfs_args is None:
+        return f"apptainer build {output_path} {image_source}"
+    return f"apptainer build --mksquashfs-args {shlex.quote(squashfs_args)} {output_path} {image_source}"
+
+
+def sif_setting(metadata: JobScriptMetadata) -> str:
+    """Return the label of the SIF compression of the metadata, under which builds are recorded."""
+    if metadata.sif_compression is None:
+        return "default"
+    if metadata.sif_compression_level is None:
+        return metadata.sif_compression.value
+    return f"{metadata.sif_compression.value}-{metadata.sif_compression_level}"
+
+
+def default_build_jobs(path: Path = Path(".")) -> int:
+    """Compute the default number of concurrent builds based on the CPU count and the free disk space."""
+    cpu_count = os.cpu_count() or 1
+    free_disk = shutil.disk_usage(path).free
+    jobs = max(1, min(cpu_count, free_disk // BUILD_DISK_PER_JOB))
+    logger.debug(f"Using {jobs} concurrent jobs ({cpu_count=}, {free_disk=})")
+    return jobs
+
+
+def start_build_hosts(
+    specs: list[str] | None, job_scripts: list[Path], dry_run: bool = False
+) -> BuildHostPool | None:
+    """Probe the build hosts given as DOCKER_HOST[,WORK_DIR[,SLOTS]] and return their pool.
+
+    Return None when no build host is given, in which case the images are built locally.
+    """
+    if not specs:
+        return None
+    pool = BuildHostPool([BuildHost.parse(spec) for spec in specs])
+    asyncio.run(pool.start([path.name for path in job_scripts], dry_run))
+    lines = [
+        f"{host.docker_host}: up to {host.slots or 1} concurrent builds"
+        if host.docker_host in pool.docker_hosts
+        else f"{host.docker_host}: unreachable"
+        for host in pool.hosts
+    ]
+    terminal_message(
+        "\n".join(lines), "Build Hosts", footer=f"{pool.capacity} concurrent builds", indent=False
+    )
+    return pool
+
+
+def schedule_longest_first(
+    job_scripts: list[Path], phases: list[str], jobs: int, dry_run: bool = False
+) -> list[Path]:
+    """Order the job scripts so that the ones expected to take the longest start first.
+
+    The durations of the given phases are estimated from the history. In dry run, the estimated
+    makespan is rendered, counting the job scripts without history with the average duration.
+    """
+    estimates = estimate_durations([path.name for path in job_scripts], phases)
+    positions = {name: position for (position, name) in enumerate(order_longest_first(estimates))}
+    ordered = sorted(job_scripts, key=lambda path: positions[path.name])
+    logger.debug(f"Scheduling the job scripts in the order {[path.name for path in ordered]}")
+
+    if dry_run:
+        known = [estimate for estimate in estimates.values() if estimate is not None]
+        lines = [
+            f"{path.name}: {estimate:.1f}s"
+            if (estimate := estimates[path.name]) is not None
+            else f"{path.name}: no history"
+            for path in ordered
+        ]
+        if known:
+            average = statistics.fmean(known)
+            durations = [average if estimate is None else estimate for estimate in estimates.values()]
+            footer = f"~{estimate_makespan(durations, jobs):.1f}s with {jobs} concurrent jobs"
+        else:
+            footer = "No history to estimate the makespan from"
+        terminal_message(
+            "\n".join(lines), f"Estimated {' + '.join(phases)} durations", footer=footer, indent=False
+        )
+    return ordered
+
+
+def build_catalog_item(entry: JobScriptIndexEntry, settings: Settings) -> dict[str, Any]:
+    """Build the catalog entry of a job script from its indexed metadata."""
+    (name, metadata) = (entry.name, entry.metadata)
+
+    apptainer_image_urls: list[str | None]
+    if metadata.image_source is None:
+        logger.warning(f"No image source found for {name}")
+        apptainer_image_urls = [None]
+    elif metadata.image_source == "Dockerfile":
+        if metadata.image_tags is None:
+            apptainer_image_urls = [f"{CATALOG_IMAGE_REGISTRY}/{name}:latest"]
+        else:
+            apptainer_image_urls = [f"{CATALOG_IMAGE_REGISTRY}/{name}:{tag}" for tag in metadata.image_tags]
+    else:
+        apptainer_image_urls = [metadata.image_source]
+
+    supporting_files_urls = (
+        [
+            f"s3://{settings.s3_bucket}/files/{name}/{supporting_file.name}"
+            for supporting_file in metadata.supporting_files
+        ]
+        if metadata.supporting_files
+        else []
+    )
+
+    logger.debug(f"Added {name} to the catalog")
+    return {
+        "name": name,
+        "summary": metadata.summary,
+        "icon-url": metadata.icon_url,
+        "description": entry.description,
+        "entrypoint-file-url": f"s3://{settings.s3_bucket}/files/{name}/{metadata.entrypoint.name}",
+        "supporting-files-urls": supporting_files_urls,
+        "apptainer-image-urls": apptainer_image_urls,
+    }
+
+
+def load_catalog(catalog_path: Path) -> JobScriptCatalog | None:
+    """Load a previously generated catalog, returning None if there is none."""
+    import yaml
+
+    if not catalog_path.exists():
+        return None
+    with open(catalog_path) as catalog_file:
+        return yaml.safe_load(catalog_file) or {"job-scripts": []}
+
+
+def write_catalog(catalog: JobScriptCatalog, catalog_path: Path):
+    """Atomically write the catalog, so readers never see a partially written file."""
+    import yaml
+
+    tmp_path = catalog_path.with_name(f".{catalog_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as catalog_file:
+        yaml.dump(catalog, catalog_file, indent=2)
+    tmp_path.replace(catalog_path)
+
+
+def merge_catalog_items(
+    catalog: JobScriptCatalog, items: list[dict[str, Any]], removed: set[str]
+) -> JobScriptCatalog:
+    """Replace or insert the given items in a catalog and drop the removed job scripts.
+
+    Existing entries keep their position, new ones are appended.
+    """
+    items_by_name = {item["name"]: item for item in items}
+    merged = [
+        items_by_name.pop(item["name"], item)
+        for item in catalog["job-scripts"]
+        if item["name"] not in removed
+    ]
+    merged.extend(items_by_name.values())
+    return {"job-scripts": merged}
+
+
+def diff_catalogs(old: JobScriptCatalog, new: JobScriptCatalog) -> CatalogDiff:
+    """Compute the job scripts added, removed and changed between two catalogs, with the changed fields."""
+    old_items = {str(item["name"]): item for item in old["job-scripts"]}
+    new_items = {str(item["name"]): item for item in new["job-scripts"]}
+    changed: dict[str, list[str]] = {}
+    for name in old_items.keys() & new_items.keys():
+        fields = sorted(
+            field
+            for field in old_items[name].keys() | new_items[name].keys()
+            if old_items[name].get(field) != new_items[name].get(field)
+        )
+        if fields:
+            changed[str(name)] = fields
+    return CatalogDiff(
+        added=sorted(new_items.keys() - old_items.keys()),
+        removed=sorted(old_items.keys() - new_items.keys()),
+        changed=dict(sorted(changed.items())),
+    )
+
+
+def generate_catalog(
+    settings: Settings,
+    catalog_path: Path,
+    only: set[str] | None = None,
+    changed_only: bool = False,
+    use_index: bool = True,
+    dry_run: bool = False,
+) -> tuple[JobScriptCatalog, CatalogDiff, bool]:
+    """Generate the catalog from the job scripts of the current directory.
+
+    With only, even empty, or changed_only, the existing catalog is loaded and only the affected entries are
+    replaced, inserted or removed. The catalog file is written atomically, and only when its content
+    changes. Return the catalog, its difference with the previous one and whether it was written.
+    """
+    previous_catalog = load_catalog(catalog_path)
+    incremental = only is not None or changed_only
+    if incremental and previous_catalog is None:
+        logger.warning(f"No catalog found at {catalog_path}. Generating the whole catalog")
+        incremental = False
+
+    job_scripts_paths = find_job_scripts()
+    logger.debug(f"Found {len(job_scripts_paths)} job scripts: {[path.name for path in job_scripts_paths]}")
+    names_on_disk = {path.name for path in job_scripts_paths}
+
+    removed: set[str] = set()
+    if incremental and only is not None:
+        job_scripts_paths = [path for path in job_scripts_paths if path.name in only]
+        removed = only - names_on_disk
+
+    with tracer.span("catalog", "index", job_scripts=len(job_scripts_paths)) as trace:
+        (entries, changed) = index_job_scripts(job_scripts_paths, use_index=use_index, save=not dry_run)
+        trace.update(changed=len(changed))
+
+    if incremental:
+        assert previous_catalog is not None
+        previous_names = {str(item["name"]) for item in previous_catalog["job-scripts"]}
+        if changed_only:
+            entries = [
+                entry for entry in entries if entry.name in changed or entry.name not in previous_names
+            ]
+            removed = previous_names - names_on_disk
+        logger.debug(f"Updating {[entry.name for entry in entries]} and removing {sorted(removed)}")
+        items = [build_catalog_item(entry, settings) for entry in entries]
+        catalog = merge_catalog_items(previous_catalog, items, removed)
+    else:
+        catalog = {"job-scripts": [build_catalog_item(entry, settings) for entry in entries]}
+
+    diff = diff_catalogs(previous_catalog or {"job-scripts": []}, catalog)
+    written = False
+    if not dry_run and not (diff.is_empty and previous_catalog is not None):
+        with tracer.span("catalog", "write"):
+            write_catalog(catalog, catalog_path)
+        written = True
+    return (catalog, diff, written)
+
+
+def report_catalog_diff(diff: CatalogDiff, footer: str):
+    """Render the structural difference between two versions of the catalog."""
+    changed_items = [f"{name} ({', '.join(fields)})" for (name, fields) in diff.changed.items()]
+    terminal_message(
+        snick.dedent(
+            f"""
+            Added: {", ".join(diff.added) or "none"}
+            Removed: {", ".join(diff.removed) or "none"}
+            Changed: {", ".join(changed_items) or "none"}
+            """
+        ),
+        "Catalog Changes" if not diff.is_empty else "Catalog Unchanged",
+        footer=footer,
+    )
+
+
+async def run_tasks_concurrently(
+    tasks: dict[str, Coroutine[Any, Any, Any]], max_concurrency: int | None = None
+) -> list[TaskResult]:
+    """Run tasks concurrently, with at most max_concurrency of them running at the same time.
+
+    A failing task does not cancel the other ones. The outcome of each task is returned in
+    the same order the tasks were supplied.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or len(tasks) or 1)
+    console = Console()
+    total = len(tasks)
+    finished = 0
+
+    async def run_task(name: str, task: Coroutine[Any, Any, Any]) -> TaskResult:
+        nonlocal finished
+        async with semaphore:
+            logger.debug(f"Starting task {name}")
+            start = time.perf_counter()
+            (outcome, error) = (None, None)
+            with tracer.span(name, "task") as trace:
+                try:
+                    value = await task
+                    if isinstance(value, str):
+                        outcome = value
+                except Abort as err:
+                    error = err.message
+                except Exception as err:
+                    error = f"{type(err).__name__}: {err}"
+                trace.update(outcome=outcome, error=error)
+            elapsed = time.perf_counter() - start
+            finished += 1
+            status = "[green]done[/green]" if error is None else "[red]failed[/red]"
+            console.print(f"[{finished}/{total}] {name} {status} in {elapsed:.1f}s")
+            return TaskResult(name=name, elapsed=elapsed, outcome=outcome, error=error)
+
+    return await asyncio.gather(*(run_task(name, task) for (name, task) in tasks.items()))
+
+
+def report_task_results(
+    results: list[TaskResult],
+    subject: str,
+    count_outcomes: bool = False,
+    footer: str | None = None,
+    journal: RunJournal | None = None,
+):
+    """Render a summary of the task results and abort if any of them failed.
+
+    If count_outcomes is set, the number of tasks per outcome is shown in the summary footer
+    instead of the supplied one. The journal of the run is deleted if every task succeeded, and
+    kept for a resumed run otherwise.
+    """
+    lines = []
+    for result in results:
+        line = f"{result.name}: {result.elapsed:.1f}s"
+        if result.outcome is not None:
+            line += f" ({result.outcome})"
+        if result.error is None:
+            lines.append(f"[green]✔[/green] {line}")
+        else:
+            lines.append(f"[red]✘[/red] {line} - {result.error}")
+
+    if count_outcomes:
+        outcomes = Counter(result.outcome for result in results if result.outcome is not None)
+        footer = ", ".join(f"{count} {outcome}" for (outcome, count) in sorted(outcomes.items()))
+
+    failed = [result.name for result in results if result.error is not None]
+    if failed and journal is not None:
+        lines.extend(
+            ["", f"Completed steps are recorded in {journal.path}, rerun with --resume to skip them"]
+        )
+    if failed:
+        raise Abort(
+            "\n".join(lines),
+            subject=f"{subject} failed for {len(failed)} of {len(results)} job scripts",
+            log_message=f"Tasks failed: {failed}",
+        )
+    if journal is not None:
+        journal.complete()
+    terminal_message("\n".join(lines), f"{subject} summary", footer=footer, indent=False)
+
+
+async def docker_build(
+    context: IO[bytes],
+    dockerfile: str,
+    tag: str,
+    cache_export: Path | None = None,
+    cache_imports: list[Path] | None = None,
+    oci_archive: Path | None = None,
+    docker_host: str | None = None,
+):
+    """Build a Docker image from a build context tarball.
+
+    The image is built through the Docker SDK, unless a BuildKit cache directory is given to export
+    the layers to or an OCI archive to write the image to. In that case docker buildx builds it,
+    importing the layers of the existing cache directories, and either loads the image into the
+    daemon or writes it to the archive. The image is built by the daemon at the docker_host
+    endpoint, defaulting to the one of the environment.
+    """
+    if cache_export is None and oci_archive is None:
+        client = docker_client(docker_host)
+        # the Docker SDK is blocking, so the build runs on the threads dedicated to it
+        await run_docker(
+            client.images.build,
+            fileobj=context,
+            custom_context=True,
+            dockerfile=dockerfile,
+            tag=tag,
+            rm=True,
+        )
+        return
+
+    arguments = [f"docker buildx build --file {shlex.quote(dockerfile)} --tag {tag}"]
+    if oci_archive is None:
+        arguments.append("--load")
+    else:
+        arguments.append(f"--output type=oci,dest={shlex.quote(str(oci_archive))}")
+    arguments.extend(
+        f"--cache-from type=local,src={shlex.quote(str(path))}"
+        for path in cache_imports or []
+        if path.exists()
+    )
+    if cache_export is not None:
+        arguments.append(f"--cache-to type=local,dest={shlex.quote(str(cache_export))},mode=max")
+    arguments.append("-")
+    env = None if docker_host is None else {"DOCKER_HOST": docker_host}
+    await run_command_logged(" ".join(arguments), env=env, stdin=context)
+
+
+def _stage_cache_dir(stage: SharedStage) -> Path:
+    """Return the BuildKit cache directory of a shared stage."""
+    return layer_cache_dir / stage.tag.partition(":")[0]
+
+
+async def _find_unbuilt_dockerfile(
+    job_script_path: Path,
+    use_cache: bool,
+    compression: SifCompression | None = None,
+    compression_level: int | None = None,
+) -> Path | None:
+    """Return the Dockerfile of a job script, or None if its image is in the build cache."""
+    try:
+        metadata = load_build_metadata(job_script_path, compression, compression_level)
+        if use_cache:
+            key = await asyncio.to_thread(compute_build_key, job_script_path, metadata)
+            if has_build_cache_entry(key):
+                return None
+        return resolve_dockerfile(job_script_path, metadata.image_source)
+    except Exception as err:
+        logger.warning(f"Leaving {job_script_path} out of the shared layers: {err}")
+        return None
+
+
+async def prepare_shared_layers(
+    job_scripts: list[Path],
+    jobs: int,
+    dry_run: bool = False,
+    use_cache: bool = True,
+    buildkit_cache: bool = False,
+    compression: SifCompression | None = None,
+    compression_level: int | None = None,
+    docker_hosts: list[str] | None = None,
+) -> list[SharedStage]:
+    """Pull the base images and build the layers shared by the job scripts before building them.
+
+    Only the job scripts missing from the build cache are considered. Their base images are pulled
+    concurrently, once each, then the stages shared by several of them are built, shallowest first,
+    so that their own builds find those layers in the cache. Failures are only logged, since the
+    builds of the job scripts pull and build whatever is missing anyway. With docker_hosts, the
+    layers are prepared on each of these daemons. Return the shared stages.
+    """
+    found = await asyncio.gather(
+        *(_find_unbuilt_dockerfile(path, use_cache, compression, compression_level) for path in job_scripts)
+    )
+    dockerfiles = {
+        path.name: dockerfile for (path, dockerfile) in zip(job_scripts, found) if dockerfile is not None
+    }
+    images = sorted({image for path in dockerfiles.values() for image in base_images(parse_dockerfile(path))})
+    stages = find_shared_stages(dockerfiles)
+    lines = [f"Pull {image}" for image in images]
+    lines.extend(
+        f"Build {stage.tag} ({stage.depth} instructions) for {', '.join(stage.job_scripts)}"
+        for stage in stages
+    )
+    terminal_message("\n".join(lines) or "No shared layers to prepare", "Shared Layers", indent=False)
+    if dry_run or not dockerfiles:
+        return stages
 
+    hosts: list[str | None] = [*docker_hosts] if docker_hosts else [None]
+    semaphore = asyncio.Semaphore(jobs)
 
-async def create_async_generator(iterable: Iterable[Any]) -> AsyncGenerator:
-    """Create an async generator from an iterable."""
-    for item in iterable:
-        yield item
+    async def pull(image: str, docker_host: str | None):
+        async with semaphore:
+            with tracer.span(image, "pull", host=docker_host):
+                try:
+                    await run_docker(lambda: docker_client(docker_host).images.pull(image))
+                except Exception as err:
+                    logger.warning(f"Failed to pull {image}: {err}")
 
+    async def build_stage(stage: SharedStage, docker_host: str | None):
+        async with semaphore:
+            with tracer.span(stage.tag, "shared-build", job_scripts=stage.job_scripts, host=docker_host):
+                (context, _) = dockerfile_tarball(stage.dockerfile)
+                cache_export = _stage_cache_dir(stage) if buildkit_cache else None
+                try:
+                    with context:
+                        await docker_build(
+                            context,
+                            "Dockerfile",
+                            stage.tag,
+                            cache_export,
+                            [_stage_cache_dir(stage)],
+                            docker_host=docker_host,
+                        )
+                except Exception as err:
+                    logger.warning(f"Failed to build the shared stage {stage.tag}: {err}")
+
+    await asyncio.gather(*(pull(image, host) for image in images for host in hosts))
+    for depth in sorted({stage.depth for stage in stages}):
+        await asyncio.gather(
+            *(build_stage(stage, host) for stage in stages if stage.depth == depth for host in hosts)
+        )
+    return stages
+
+
+def resolve_build_backend(
+    metadata: JobScriptMetadata, backend: BuildBackend | None = None, host: BuildHost | None = None
+) -> BuildBackend:
+    """Return how an image reaches Apptainer, defaulting to the backend of the metadata then to the daemon.
+
+    Hosts reached through SSH always go through their daemon, since BuildKit would write the OCI
+    archive on the local machine rather than on the host.
+    """
+    if host is not None and host.is_remote:
+        return BuildBackend.DOCKER_DAEMON
+    return backend or metadata.build_backend or BuildBackend.DOCKER_DAEMON
+
+
+async def build_image(
+    job_script_path: Path,
+    dry_run: bool = False,
+    use_cache: bool = True,
+    timeout: float | None = None,
+    output_dir: Path | None = None,
+    buildkit_cache: bool = False,
+    shared_stages: list[SharedStage] | None = None,
+    backend: BuildBackend | None = None,
+    compression: SifCompression | None = None,
+    compression_level: int | None = None,
+    host: BuildHost | None = None,
+) -> str:
+    """Build an Apptainer image from a Dockerfile.
+
+    The build is skipped if an image for the same content is available in the build cache. The
+    Docker build context only holds the files the Dockerfile copies, and is streamed to the daemon
+    as a tarball. With buildkit_cache, the layers are imported from and exported to a local BuildKit
+    cache, along with the ones of the shared stages of the job script. The Apptainer build is killed
+    if it takes longer than timeout seconds. Return whether the image was restored from the cache or
+    built.
+
+    The backend, which defaults to the one of the metadata, selects how the image reaches Apptainer:
+    through the Docker daemon, or written by BuildKit to an OCI archive next to the output, which
+    skips exporting the image from the daemon again. The compression of the SIF filesystem also
+    defaults to the one of the metadata, and the build time and size are recorded under it.
+
+    With host, the image is built by the Docker daemon of that build host and converted by
+    Apptainer on it, and the .sif file is brought back to the output path.
+    """
+    output_path = sif_path(job_script_path, output_dir)
+    start = time.perf_counter()
+    metadata = load_build_metadata(job_script_path, compression, compression_level)
+    squashfs_args = mksquashfs_args(metadata)
+    setting = sif_setting(metadata)
+    name = job_script_path.name
+    backend = resolve_build_backend(metadata, backend, host)
+    host_label = None if host is None else host.label
+    cache_key = None
+    if use_cache:
+        with tracer.span(name, "cache-lookup") as trace:
+            cache_key = await asyncio.to_thread(compute_build_key, job_script_path, metadata)
+            logger.debug(f"Computed build cache key {cache_key} for {job_script_path}")
+            hit = not dry_run and await asyncio.to_thread(restore_from_build_cache, cache_key, output_path)
+            trace.update(key=cache_key, hit=hit)
+        if hit:
+            final_message = f"Reused cached Apptainer image {output_path}"
+            logger.debug(final_message)
+            terminal_message(final_message, "Image Cache Hit")
+            return "cache hit"
 
-async def build_image(job_script_path: Path, dry_run: bool = False):
-    """Build an Apptainer image from a Dockerfile."""
     with Abort.handle_errors(
         "Failed to build Docker image",
         raise_kwargs={
@@ -81,17 +761,53 @@ async def build_image(job_script_path: Path, dry_run: bool = False):
             "log_message": f"Failed to build Docker image from {job_script_path}",
         },
     ):
-        logger.debug(f"Building local docker image from {job_script_path}")
-        docker_client = docker.from_env()
-        tag = f"{job_script_path.name}:latest"
-        if not dry_run:
-            docker_client.images.build(
-                path=str(job_script_path),
-                tag=tag,
-                rm=True,
+        with tracer.span(name, "build-context") as trace:
+            dockerfile_path = resolve_dockerfile(job_script_path, metadata.image_source)
+            context_files = await asyncio.to_thread(build_context_files, job_script_path, dockerfile_path)
+            (context, context_size) = await asyncio.to_thread(
+                build_context_tarball, job_script_path, context_files
             )
-        docker_image_source = f"docker-daemon://{tag}"
-        logger.debug(f"Built local docker image {tag}")
+            trace.update(files=len(context_files), bytes=context_size)
+        logger.debug(
+            f"Assembled a build context of {len(context_files)} files and {context_size} bytes "
+            f"for {job_script_path}"
+        )
+        tag = f"{job_script_path.name}:latest"
+        cache_export = layer_cache_dir / name if buildkit_cache else None
+        cache_imports = [layer_cache_dir / name]
+        cache_imports.extend(
+            _stage_cache_dir(stage) for stage in shared_stages or [] if name in stage.job_scripts
+        )
+        oci_archive = None
+        if backend == BuildBackend.OCI_ARCHIVE:
+            oci_archive = output_path.with_name(f".{output_path.stem}.oci.tar")
+        with context, tracer.span(
+            name,
+            "docker-build",
+            dry_run=dry_run,
+            buildkit=buildkit_cache,
+            backend=backend.value,
+            host=host_label,
+        ) as trace:
+            if not dry_run:
+                logger.debug(f"Building {backend.value} image from {job_script_path}")
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                dockerfile = dockerfile_path.relative_to(job_script_path).as_posix()
+                await docker_build(
+                    context,
+                    dockerfile,
+                    tag,
+                    cache_export,
+                    cache_imports,
+                    oci_archive,
+                    docker_host=None if host is None else host.docker_host,
+                )
+                if oci_archive is not None:
+                    trace.update(bytes=oci_archive.stat().st_size)
+        docker_image_source = (
+            f"docker-daemon://{tag}" if oci_archive is None else f"oci-archive://{oci_archive}"
+        )
+        logger.debug(f"Built docker image {docker_image_source}")
 
     with Abort.handle_errors(
         "Failed to build Apptainer image",
@@ -101,19 +817,183 @@ async def build_image(job_script_path: Path, dry_run: bool = False):
         },
     ):
         logger.debug(f"Building Apptainer image from {docker_image_source}")
-        output_path = job_script_path / "output.sif"
         if not dry_run:
-            command = f"apptainer build {output_path} {docker_image_source}"
-            run_command_logged(command)
-    final_message = f"Built Apptainer image {output_path}"
+            # the previous image may be hard linked to a cache entry, so it must not be overwritten in place
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_path.unlink(missing_ok=True)
+            with tracer.span(name, "sif-conversion", setting=setting, host=host_label) as trace:
+                try:
+                    await convert_to_sif(name, output_path, docker_image_source, squashfs_args, timeout, host)
+                finally:
+                    if oci_archive is not None:
+                        oci_archive.unlink(missing_ok=True)
+                trace.update(bytes=output_path.stat().st_size)
+            if cache_key is not None:
+                with tracer.span(name, "cache-store"):
+                    await asyncio.to_thread(store_in_build_cache, cache_key, job_script_path, output_path)
+    final_message = (
+        f"Built Apptainer image {output_path} in {time.perf_counter() - start:.1f}s "
+        f"from a build context of {context_size / 1024:.1f} KiB"
+    )
     logger.debug(final_message)
     terminal_message(final_message, "Image Built Successfully")
+    if dry_run:
+        return "dry run"
+    record_history(
+        name, "build", time.perf_counter() - start, size=output_path.stat().st_size, setting=setting
+    )
+    return "cache miss" if use_cache else "built"
 
 
-async def publish_image(
-    job_script_path: Path, settings: Settings, dry_run: bool = False, verbose: bool = False
+async def convert_to_sif(
+    name: str,
+    output_path: Path,
+    image_source: str,
+    squashfs_args: str | None,
+    timeout: float | None = None,
+    host: BuildHost | None = None,
+):
+    """Convert a Docker image to a .sif file with Apptainer, on the build host if any."""
+    if host is None:
+        await run_command_logged(
+            apptainer_build_command(output_path, image_source, squashfs_args), timeout=timeout
+        )
+        return
+    work_path = host.work_path(output_path, name)
+    logger.debug(f"Converting the image of {name} on the build host {host.label} to {work_path}")
+    await host.run(apptainer_build_command(work_path, image_source, squashfs_args), timeout=timeout)
+    await host.fetch(work_path, output_path)
+
+
+def schedule_build(
+    job_script_path: Path, host_pool: BuildHostPool | None = None, **build_kwargs: Any
+) -> Coroutine[Any, Any, str]:
+    """Return the build of a job script, scheduled on one of the build hosts of the pool if any."""
+    if host_pool is None:
+        return build_image(job_script_path, **build_kwargs)
+    return host_pool.run(
+        job_script_path.name, lambda host: build_image(job_script_path, host=host, **build_kwargs)
+    )
+
+
+def resolve_image_tags(metadata: JobScriptMetadata, image_name: str) -> list[str]:
+    """Return the tags to publish an image with, which always include the latest tag."""
+    logger.debug("Fetching image tags from the metadata")
+    tags = metadata.image_tags
+    # if no tag is defined, use "latest"
+    # if a tag is present, make sure it has the latest as well
+    if tags is None or len(tags) == 0:
+        tags = ["latest"]
+        logger.debug(f"No tag defined for the image {image_name=}, using {tags=}")
+    elif "latest" not in tags:
+        tags = list(set(tags + ["latest"]))
+        logger.debug("Added the 'latest' tag to the image tags")
+    else:
+        logger.debug(f"Using tags {tags=} for the image {image_name=}")
+    return tags
+
+
+def ensure_ecr_repository(aws: AwsClients, image_name: str, dry_run: bool = False) -> EcrLogin:
+    """Log into the ECR Public registry and make sure the image repository exists."""
+    login = aws.ecr_login()
+    ecr = aws.ecr_public()
+    try:
+        ecr.get_repository_catalog_data(
+            registryId=login.registry_id,
+            repositoryName=image_name,
+        )
+    except ecr.exceptions.RepositoryNotFoundException:
+        logger.warning(f"Repository {image_name} not found. Creating it")
+        if not dry_run:
+            ecr.create_repository(repositoryName=image_name)
+    return login
+
+
+def attach_image_tags(
+    registry: RegistryClient, repository: str, source_tag: str, tags: list[str], settings: Settings
 ):
-    """Publish an Apptainer image to a remote registry."""
+    """Attach tags to an already published image by uploading its manifest under each of them."""
+    description = f"manifest fetch of {repository}:{source_tag}"
+    manifest = retry_call(
+        registry.get_manifest, repository, source_tag, settings=settings, description=description
+    )
+    Abort.require_condition(
+        manifest is not None,
+        f"Could not fetch the manifest of {registry.domain}/{repository}:{source_tag}",
+        raise_kwargs=dict(subject="Publish failed", log_message="Source manifest not found"),
+    )
+    assert manifest is not None
+    for tag in tags:
+        description = f"manifest upload of {repository}:{tag}"
+        retry_call(
+            registry.put_manifest, repository, tag, manifest, settings=settings, description=description
+        )
+        logger.debug(f"Tagged {registry.domain}/{repository}:{source_tag} as {tag}")
+
+
+async def find_unchanged_tags(
+    registry: RegistryClient,
+    repository: str,
+    tags: list[str],
+    digest: str,
+    settings: Settings,
+    force: bool = False,
+) -> list[str]:
+    """Return the tags whose manifest in the registry already references the image digest.
+
+    With force, the registry is not checked and every tag is considered outdated.
+    """
+    unchanged_tags: list[str] = []
+    if force:
+        return unchanged_tags
+    for tag in tags:
+        manifest = await asyncio.to_thread(
+            retry_call,
+            registry.get_manifest,
+            repository,
+            tag,
+            settings=settings,
+            description=f"manifest check of {repository}:{tag}",
+        )
+        if manifest is not None and digest in manifest.layer_digests:
+            logger.debug(f"Tag {tag} of {repository} already references {digest}. Skipping it")
+            unchanged_tags.append(tag)
+    return unchanged_tags
+
+
+async def push_image(job_script: str, output_path: Path, publish_url: str, settings: Settings):
+    """Push an Apptainer image, retrying failed pushes, and record the push duration in the history."""
+    push_start = time.perf_counter()
+    # a registry served over plain HTTP, such as a local stand-in, needs the flag for the push as well
+    no_https = " --no-https" if settings.oci_registry_plain_http else ""
+    command = f"apptainer push{no_https} {output_path} {publish_url}"
+    # the output of a failed push does not tell transient errors apart, so any of them is retried
+    await retry_async(
+        lambda: run_command_logged(command),
+        settings,
+        f"push of {publish_url}",
+        is_transient=lambda err: isinstance(err, RuntimeError) or is_transient_error(err),
+    )
+    record_history(job_script, "push", time.perf_counter() - push_start, size=output_path.stat().st_size)
+
+
+async def publish_image(
+    job_script_path: Path,
+    aws: AwsClients,
+    dry_run: bool = False,
+    verbose: bool = False,
+    force: bool = False,
+    output_dir: Path | None = None,
+    journal: RunJournal | None = None,
+) -> str | None:
+    """Publish an Apptainer image to a remote registry.
+
+    The image is pushed once and the remaining tags are attached by uploading its manifest under
+    them. Tags whose remote manifest already references the local image digest are left untouched,
+    unless force is set. Tags recorded in the journal for the same digest are skipped without
+    checking the registry, and the ones published are recorded. Transient registry errors are
+    retried. Return a short description of what was published.
+    """
     logger.debug(f"Loading metadata.yaml from {job_script_path}")
     metadata = load_job_script_metadata(job_script_path)
     logger.debug("Metadata loaded successfully:")
@@ -127,92 +1007,136 @@ async def publish_image(
     if image_source is None:
         logger.debug("No image source defined. Skipping the publish process")
         terminal_message("No image source defined. Skipping the publish process", "Publish Skipped")
-        return
-    elif image_source == "Dockerfile":
-        logger.debug("The image source is 'Dockerfile'. Starting the publish process")
-        image_name = job_script_path.stem
-        logger.debug(f"Using {image_name=} as the image name")
-
-        logger.debug("Getting ECR client for region us-east-1")
-        ecr: ECRPublicClient = boto3.client(
-            "ecr-public",
-            region_name="us-east-1",
-            aws_access_key_id=settings.aws_access_key_id,
-            aws_secret_access_key=settings.aws_secret_access_key,
-            aws_session_token=settings.aws_session_token,
-        )
-
-        logger.debug("Fetching authorization token and extracting username and password")
-        auth_token_response = ecr.get_authorization_token()
-        token = auth_token_response["authorizationData"]["authorizationToken"]
-        (username, password) = base64.b64decode(token).decode().split(":")
-        logger.debug(f"Got authorization token for user {username}")
-
-        logger.debug("Describing registries on ECR Public")
-        registry_response = ecr.describe_registries()
-        registry_list = registry_response["registries"]
-        Abort.require_condition(
-            len(registry_list) == 1,
-            "Did not find one and only one registry",
-            raise_kwargs=dict(
-                subject="Publish failed",
-                log_message=f"Found {len(registry_list)} registries instead of one",
-            ),
+        return "no image source"
+    elif image_source != "Dockerfile":
+        logger.debug("The image source is an external registry. Skipping the publish process")
+        terminal_message(
+            "The image source is an external registry. Skipping the publish process", "Publish Skipped"
         )
-        registry_data = registry_list[0]
-        registry_id = registry_data["registryId"]
-        registry_uri = registry_data["registryUri"]
-        registry_domain = registry_uri.split("/")[0]
+        return "external image"
 
-        try:
-            ecr.get_repository_catalog_data(
-                registryId=registry_id,
-                repositoryName=image_name,
-            )
-        except ecr.exceptions.RepositoryNotFoundException:
-            logger.warning(f"Repository {image_name} not found. Creating it")
-            if not dry_run:
-                ecr.create_repository(repositoryName=image_name)
-
-        logger.debug("Logging into the ECR Public registry via Apptainer")
-        command = (
-            "apptainer registry login "
-            f"--username={username} "
-            f"--password={password} "
-            f"oras://{registry_domain}"
-        )
-        run_command(command)
-
-        logger.debug("Fetching image tags from the metadata")
-        tags = metadata.image_tags
-        # if no tag is defined, use "latest"
-        # if a tag is present, make sure it has the latest as well
-        if tags is None or len(tags) == 0:
-            tags = ["latest"]
-            logger.debug(f"No tag defined for the image {image_name=}, using {tags=}")
-        elif "latest" not in tags:
-            tags = list(set(tags + ["latest"]))
-            logger.debug("Added the 'latest' tag to the image tags")
-        else:
-            logger.debug(f"Using tags {tags=} for the image {image_name=}")
+    logger.debug("The image source is 'Dockerfile'. Starting the publish process")
+    image_name = job_script_path.stem
+    logger.debug(f"Using {image_name=} as the image name")
 
-        async for tag in create_async_generator(tags):
-            logger.debug(f"Publishing Apptainer image from {job_script_path}")
-            publish_url = f"oras://{registry_uri}/{image_name}:{tag}"
-            output_path = job_script_path / "output.sif"
-            if not dry_run:
-                command = f"apptainer push {output_path} {publish_url}"
-                run_command_logged(command)
-            logger.debug(f"Published Apptainer image {output_path} to {registry_uri}/{image_name}:{tag}")
+    settings = aws.settings
+    username: str | None = None
+    password: str | None = None
+    if settings.oci_registry is None:
+        with tracer.span(job_script_path.name, "ecr-login"):
+            login = await asyncio.to_thread(ensure_ecr_repository, aws, image_name, dry_run)
+        (registry_uri, username, password) = (login.registry_uri, login.username, login.password)
     else:
-        logger.debug("The image source is an external registry. Skipping the publish process")
-        terminal_message(
-            "The image source is an external registry. Skipping the publish process", "Publish Skipped"
+        logger.debug(f"Using the OCI registry {settings.oci_registry} instead of ECR Public")
+        registry_uri = settings.oci_registry
+
+    tags = resolve_image_tags(metadata, image_name)
+
+    output_path = sif_path(job_script_path, output_dir)
+    with tracer.span(job_script_path.name, "digest", bytes=output_path.stat().st_size):
+        local_digest = f"sha256:{await asyncio.to_thread(hash_file, output_path)}"
+    logger.debug(f"Local image {output_path} has digest {local_digest}")
+    from builder.registry import RegistryClient
+
+    (registry_domain, _, namespace) = registry_uri.partition("/")
+    registry = RegistryClient(
+        registry_domain, username=username, password=password, plain_http=settings.oci_registry_plain_http
+    )
+    repository = f"{namespace}/{image_name}".lstrip("/")
+
+    name = job_script_path.name
+
+    def record_tags(published_tags: list[str]):
+        if journal is not None and not dry_run:
+            journal.record_all(name, "image", published_tags, local_digest)
+
+    # tags already pointing at the local image are left untouched and one of them
+    # can serve as the source manifest for the outdated ones
+    resumed_tags = [] if journal is None else journal.completed(name, "image", tags, local_digest)
+    checked_tags = [tag for tag in tags if tag not in resumed_tags]
+    with tracer.span(name, "manifest-check", force=force) as trace:
+        unchanged_tags = await find_unchanged_tags(
+            registry, repository, checked_tags, local_digest, settings, force
         )
+        record_tags(unchanged_tags)
+        outdated_tags = [tag for tag in checked_tags if tag not in unchanged_tags]
+        unchanged = len(unchanged_tags)
+        trace.update(tags=len(tags), unchanged=unchanged, resumed=len(resumed_tags))
+    source_tag = next(iter(resumed_tags + unchanged_tags), None)
+
+    pushed = 0
+    if outdated_tags and source_tag is None:
+        source_tag = outdated_tags.pop(0)
+        logger.debug(f"Publishing Apptainer image from {job_script_path}")
+        publish_url = f"oras://{registry_uri}/{image_name}:{source_tag}"
+        with tracer.span(
+            job_script_path.name, "push", tag=source_tag, bytes=output_path.stat().st_size, dry_run=dry_run
+        ):
+            if not dry_run:
+                await push_image(job_script_path.name, output_path, publish_url, settings)
+        pushed += 1
+        record_tags([source_tag])
+        logger.debug(f"Published Apptainer image {output_path} to {registry_uri}/{image_name}:{source_tag}")
+
+    if outdated_tags and not dry_run:
+        assert source_tag is not None
+        with tracer.span(job_script_path.name, "tag", tags=outdated_tags):
+            await asyncio.to_thread(
+                attach_image_tags, registry, repository, source_tag, outdated_tags, settings
+            )
+        record_tags(outdated_tags)
+
+    outcome = f"{pushed} pushed, {len(outdated_tags)} tagged, {unchanged} unchanged"
+    return f"{outcome}, {len(resumed_tags)} resumed" if resumed_tags else outcome
+
+
+def upload_file_resumably(
+    aws: AwsClients, local_path: Path, key: str, digest: str, job_script: str, journal: RunJournal | None
+):
+    """Upload a file to the bucket, retrying transient errors, and record it in the journal.
+
+    The multipart upload recorded in the journal for the same digest is resumed, and the one started
+    otherwise is recorded, so each attempt resumes the upload left by the previous ones.
+    """
+    pending = None if journal is None else journal.find(job_script, "multipart-upload", key, digest)
+    upload_ids = [pending.upload_id] if pending is not None and pending.upload_id is not None else []
+
+    def record_upload(upload_id: str):
+        upload_ids.append(upload_id)
+        if journal is not None:
+            journal.record(job_script, "multipart-upload", key, digest, upload_id=upload_id)
+
+    retry_call(
+        lambda: aws.upload_file(
+            local_path,
+            key,
+            {"sha256": digest},
+            upload_id=upload_ids[-1] if upload_ids else None,
+            on_started=record_upload,
+        ),
+        settings=aws.settings,
+        description=f"upload of s3://{aws.settings.s3_bucket}/{key}",
+    )
+    if journal is not None:
+        journal.record(job_script, "file", key, digest)
 
 
-async def publish_files(job_script_path: Path, settings: Settings, dry_run: bool = False):
-    """Publish the auxiliary files for a job script to a remote S3 bucket."""
+async def publish_files(
+    job_script_path: Path,
+    aws: AwsClients,
+    dry_run: bool = False,
+    force: bool = False,
+    journal: RunJournal | None = None,
+) -> str:
+    """Publish the auxiliary files for a job script to a remote S3 bucket.
+
+    Files whose remote copy has the same content are skipped, unless force is set. Files recorded in
+    the journal for the same digest are skipped without checking the bucket, and the multipart
+    uploads started for large files are recorded, so they are resumed instead of restarted, both by
+    the retries of transient errors and by a resumed run. Return a short description of what was
+    published.
+    """
+    settings = aws.settings
     logger.debug(f"Loading metadata.yaml from {job_script_path}")
     metadata = load_job_script_metadata(job_script_path)
     logger.debug("Metadata loaded successfully:")
@@ -231,21 +1155,168 @@ async def publish_files(job_script_path: Path, settings: Settings, dry_run: bool
             log_message="Some of the files do not exist",
         )
 
-    async for file_path in create_async_generator(files_paths):
+    s3 = aws.s3()
+
+    name = job_script_path.name
+
+    def publish_file(file_path: Path) -> str:
+        """Upload a single file unless its remote copy is identical, returning what was done."""
         logger.debug(f"Publishing {file_path} to the bucket {settings.s3_bucket}")
-        s3: S3Client = boto3.client(
-            "s3",
-            region_name=settings.s3_bucket_region,
-            aws_access_key_id=settings.aws_access_key_id,
-            aws_secret_access_key=settings.aws_secret_access_key,
-            aws_session_token=settings.aws_session_token,
-        )
-        if not dry_run:
-            s3.upload_file(
-                Filename=str(job_script_path / file_path),
-                Bucket=settings.s3_bucket,
-                Key=f"files/{job_script_path.name}/{file_path}",
+        local_path = job_script_path / file_path
+        key = f"files/{name}/{file_path}"
+        with tracer.span(name, "s3-check", file=str(file_path)) as trace:
+            local_digest = hash_file(local_path)
+            if journal is not None and journal.is_done(name, "file", key, local_digest):
+                trace.update(resumed=True)
+                return "resumed"
+            unchanged = not force and retry_call(
+                is_s3_object_unchanged,
+                s3,
+                settings.s3_bucket,
+                key,
+                local_path,
+                local_digest,
+                settings=settings,
+                description=f"check of s3://{settings.s3_bucket}/{key}",
             )
-        logger.debug(
-            f"Published {file_path} to the bucket s3://{settings.s3_bucket}/files/{job_script_path.name}"
-        )
+            trace.update(unchanged=unchanged)
+        if unchanged:
+            logger.debug(f"{file_path} is unchanged in the bucket {settings.s3_bucket}. Skipping it")
+            if journal is not None and not dry_run:
+                journal.record(name, "file", key, local_digest)
+            return "unchanged"
+
+        with tracer.span(
+            name,
+            "s3-upload",
+            file=str(file_path),
+            bytes=local_path.stat().st_size,
+            dry_run=dry_run,
+        ):
+            if not dry_run:
+                upload_file_resumably(aws, local_path, key, local_digest, name, journal)
+        logger.debug(f"Published {file_path} to the bucket s3://{settings.s3_bucket}/files/{name}")
+        return "uploaded"
+
+    # files are uploaded concurrently, each of them using multipart uploads when large enough
+    results = await asyncio.gather(*(asyncio.to_thread(publish_file, file_path) for file_path in files_paths))
+    outcomes = Counter(results)
+    summary = f"{outcomes['uploaded']} uploaded, {outcomes['unchanged']} unchanged"
+    return f"{summary}, {outcomes['resumed']} resumed" if outcomes["resumed"] else summary
+
+
+async def run_job_pipeline(
+    job_script_path: Path,
+    aws: AwsClients,
+    stages: dict[str, asyncio.Semaphore],
+    dry_run: bool = False,
+    force: bool = False,
+    use_cache: bool = True,
+    timeout: float | None = None,
+    output_dir: Path | None = None,
+    verbose: bool = False,
+    buildkit_cache: bool = False,
+    shared_stages: list[SharedStage] | None = None,
+    backend: BuildBackend | None = None,
+    compression: SifCompression | None = None,
+    compression_level: int | None = None,
+    journal: RunJournal | None = None,
+    kinds: set[ChangeKind] | None = None,
+    host_pool: BuildHostPool | None = None,
+) -> str:
+    """Stream a job script through the build, publish image and publish files stages.
+
+    Each stage only waits for its own semaphore, so the builds of some job scripts overlap with
+    the uploads of others. The auxiliary files do not depend on the image, so they are published
+    while the image is built and pushed. With kinds, the image or the files are only delivered if
+    they are among the changed artifacts. With host_pool, the image is built on one of its hosts.
+    Return a short description of each stage outcome.
+    """
+    kinds = set(ChangeKind) if kinds is None else kinds
+
+    async def build_and_publish_image() -> str:
+        if ChangeKind.IMAGE not in kinds:
+            return "unchanged, skipped"
+        async with stages["build"]:
+            built = await schedule_build(
+                job_script_path,
+                host_pool,
+                dry_run=dry_run,
+                use_cache=use_cache,
+                timeout=timeout,
+                output_dir=output_dir,
+                buildkit_cache=buildkit_cache,
+                shared_stages=shared_stages,
+                backend=backend,
+                compression=compression,
+                compression_level=compression_level,
+            )
+        if dry_run and not sif_path(job_script_path, output_dir).exists():
+            return f"{built}, publish skipped"
+        async with stages["publish-image"]:
+            published = await publish_image(
+                job_script_path, aws, dry_run, verbose, force, output_dir, journal
+            )
+        return f"{built}, {published}"
+
+    async def upload_files() -> str:
+        if ChangeKind.FILES not in kinds:
+            return "unchanged, skipped"
+        async with stages["publish-files"]:
+            return await publish_files(job_script_path, aws, dry_run, force, journal)
+
+    (image, files) = await asyncio.gather(build_and_publish_image(), upload_files(), return_exceptions=True)
+    for outcome in (image, files):
+        if isinstance(outcome, BaseException):
+            raise outcome
+    return f"image: {image}; files: {files}"
+
+
+async def refresh_job_script(
+    job_script_path: Path,
+    change: JobScriptChange,
+    aws: AwsClients | None = None,
+    timeout: float | None = None,
+    output_dir: Path | None = None,
+    verbose: bool = False,
+) -> str:
+    """Rerun the minimal steps for the changes of a job script, as the watch command does.
+
+    The image is rebuilt when its Dockerfile or build context changed, then published along with
+    the changed files when AWS clients are given. Changes only affecting the catalog entry, or the
+    files when not publishing, need no step here. Return a short description of each step outcome.
+    """
+    outcomes = []
+    if ChangeKind.IMAGE in change.kinds:
+        built = await build_image(job_script_path, timeout=timeout, output_dir=output_dir)
+        outcomes.append(f"image {built}")
+        if aws is not None:
+            published = await publish_image(job_script_path, aws, verbose=verbose, output_dir=output_dir)
+            outcomes.append(published or "image published")
+    if ChangeKind.FILES in change.kinds:
+        if aws is None:
+            outcomes.append("files changed, not published")
+        else:
+            outcomes.append(await publish_files(job_script_path, aws))
+    return ", ".join(outcomes) or "nothing to rebuild"
+
+
+def is_s3_object_unchanged(s3: S3Client, bucket: str, key: str, local_path: Path, local_digest: str) -> bool:
+    """Check if an S3 object has the same content as a local file.
+
+    The SHA-256 digest recorded in the object metadata upon upload is compared with the local one.
+    Objects uploaded without it are compared by ETag, which is the MD5 digest of single part uploads.
+    """
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key)
+    except s3.exceptions.ClientError as err:
+        if err.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    remote_digest = head.get("Metadata", {}).get("sha256")
+    if remote_digest is not None:
+        return remote_digest == local_digest
+    etag = head.get("ETag", "").strip('"')
+    if "-" in etag:
+        return False
+    return etag == hash_file(local_path, algorithm="md5")
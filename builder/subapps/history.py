@@ -0,0 +1,87 @@
+"""App for inspecting the history of the build and push durations."""
+
+from datetime import datetime
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+
+from builder.cache import init_cache
+from builder.exceptions import handle_abort
+from builder.format import terminal_message
+from builder.history import (
+    clear_history,
+    estimate_durations,
+    history_path,
+    list_history,
+    summarize_settings,
+)
+
+app = typer.Typer()
+
+
+@app.command(name="show")
+@handle_abort
+@init_cache
+def show(
+    job_scripts: Annotated[
+        Optional[list[Path]],
+        typer.Argument(..., help="Paths of the job scripts to show. If None, all job scripts are shown."),
+    ] = None,
+    limit: int = typer.Option(20, min=1, help="Maximum number of records shown."),
+):
+    """Show the recent build and push durations, the estimates derived from them and the build settings.
+
+    The builds are averaged for each SIF compression setting, to weigh build time against image size.
+    """
+    names = [path.name for path in job_scripts] if job_scripts else None
+    records = list_history(names, limit=limit)
+    lines = [
+        f"{datetime.fromtimestamp(record.recorded_at):%Y-%m-%d %H:%M} {record.job_script} "
+        f"{record.phase}"
+        + (f" ({record.setting})" if record.setting is not None else "")
+        + f": {record.duration:.1f}s"
+        + (f", {record.size / 1024**2:.1f} MiB" if record.size is not None else "")
+        for record in records
+    ]
+    estimated_names = names or sorted({record.job_script for record in records})
+    estimates = {phase: estimate_durations(estimated_names, [phase]) for phase in ("build", "push")}
+    if estimated_names:
+        lines.append("")
+        lines.append("Estimated durations:")
+    for name in estimated_names:
+        phases = [
+            f"{phase} {estimate:.1f}s"
+            if (estimate := estimates[phase][name]) is not None
+            else f"{phase} unknown"
+            for phase in estimates
+        ]
+        lines.append(f"{name}: {', '.join(phases)}")
+    summaries = summarize_settings(names)
+    if summaries:
+        lines.append("")
+        lines.append("Build settings:")
+    for summary in summaries:
+        lines.append(
+            f"{summary.job_script} ({summary.setting}): {summary.runs} runs, {summary.duration:.1f}s"
+            + (f", {summary.size / 1024**2:.1f} MiB" if summary.size is not None else "")
+        )
+    terminal_message(
+        "\n".join(lines) or "No history recorded", "Build History", footer=str(history_path), indent=False
+    )
+
+
+@app.command(name="clear")
+@handle_abort
+@init_cache
+def clear(
+    job_scripts: Annotated[
+        Optional[list[Path]],
+        typer.Argument(
+            ..., help="Paths of the job scripts to forget. If None, the whole history is cleared."
+        ),
+    ] = None,
+):
+    """Clear the recorded history."""
+    deleted = clear_history([path.name for path in job_scripts] if job_scripts else None)
+    terminal_message(f"Deleted {deleted} history records", "Process Complete")
@@ -0,0 +1,199 @@
+"""App for running every stage of the catalog delivery for each job script."""
+
+import asyncio
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+
+from builder.aws import AwsClients
+from builder.build_hosts import size_docker_executor
+from builder.cache import init_cache
+from builder.config import attach_settings
+from builder.context import CliContext
+from builder.exceptions import handle_abort
+from builder.format import terminal_message
+from builder.journal import RunJournal
+from builder.schemas import BuildBackend, ChangeKind, SifCompression
+from builder.subapps.helpers import (
+    check_existing_paths,
+    check_metadata_exists,
+    default_build_jobs,
+    detect_job_script_changes,
+    find_job_scripts,
+    generate_catalog,
+    prepare_shared_layers,
+    report_catalog_diff,
+    report_task_results,
+    run_job_pipeline,
+    run_tasks_concurrently,
+    schedule_longest_first,
+    start_build_hosts,
+)
+
+app = typer.Typer()
+
+
+@app.command(name="run")
+@handle_abort
+@init_cache
+@attach_settings
+def run(
+    ctx: typer.Context,
+    job_scripts: Annotated[
+        Optional[list[Path]],
+        typer.Argument(
+            ..., help="Paths of the job scripts to deliver. If None, all job scripts will be delivered."
+        ),
+    ] = None,
+    dry_run: bool = typer.Option(False, help="Do not build nor publish anything, only print the commands."),
+    force: bool = typer.Option(
+        False, "--force", help="Publish the artifacts even if the remote copies are identical."
+    ),
+    no_cache: bool = typer.Option(
+        False, "--no-cache", help="Rebuild the images even if they are available in the build cache."
+    ),
+    timeout: Optional[float] = typer.Option(
+        None, min=1, help="Maximum duration, in seconds, of each Apptainer build."
+    ),
+    output_dir: Optional[Path] = typer.Option(
+        None,
+        help="Directory where the .sif files are stored, named after the job scripts. "
+        "Defaults to an output.sif file in each job script directory.",
+    ),
+    build_jobs: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="Maximum number of concurrent builds. Defaults to a value based on CPU count and free disk.",
+    ),
+    publish_jobs: int = typer.Option(4, min=1, help="Maximum number of images pushed concurrently."),
+    upload_jobs: int = typer.Option(
+        10, min=1, help="Maximum number of job scripts whose files are uploaded concurrently."
+    ),
+    share_layers: bool = typer.Option(
+        True, help="Pull the base images and build the layers shared by several job scripts first."
+    ),
+    buildkit_cache: bool = typer.Option(
+        False, help="Build with docker buildx, importing and exporting the layers to a local cache."
+    ),
+    backend: Optional[BuildBackend] = typer.Option(
+        None,
+        help="How images are handed over to Apptainer, overriding the build-backend of the metadata. "
+        "Defaults to docker-daemon.",
+    ),
+    compression: Optional[SifCompression] = typer.Option(
+        None, help="Compression of the SIF filesystem, overriding the sif-compression of the metadata."
+    ),
+    compression_level: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="Level of the SIF compression, overriding the sif-compression-level of the metadata.",
+    ),
+    catalog: bool = typer.Option(
+        True, help="Generate the catalog.yaml file once every job script is delivered."
+    ),
+    resume: bool = typer.Option(
+        False,
+        help="Skip the steps completed by the previous run of this command, as recorded in its journal, "
+        "and resume its interrupted uploads.",
+    ),
+    since: Optional[str] = typer.Option(
+        None,
+        help="Only deliver the artifacts of the job scripts that changed since this git reference, "
+        "such as a commit or a branch, and only update their catalog entries.",
+    ),
+    build_host: Optional[list[str]] = typer.Option(
+        None,
+        help="Build host, as DOCKER_HOST[,WORK_DIR[,SLOTS]], such as ssh://builder@10.0.0.5,/scratch,8. "
+        "May be repeated to distribute the builds across several hosts, scheduled by load.",
+    ),
+):
+    """Build and publish the image and the files of each job script, then generate the catalog.
+
+    Every job script goes through the stages as soon as the previous one is done, instead of
+    waiting for all the job scripts to finish a stage. The catalog is only generated when every
+    job script was delivered successfully. With --resume, the images and files published by the
+    previous run are not checked again. With --since, an image is only built and published if its
+    Dockerfile or build context changed, and the files are only published if they changed.
+    """
+    ctx_obj = ctx.obj
+    assert isinstance(ctx_obj, CliContext)
+    settings = ctx_obj.settings
+    assert settings is not None
+
+    explicit = job_scripts is not None
+    changed_kinds: dict[str, set[ChangeKind]] = {}
+    if since is not None:
+        changes = detect_job_script_changes(since, job_scripts)
+        changed_kinds = {name: change.kinds for (name, change) in changes.items() if not change.removed}
+        job_scripts = [Path(name) for (name, kinds) in changed_kinds.items() if kinds - {ChangeKind.CATALOG}]
+    job_scripts = find_job_scripts(job_scripts)
+    check_existing_paths(job_scripts)
+    check_metadata_exists(job_scripts)
+    host_pool = start_build_hosts(build_host, job_scripts, dry_run)
+    if build_jobs is None:
+        build_jobs = default_build_jobs() if host_pool is None else host_pool.capacity
+    size_docker_executor(build_jobs)
+    job_scripts = schedule_longest_first(job_scripts, ["build", "push"], build_jobs, dry_run)
+
+    aws = AwsClients(settings, max_pool_connections=publish_jobs + upload_jobs * settings.s3_max_concurrency)
+    journal = None if dry_run else RunJournal("pipeline-run", resume=resume)
+
+    async def deliver():
+        shared_stages = []
+        if share_layers:
+            shared_stages = await prepare_shared_layers(
+                job_scripts,
+                build_jobs,
+                dry_run,
+                not no_cache,
+                buildkit_cache,
+                compression,
+                compression_level,
+                None if host_pool is None else host_pool.docker_hosts,
+            )
+        # the semaphores must be created within the running event loop
+        stages = {
+            "build": asyncio.Semaphore(build_jobs),
+            "publish-image": asyncio.Semaphore(publish_jobs),
+            "publish-files": asyncio.Semaphore(upload_jobs),
+        }
+        tasks = {
+            job_script_path.name: run_job_pipeline(
+                job_script_path,
+                aws,
+                stages,
+                dry_run=dry_run,
+                force=force,
+                use_cache=not no_cache,
+                timeout=timeout,
+                output_dir=output_dir,
+                verbose=ctx_obj.verbose,
+                buildkit_cache=buildkit_cache,
+                shared_stages=shared_stages,
+                backend=backend,
+                compression=compression,
+                compression_level=compression_level,
+                journal=journal,
+                kinds=changed_kinds.get(job_script_path.name),
+                host_pool=host_pool,
+            )
+            for job_script_path in job_scripts
+        }
+        return await run_tasks_concurrently(tasks)
+
+    results = asyncio.run(deliver())
+    report_task_results(results, "Pipeline", footer=aws.transfer_stats.summary(), journal=journal)
+
+    if catalog:
+        catalog_path = Path("catalog.yaml")
+        only = {path.name for path in job_scripts} if explicit else None
+        if since is not None:
+            only = set(changes)
+        (_, diff, written) = generate_catalog(settings, catalog_path, only=only, dry_run=dry_run)
+        if written:
+            footer = f"Catalog file generated at {catalog_path}"
+        else:
+            footer = f"Catalog file {catalog_path} left untouched"
+        report_catalog_diff(diff, footer)
+    terminal_message("Delivered the job scripts successfully", "Process Complete")
@@ -0,0 +1,69 @@
+"""Command for pulling the Apptainer image of a job script into a cache shared by the cluster nodes."""
+
+import os
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from builder.cache import cache_dir
+from builder.exceptions import handle_abort
+from builder.schemas import CATALOG_URL, PullSettings
+
+
+@handle_abort
+def pull(
+    job_script: str = typer.Argument(..., help="Name of the job script whose image to pull."),
+    tag: Optional[str] = typer.Option(
+        None, help="Tag of the image. Defaults to the latest one, or to the first one of the job script."
+    ),
+    catalog: str = typer.Option(
+        CATALOG_URL,
+        envvar="VANTAGE_CATALOG",
+        help="Path or URL of the catalog resolving the images, or of the pointer to a published catalog.",
+    ),
+    image_cache_dir: Path = typer.Option(
+        cache_dir / "images",
+        "--cache-dir",
+        envvar="VANTAGE_IMAGE_CACHE_DIR",
+        help="Directory of the image cache, shared by the nodes of the cluster such as an NFS mount.",
+    ),
+    max_cache_size: float = typer.Option(
+        50.0,
+        min=0,
+        envvar="VANTAGE_IMAGE_CACHE_SIZE",
+        help="Size of the image cache, in GiB, beyond which the least recently used images are evicted.",
+    ),
+    jobs: int = typer.Option(
+        4,
+        "--jobs",
+        "-j",
+        min=1,
+        envvar="VANTAGE_PULL_JOBS",
+        help="Number of concurrent range requests downloading an image.",
+    ),
+    verify: bool = typer.Option(False, help="Check the digest of a cached image again before using it."),
+    link: Optional[Path] = typer.Option(
+        None, help="Also point this symbolic link at the pulled image, replacing it atomically."
+    ),
+):
+    """Pull the Apptainer image of a job script into the image cache and print its path.
+
+    The image is resolved from the catalog to the digest of its SIF file, which names it in the
+    cache. Concurrent pulls of the same image, including from other nodes sharing the cache
+    directory, download it once, and every download is checked against its digest. The path is
+    the only output, so jobs can run APPTAINER_IMAGE=$(builder pull hpl-benchmark).
+    """
+    from builder.image_cache import load_catalog_source, pull_image, select_image_url
+
+    settings = PullSettings(
+        cache_dir=image_cache_dir, max_cache_size=int(max_cache_size * 1024**3), jobs=jobs
+    )
+    url = select_image_url(load_catalog_source(catalog, settings), Path(job_script).name, tag)
+    path = pull_image(url, settings, verify)
+    if link is not None:
+        partial_link = link.with_name(f".{link.name}.{os.getpid()}.partial")
+        partial_link.unlink(missing_ok=True)
+        partial_link.symlink_to(path)
+        partial_link.replace(link)
+    typer.echo(path)
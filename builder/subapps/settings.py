@@ -20,6 +20,34 @@ def set_config(
     aws_session_token: str = typer.Option(None, help="The session token used by authenticating against AWS"),
     s3_bucket: str = typer.Option(..., help="The S3 bucket where job scripts will be uploaded to"),
     s3_bucket_region: str = typer.Option(..., help="The region of the S3 bucket"),
+    oci_registry: str = typer.Option(
+        None,
+        help=(
+            "The OCI registry, including the namespace, where images will be published to instead of "
+            "ECR Public, e.g. localhost:5000/vantage"
+        ),
+    ),
+    oci_registry_plain_http: bool = typer.Option(
+        False, help="Talk to the OCI registry over plain HTTP, which is useful for local registries"
+    ),
+    s3_multipart_threshold: int = typer.Option(
+        8, min=5, help="The size, in MiB, from which files are uploaded to S3 in multiple parts"
+    ),
+    s3_multipart_chunksize: int = typer.Option(
+        8, min=5, help="The size, in MiB, of each part of a multipart upload to S3"
+    ),
+    s3_max_concurrency: int = typer.Option(
+        10, min=1, help="The maximum number of threads transferring the parts of a single file to S3"
+    ),
+    max_attempts: int = typer.Option(
+        5, min=1, help="The number of attempts of each AWS and registry call failing with a transient error"
+    ),
+    retry_base_delay: float = typer.Option(
+        1.0, min=0, help="The delay, in seconds, from which the backoff between two attempts grows"
+    ),
+    retry_max_delay: float = typer.Option(
+        30.0, min=0, help="The maximum delay, in seconds, between two attempts"
+    ),
 ):
     """Set the configuration for the CLI."""
     settings = init_settings(
@@ -28,6 +56,14 @@ def set_config(
         aws_session_token=aws_session_token,
         s3_bucket=s3_bucket,
         s3_bucket_region=s3_bucket_region,
+        oci_registry=oci_registry,
+        oci_registry_plain_http=oci_registry_plain_http,
+        s3_multipart_threshold=s3_multipart_threshold,
+        s3_multipart_chunksize=s3_multipart_chunksize,
+        s3_max_concurrency=s3_max_concurrency,
+        max_attempts=max_attempts,
+        retry_base_delay=retry_base_delay,
+        retry_max_delay=retry_max_delay,
     )
     dump_settings(settings)
 
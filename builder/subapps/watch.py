@@ -0,0 +1,145 @@
+"""Command for rebuilding the job scripts incrementally while they are being edited."""
+
+import asyncio
+from pathlib import Path
+from typing import Annotated, Optional
+
+import typer
+from loguru import logger
+from rich.markup import escape
+
+from builder.aws import AwsClients
+from builder.build_hosts import size_docker_executor
+from builder.cache import init_cache
+from builder.config import Settings, attach_settings
+from builder.context import CliContext
+from builder.exceptions import Abort, handle_abort
+from builder.format import terminal_message
+from builder.schemas import ChangeKind, JobScriptChange
+from builder.subapps.helpers import (
+    check_existing_paths,
+    classify_watched_changes,
+    find_job_scripts,
+    generate_catalog,
+    refresh_job_script,
+    report_catalog_diff,
+    report_task_results,
+    run_tasks_concurrently,
+    snapshot_metadata,
+)
+from builder.watcher import open_watcher, wait_for_changes
+
+
+def refresh(
+    job_scripts: list[Path],
+    changes: dict[str, JobScriptChange],
+    settings: Settings,
+    aws: AwsClients | None,
+    catalog: bool,
+    timeout: float | None,
+    output_dir: Path | None,
+    verbose: bool,
+):
+    """Rerun the minimal steps for the changed job scripts, then refresh their catalog entries."""
+    tasks = {
+        path.name: refresh_job_script(path, changes[path.name], aws, timeout, output_dir, verbose)
+        for path in job_scripts
+        if path.name in changes
+        and not changes[path.name].removed
+        and changes[path.name].kinds - {ChangeKind.CATALOG}
+    }
+    if tasks:
+        results = asyncio.run(run_tasks_concurrently(tasks))
+        report_task_results(results, "Refresh", count_outcomes=True)
+    entries = {name for (name, change) in changes.items() if ChangeKind.CATALOG in change.kinds}
+    if catalog and entries:
+        catalog_path = Path("catalog.yaml")
+        (_, diff, written) = generate_catalog(settings, catalog_path, only=entries)
+        footer = f"Catalog file {'generated at' if written else 'left untouched at'} {catalog_path}"
+        report_catalog_diff(diff, footer)
+
+
+@handle_abort
+@init_cache
+@attach_settings
+def watch(
+    ctx: typer.Context,
+    job_scripts: Annotated[
+        Optional[list[Path]],
+        typer.Argument(
+            ..., help="Paths of the job scripts to watch. If None, all job scripts will be watched."
+        ),
+    ] = None,
+    debounce: float = typer.Option(
+        0.5,
+        min=0,
+        help="Seconds without any change to wait for before rebuilding, gathering bursts of edits.",
+    ),
+    polling: bool = typer.Option(
+        False, help="Compare the modification times of the files every interval instead of using inotify."
+    ),
+    poll_interval: float = typer.Option(
+        1.0, min=0.1, help="Seconds between two scans of the files when polling."
+    ),
+    publish: bool = typer.Option(
+        False, help="Also publish the rebuilt images and the changed files, keeping the AWS clients warm."
+    ),
+    catalog: bool = typer.Option(
+        True, help="Refresh the entries of the changed job scripts in catalog.yaml."
+    ),
+    timeout: Optional[float] = typer.Option(
+        None, min=1, help="Maximum duration, in seconds, of each Apptainer build."
+    ),
+    output_dir: Optional[Path] = typer.Option(
+        None,
+        help="Directory where the .sif files are stored, named after the job scripts. "
+        "Defaults to an output.sif file in each job script directory.",
+    ),
+):
+    """Watch the job scripts and rerun the minimal steps whenever they change, until interrupted.
+
+    A change to the Dockerfile or its build context rebuilds the image, while a change to the
+    README.md file only refreshes the catalog entry, and a change to the entrypoint or the
+    supporting files needs no step unless publishing. The Docker and AWS clients are kept between
+    the iterations, and a failing iteration is reported without stopping the watch.
+    """
+    ctx_obj = ctx.obj
+    assert isinstance(ctx_obj, CliContext)
+    settings = ctx_obj.settings
+    assert settings is not None
+
+    job_scripts = find_job_scripts(job_scripts)
+    check_existing_paths(job_scripts)
+    snapshots = snapshot_metadata(job_scripts)
+    size_docker_executor(len(job_scripts))
+    aws = AwsClients(settings) if publish else None
+    watcher = open_watcher(job_scripts, poll_interval, polling)
+    terminal_message(
+        f"Watching {len(job_scripts)} job scripts for changes. Press Ctrl+C to stop.", "Watching"
+    )
+    try:
+        while True:
+            paths = wait_for_changes(watcher, debounce)
+            try:
+                changes = classify_watched_changes(paths, job_scripts, snapshots)
+                if not changes:
+                    continue
+                lines = [
+                    f"{name}: " + ("removed" if change.removed else ", ".join(sorted(change.kinds)))
+                    for (name, change) in changes.items()
+                ]
+                terminal_message("\n".join(lines), "Changes detected", indent=False)
+                refresh(job_scripts, changes, settings, aws, catalog, timeout, output_dir, ctx_obj.verbose)
+            except Abort as err:
+                terminal_message(err.message, err.subject, color="red", indent=False)
+            except Exception as err:
+                # files caught in the middle of an edit, such as a half-written metadata.yaml file or
+                # Dockerfile, fail with parsing or validation errors that must not stop the watch
+                logger.debug(f"Refresh failed: {err!r}")
+                terminal_message(
+                    escape(str(err)), f"Refresh failed: {type(err).__name__}", color="red", indent=False
+                )
+    except KeyboardInterrupt:
+        terminal_message("Stopped watching the job scripts", "Process Complete")
+    finally:
+        watcher.close()
@@ -1,41 +1,104 @@
 """Core module for bash command related operations."""
 
+import asyncio
+import os
+import re
 import shlex
 import subprocess
+from collections import deque
+from typing import IO
 
 from loguru import logger
 
+# number of output lines kept in memory for each stream of a subprocess
+OUTPUT_TAIL_LINES = 100
 
-def run_command(command) -> tuple[str | None, str | None]:
-    """Run a command and return the stdout and stderr."""
+# size of the chunks read from the streams of a subprocess
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def run_command(command) -> tuple[int, str, str]:
+    """Run a command and return its exit code, stdout and stderr."""
     proc = subprocess.run(shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     (stdout, stderr) = (proc.stdout.decode(), proc.stderr.decode())
-    return (stdout, stderr)
+    return (proc.returncode, stdout, stderr)
+
 
+async def _drain_stream(stream: asyncio.StreamReader, label: str, tail: deque[str]):
+    """Log every line read from a subprocess stream, keeping the last ones in a bounded buffer."""
+    pending = b""
+    while chunk := await stream.read(STREAM_CHUNK_SIZE):
+        # progress bars rewrite the same line using carriage returns
+        (*lines, pending) = re.split(rb"[\r\n]", pending + chunk)
+        if len(pending) > STREAM_CHUNK_SIZE:
+            (lines, pending) = ([*lines, pending], b"")
+        for line in lines:
+            decoded = line.decode(errors="replace").rstrip()
+            if decoded:
+                tail.append(decoded)
+                logger.debug(f"Subprocess {label} => {decoded}")
+    if decoded := pending.decode(errors="replace").rstrip():
+        tail.append(decoded)
+        logger.debug(f"Subprocess {label} => {decoded}")
 
-def run_command_logged(command):
+
+async def run_command_logged(
+    command: str,
+    timeout: float | None = None,
+    tail_lines: int = OUTPUT_TAIL_LINES,
+    env: dict[str, str] | None = None,
+    stdin: IO[bytes] | None = None,
+) -> tuple[list[str], list[str]]:
     """Execute a shell command while logging its output and errors.
 
-    This function runs a given shell command as a subprocess, captures its
-    standard output and standard error streams, and logs the output in real-time.
-    If the subprocess returns a non-zero exit code, a RuntimeError is raised with
-    the last line of the error output.
+    This function runs a given shell command as an asyncio subprocess and streams both its
+    standard output and standard error concurrently, so neither pipe can fill up and block the
+    subprocess. Only the last tail_lines lines of each stream are kept in memory, and they are
+    returned once the subprocess finishes. The standard input is read from the stdin file, if any.
+
+    If the subprocess does not finish within timeout seconds, or if the calling task is cancelled,
+    the subprocess is killed. If the subprocess returns a non-zero exit code or times out, a
+    RuntimeError is raised with the last lines of the error output.
     """
     logger.debug(f"Issuing subprocess {command=}")
-    proc = subprocess.Popen(
-        shlex.split(command),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+    args = shlex.split(command)
+    proc_name = args[0]
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=stdin,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=None if env is None else {**os.environ, **env},
+    )
+    assert proc.stdout is not None and proc.stderr is not None
+    (stdout, stderr) = (deque[str](maxlen=tail_lines), deque[str](maxlen=tail_lines))
+    drainers = asyncio.gather(
+        _drain_stream(proc.stdout, f"{proc_name}[{proc.pid}]", stdout),
+        _drain_stream(proc.stderr, f"{proc_name}[{proc.pid}]", stderr),
+        proc.wait(),
     )
-    proc_name = proc.args[0]
-    last_err_line = ""
-    while proc.poll() is None:
-        while True:
-            stderr_line = proc.stderr.readline().decode()
-            if stderr_line:
-                last_err_line = stderr_line
-                logger.debug(f"Subprocess {proc_name} => {stderr_line}")
-            else:
-                break
+    try:
+        await asyncio.wait_for(drainers, timeout=timeout)
+    except TimeoutError:
+        await _kill(proc)
+        raise RuntimeError(f"Subprocess {proc_name} timed out after {timeout}s: {_last_lines(stderr)}")
+    except asyncio.CancelledError:
+        logger.debug(f"Killing subprocess {proc_name}[{proc.pid}] upon cancellation")
+        await _kill(proc)
+        raise
+
     if proc.returncode != 0:
-        raise RuntimeError(f"Subprocess {proc_name} error: {last_err_line}")
+        raise RuntimeError(f"Subprocess {proc_name} error: {_last_lines(stderr)}")
+    return (list(stdout), list(stderr))
+
+
+async def _kill(proc: asyncio.subprocess.Process):
+    """Kill a subprocess and reap it."""
+    if proc.returncode is None:
+        proc.kill()
+        await proc.wait()
+
+
+def _last_lines(lines: deque[str], count: int = 5) -> str:
+    """Join the last lines of a subprocess stream."""
+    return "\n".join(list(lines)[-count:])
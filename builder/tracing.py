@@ -0,0 +1,131 @@
+"""Core module for timing the phases of the builder commands and reporting them."""
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+from loguru import logger
+
+from builder.schemas import TraceSpan
+
+
+class Tracer:
+    """Collector of the spans recorded while running a command.
+
+    Spans are recorded from the event loop as well as from worker threads, so they are appended
+    under a lock. Their start is relative to the creation of the tracer.
+    """
+
+    def __init__(self) -> None:  # noqa: D107
+        self._lock = threading.Lock()
+        self.spans: list[TraceSpan] = []
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+
+    def record(self, span: TraceSpan):
+        """Record a finished span."""
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, job: str, phase: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+        """Time the enclosed block as a phase of a job script.
+
+        The attributes are yielded, so the block can add the bytes transferred or the decisions
+        taken once they are known. A failing block is recorded along with its error.
+        """
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except BaseException as err:
+            error = f"{type(err).__name__}: {err}"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.record(
+                TraceSpan(
+                    job=job,
+                    phase=phase,
+                    start=start - self._origin,
+                    duration=duration,
+                    thread=threading.get_ident(),
+                    attributes=attributes,
+                    error=error,
+                )
+            )
+            logger.debug(f"Phase {phase} of {job} took {duration:.3f}s")
+
+    def summarize(self) -> dict[str, Any]:
+        """Aggregate the spans per job script and per phase."""
+        jobs: dict[str, dict[str, Any]] = {}
+        for span in self.spans:
+            job = jobs.setdefault(span.job, {"phases": {}})
+            phase = job["phases"].setdefault(
+                span.phase, {"count": 0, "duration": 0.0, "bytes": 0, "errors": 0}
+            )
+            phase["count"] += 1
+            phase["duration"] += span.duration
+            phase["bytes"] += span.attributes.get("bytes", 0)
+            # failed tasks are caught by the task runner, so their error is an attribute
+            phase["errors"] += span.error is not None or span.attributes.get("error") is not None
+        return jobs
+
+    def build_report(self) -> dict[str, Any]:
+        """Return the run report, with the aggregated phases and every recorded span."""
+        return {
+            "command": sys.argv[1:],
+            "started_at": datetime.fromtimestamp(self.started_at, tz=timezone.utc).isoformat(),
+            "duration": time.perf_counter() - self._origin,
+            "jobs": self.summarize(),
+            "spans": [
+                span.model_dump(mode="json") for span in sorted(self.spans, key=lambda span: span.start)
+            ],
+        }
+
+    def build_chrome_trace(self) -> dict[str, Any]:
+        """Return the spans in the Chrome trace event format, which Perfetto also reads.
+
+        Each job script is shown as its own track, since their phases interleave across threads.
+        """
+        tracks = {job: index for (index, job) in enumerate(dict.fromkeys(span.job for span in self.spans))}
+        events: list[dict[str, Any]] = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": job}}
+            for (job, tid) in tracks.items()
+        ]
+        for span in self.spans:
+            args = dict(span.attributes)
+            if span.error is not None:
+                args["error"] = span.error
+            events.append(
+                {
+                    "name": span.phase,
+                    "cat": "builder",
+                    "ph": "X",
+                    "ts": span.start * 1e6,
+                    "dur": span.duration * 1e6,
+                    "pid": 1,
+                    "tid": tracks[span.job],
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_report(self, path: Path):
+        """Write the run report as JSON."""
+        path.write_text(json.dumps(self.build_report(), indent=2, default=str))
+        logger.debug(f"Wrote the run report to {path}")
+
+    def write_chrome_trace(self, path: Path):
+        """Write the spans as a Chrome trace, to be opened in Perfetto or chrome://tracing."""
+        path.write_text(json.dumps(self.build_chrome_trace(), default=str))
+        logger.debug(f"Wrote the Chrome trace to {path}")
+
+
+# spans of the running command, shared by all the helpers
+tracer = Tracer()
@@ -0,0 +1,206 @@
+"""Core module for watching the job script directories for changes.
+
+On Linux, the changes are reported by inotify, bound through ctypes since the standard library has
+no binding for it. Elsewhere, or when inotify is not available, the modification times and sizes
+of the files are compared every interval instead. Bursts of events, such as an editor saving a
+file through a temporary one, are gathered until the directories stay quiet for a debounce delay.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Protocol
+
+from loguru import logger
+
+# events of inotify, from sys/inotify.h
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# events meaning that a file holds new content or is gone, leaving out the writes in progress
+WATCHED_EVENTS = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+)
+
+# header of an inotify event: watch descriptor, mask, cookie and length of the name that follows
+EVENT_HEADER = struct.Struct("iIII")
+
+# size of the buffer the inotify events are read into
+EVENT_BUFFER_SIZE = 64 * 1024
+
+# suffixes of the temporary files of editors, which never affect the artifacts
+IGNORED_SUFFIXES = ("~", ".swp", ".swx", ".tmp", ".partial")
+
+
+def is_ignored(path: Path) -> bool:
+    """Check if a changed path is a hidden or temporary file, such as the backups of an editor."""
+    return path.name.startswith(".") or path.name.endswith(IGNORED_SUFFIXES)
+
+
+def walk_files(directory: Path) -> list[Path]:
+    """Return the files under a directory, leaving out the hidden and temporary ones."""
+    files: list[Path] = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        files.extend(Path(dirpath, name) for name in filenames)
+    return [path for path in files if not is_ignored(path)]
+
+
+class Watcher(Protocol):
+    """Source of the paths changed under some directories."""
+
+    def read(self, timeout: float | None) -> set[Path]:
+        """Return the paths changed since the previous call, waiting at most timeout seconds for one."""
+        ...
+
+    def close(self):
+        """Release the resources of the watcher."""
+        ...
+
+
+class InotifyWatcher:
+    """Watcher of directory trees backed by inotify.
+
+    A watch is added to every directory of the trees, including the ones created later, whose files
+    are reported as changed since they may have been written before their watch was added. When
+    the event queue overflows, every file of the trees is reported.
+    """
+
+    def __init__(self, roots: list[Path]):  # noqa: D107
+        self.roots = roots
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self._directories: dict[int, Path] = {}
+        for root in roots:
+            self._add_tree(root)
+        logger.debug(f"Watching {len(self._directories)} directories with inotify")
+
+    def _add_watch(self, directory: Path):
+        """Add a watch to a directory, which may already be gone."""
+        descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCHED_EVENTS)
+        if descriptor < 0:
+            logger.debug(f"Could not watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return
+        self._directories[descriptor] = directory
+
+    def _add_tree(self, directory: Path):
+        """Add a watch to a directory and to each of its subdirectories, leaving out the hidden ones."""
+        for dirpath, dirnames, _ in os.walk(directory):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            self._add_watch(Path(dirpath))
+
+    def _parse(self, buffer: bytes) -> set[Path]:
+        """Return the paths changed by a buffer of inotify events, watching the new directories."""
+        changed: set[Path] = set()
+        offset = 0
+        while offset < len(buffer):
+            (descriptor, mask, _, length) = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("The inotify event queue overflowed, considering every file as changed")
+                changed.update(path for root in self.roots for path in walk_files(root))
+                continue
+            if mask & IN_IGNORED:
+                self._directories.pop(descriptor, None)
+                continue
+            directory = self._directories.get(descriptor)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+                changed.update(walk_files(path))
+            changed.add(path)
+        return changed
+
+    def read(self, timeout: float | None) -> set[Path]:  # noqa: D102
+        (readable, _, _) = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            buffer = os.read(self._fd, EVENT_BUFFER_SIZE)
+        except BlockingIOError:
+            return set()
+        return {path for path in self._parse(buffer) if not is_ignored(path)}
+
+    def close(self):  # noqa: D102
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Watcher of directory trees comparing the modification time and size of their files every interval."""
+
+    def __init__(self, roots: list[Path], interval: float = 1.0):  # noqa: D107
+        self.roots = roots
+        self.interval = interval
+        self._snapshot = self._scan()
+        logger.debug(f"Polling {len(self._snapshot)} files every {interval}s")
+
+    def _scan(self) -> dict[Path, tuple[int, int]]:
+        """Return the modification time and size of every file of the trees."""
+        snapshot = {}
+        for path in (path for root in self.roots for path in walk_files(root)):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read(self, timeout: float | None) -> set[Path]:  # noqa: D102
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {
+                path
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return set()
+            time.sleep(self.interval if remaining is None else min(self.interval, remaining))
+
+    def close(self):  # noqa: D102
+        pass
+
+
+def open_watcher(roots: list[Path], poll_interval: float = 1.0, polling: bool = False) -> Watcher:
+    """Return an inotify watcher of the directory trees, or a polling one if inotify is not available."""
+    if not polling:
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as err:
+            logger.warning(f"inotify is not available, polling the files instead: {err}")
+    return PollingWatcher(roots, poll_interval)
+
+
+def wait_for_changes(watcher: Watcher, debounce: float) -> set[Path]:
+    """Wait for changes, then gather the following ones until none happens for debounce seconds."""
+    changed = watcher.read(None)
+    while more := watcher.read(debounce):
+        changed |= more
+    return changed
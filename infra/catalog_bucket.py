@@ -24,6 +24,10 @@ class ArtifactBucket(Stack):
             "ArtifactBucket",
             bucket_name="vantage-compute-jobs-catalog-artifacts",
             removal_policy=cdk.RemovalPolicy.RETAIN,
+            # multipart uploads left behind by runs that were not resumed
+            lifecycle_rules=[
+                s3.LifecycleRule(abort_incomplete_multipart_upload_after=cdk.Duration.days(7)),
+            ],
             block_public_access=s3.BlockPublicAccess(
                 block_public_acls=True,
                 block_public_policy=False,
@@ -1,5 +1,7 @@
 """Website infrastructure for the Vantage Jobs Catalog."""
 
+import os
+
 import aws_cdk as cdk
 import yaml
 from aws_cdk import App, Stack
@@ -10,6 +12,21 @@ from aws_cdk import aws_route53_targets as targets
 from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_s3_deployment as s3_deploy
 
+# directory written by `builder catalog generate --publish-dir`
+CATALOG_PUBLISH_DIR = "catalog-dist"
+
+# short-lived file naming the current content-hashed catalog
+CATALOG_POINTER = "catalog-latest.json"
+
+# content-hashed catalog, index of the sharded catalog and detail documents of the job scripts
+CATALOG_ARTIFACT_PATTERNS = ["catalog.*.json", "catalog-index.*.json", "jobs/*.json"]
+
+# lifetime of the files that change on every deploy, which CloudFront and clients revalidate often
+SHORT_TTL = cdk.Duration.seconds(60)
+
+# lifetime of the content-hashed catalogs, which never change once published
+IMMUTABLE_TTL = cdk.Duration.days(365)
+
 
 class WebsiteStack(Stack):
     """Stack for the Vantage Jobs Catalog website."""
@@ -63,9 +80,11 @@ class WebsiteStack(Stack):
                     behaviors=[
                         cloudfront.Behavior(
                             is_default_behavior=True,
-                            max_ttl=cdk.Duration.seconds(0),
+                            # the Cache-Control header of each object sets its lifetime
                             min_ttl=cdk.Duration.seconds(0),
-                            default_ttl=cdk.Duration.seconds(0),
+                            default_ttl=SHORT_TTL,
+                            max_ttl=IMMUTABLE_TTL,
+                            compress=True,
                         )
                     ],
                     s3_origin_source=cloudfront.S3OriginConfig(
@@ -103,12 +122,74 @@ class WebsiteStack(Stack):
         with open("catalog.yaml", "r") as f:
             catalog_content = yaml.safe_load(f)
 
+        short_cache_control = [
+            s3_deploy.CacheControl.set_public(),
+            s3_deploy.CacheControl.max_age(SHORT_TTL),
+        ]
+        immutable_cache_control = [
+            s3_deploy.CacheControl.set_public(),
+            s3_deploy.CacheControl.max_age(IMMUTABLE_TTL),
+            s3_deploy.CacheControl.from_string("immutable"),
+        ]
+
+        # none of the deployments prune, so they do not delete each other's files, and the
+        # content-hashed catalogs stay available to clients holding an older pointer
         s3_deploy.BucketDeployment(
             self,
             "BucketDeployment",
             sources=[s3_deploy.Source.yaml_data("catalog.yaml", catalog_content)],
             destination_bucket=bucket,
             distribution=distribution,
+            distribution_paths=["/catalog.yaml"],
             memory_limit=128,
             content_type="text/yaml",
+            cache_control=short_cache_control,
+            prune=False,
+        )
+
+        # the content-hashed documents are uploaded once, each variant with its content encoding,
+        # before the pointer is switched over to them
+        if not os.path.isdir(CATALOG_PUBLISH_DIR):
+            raise FileNotFoundError(
+                f"The {CATALOG_PUBLISH_DIR} directory does not exist, write it with "
+                f"`builder catalog generate --publish-dir {CATALOG_PUBLISH_DIR}` before deploying"
+            )
+        catalog_source = s3_deploy.Source.asset(CATALOG_PUBLISH_DIR)
+        variants = {
+            "CatalogJsonDeployment": ("", None),
+            "CatalogGzipDeployment": (".gz", "gzip"),
+            "CatalogBrotliDeployment": (".br", "br"),
+        }
+        variant_deployments = [
+            s3_deploy.BucketDeployment(
+                self,
+                deployment_id,
+                sources=[catalog_source],
+                destination_bucket=bucket,
+                exclude=["*"],
+                include=[f"{pattern}{suffix}" for pattern in CATALOG_ARTIFACT_PATTERNS],
+                memory_limit=128,
+                content_type="application/json",
+                content_encoding=content_encoding,
+                cache_control=immutable_cache_control,
+                prune=False,
+            )
+            for (deployment_id, (suffix, content_encoding)) in variants.items()
+        ]
+
+        pointer_deployment = s3_deploy.BucketDeployment(
+            self,
+            "CatalogPointerDeployment",
+            sources=[catalog_source],
+            destination_bucket=bucket,
+            distribution=distribution,
+            distribution_paths=[f"/{CATALOG_POINTER}"],
+            exclude=["*"],
+            include=[CATALOG_POINTER],
+            memory_limit=128,
+            content_type="application/json",
+            cache_control=short_cache_control,
+            prune=False,
         )
+        for variant_deployment in variant_deployments:
+            pointer_deployment.node.add_dependency(variant_deployment)